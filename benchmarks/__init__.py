@@ -0,0 +1,3 @@
+"""
+Performance benchmarks for FlowUtils, see run_benchmarks.py
+"""
@@ -0,0 +1,263 @@
+"""
+Runs the benchmark suite, reporting the throughput (events per second) & the
+peak memory allocated by each benchmarked function, and compares the results
+to a stored baseline.
+
+Usage:
+
+    python run_benchmarks.py [--sizes 10000 100000 1000000] [--filter gating.]
+        [--save benchmarks/baseline.json] [--compare benchmarks/baseline.json]
+
+The timings use the best of several repeats (see `--repeat`), where each
+repeat calls the function as many times as needed to run for at least 0.2
+seconds. The peak memory is measured with tracemalloc in a separate call, so
+tracing does not affect the timings. It includes the memory allocated by NumPy
+& the C extensions for the returned arrays & any temporary arrays, but not
+the input data.
+
+Baselines are specific to a machine, save a baseline before a change and
+compare after it on the same machine.
+"""
+import argparse
+import fnmatch
+import gc
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+import flowutils
+from .suite import BENCHMARKS
+
+
+DEFAULT_SIZES = [10 ** 4, 10 ** 5, 10 ** 6]
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# relative change from the baseline reported as a regression
+DEFAULT_THRESHOLD = 0.25
+
+
+def result_key(benchmark, params, event_count):
+    """
+    Identifies a result in a baseline, e.g. 'gating.points_in_polygon[vertices=4,output=mask]@10000'
+    """
+    key = benchmark.name
+    if len(params) > 0:
+        key += '[%s]' % ','.join('%s=%s' % (name, value) for name, value in params.items())
+    if event_count is not None:
+        key += '@%d' % event_count
+
+    return key
+
+
+def time_function(func, repeat):
+    """
+    Returns the best time, in seconds, of a single call to the function
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def peak_memory(func):
+    """
+    Returns the peak memory, in bytes, allocated while calling the function
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+
+def run_benchmark(benchmark, params, event_count, repeat):
+    """
+    Sets up & runs a benchmark for one combination of parameters
+
+    :return: dict of results: seconds per call, events (or calls) per second & peak memory in bytes
+    """
+    func = benchmark.setup(1 if event_count is None else event_count, **params)
+    seconds = time_function(func, repeat)
+    peak = peak_memory(func)
+
+    rate = (1 if event_count is None else event_count) / seconds
+
+    return {'seconds': seconds, 'rate': rate, 'peak_memory': peak}
+
+
+def run_suite(benchmarks, sizes, repeat, report=None):
+    """
+    Runs the benchmarks for every event count & parameter combination
+
+    :param benchmarks: list of Benchmark instances
+    :param sizes: list of event counts
+    :param repeat: number of timings per benchmark (the best is reported)
+    :param report: Optional function called with (key, result) as each benchmark completes
+
+    :return: dict of result keys to result dicts
+    """
+    results = {}
+    for benchmark in benchmarks:
+        event_counts = sizes if benchmark.per_event else [None]
+
+        for event_count in event_counts:
+            if benchmark.max_events is not None and event_count is not None and event_count > benchmark.max_events:
+                continue
+
+            for params in benchmark.param_combinations():
+                key = result_key(benchmark, params, event_count)
+                results[key] = run_benchmark(benchmark, params, event_count, repeat)
+                if report is not None:
+                    report(key, results[key])
+
+    return results
+
+
+def machine_info():
+    """
+    :return: dict describing the machine & software versions the benchmarks ran with
+    """
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'flowutils': flowutils.__version__,
+    }
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump({'machine': machine_info(), 'results': results}, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(results, baseline_results, threshold):
+    """
+    Compares results to baseline results of the same benchmarks
+
+    :param results: dict of result keys to result dicts, from `run_suite`
+    :param baseline_results: dict of result keys to result dicts, from a saved baseline
+    :param threshold: relative change reported as a regression, e.g. 0.25 for
+        25% fewer events per second or 25% more peak memory
+
+    :return: list of (key, rate ratio, memory ratio, regressed) tuples for the
+        results found in the baseline, ratios are current / baseline
+    """
+    comparison = []
+    for key, result in results.items():
+        if key not in baseline_results:
+            continue
+
+        baseline = baseline_results[key]
+        rate_ratio = result['rate'] / baseline['rate']
+        if baseline['peak_memory'] > 0:
+            memory_ratio = result['peak_memory'] / baseline['peak_memory']
+        else:
+            memory_ratio = 1.0 if result['peak_memory'] == 0 else float('inf')
+
+        # small allocations (e.g. Python objects) vary between runs, only report memory
+        # regressions larger than a megabyte
+        memory_regressed = memory_ratio > 1 + threshold and result['peak_memory'] - baseline['peak_memory'] > 2 ** 20
+        regressed = rate_ratio < 1 - threshold or memory_regressed
+
+        comparison.append((key, rate_ratio, memory_ratio, regressed))
+
+    return comparison
+
+
+def _format_memory(byte_count):
+    for unit in ('B', 'KB', 'MB'):
+        if byte_count < 1024:
+            return '%.0f %s' % (byte_count, unit)
+        byte_count /= 1024.0
+
+    return '%.1f GB' % byte_count
+
+
+def _print_result(key, result):
+    print('%-72s %12.3g %16.0f %10s' % (key, result['seconds'], result['rate'], _format_memory(result['peak_memory'])))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+        help='event counts to benchmark, e.g. 10000 100000 1000000 10000000 100000000'
+    )
+    parser.add_argument(
+        '--filter', nargs='+', default=None,
+        help='only run benchmarks whose name contains one of the given strings or matches a glob pattern'
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='number of timings per benchmark (the best is reported)')
+    parser.add_argument('--save', metavar='PATH', help='save the results as a baseline JSON file')
+    parser.add_argument(
+        '--compare', metavar='PATH', nargs='?', const=DEFAULT_BASELINE_PATH,
+        help='compare the results to a baseline JSON file (default: %s)' % DEFAULT_BASELINE_PATH
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='relative change reported as a regression (default: %.2f)' % DEFAULT_THRESHOLD
+    )
+    parser.add_argument('--list', action='store_true', help='list the benchmarks and exit')
+    args = parser.parse_args(argv)
+
+    benchmarks = BENCHMARKS
+    if args.filter is not None:
+        benchmarks = [
+            b for b in benchmarks
+            if any(pattern in b.name or fnmatch.fnmatch(b.name, pattern) for pattern in args.filter)
+        ]
+
+    if args.list:
+        for benchmark in benchmarks:
+            print(benchmark.name)
+        return 0
+
+    baseline = None
+    if args.compare is not None:
+        baseline = load_baseline(args.compare)
+
+    print('%-72s %12s %16s %10s' % ('benchmark', 'seconds', 'events/sec', 'peak mem'))
+    results = run_suite(benchmarks, args.sizes, args.repeat, report=_print_result)
+
+    if args.save is not None:
+        save_baseline(args.save, results)
+        print('\nSaved %d results to %s' % (len(results), args.save))
+
+    if baseline is None:
+        return 0
+
+    comparison = compare_results(results, baseline['results'], args.threshold)
+    print('\nCompared to %s (%s):' % (args.compare, baseline['machine']['platform']))
+    if baseline['machine'] != machine_info():
+        print('Note: the baseline was saved on a different machine or with different software versions')
+    print('%-72s %12s %10s' % ('benchmark', 'events/sec', 'peak mem'))
+
+    regression_count = 0
+    for key, rate_ratio, memory_ratio, regressed in comparison:
+        regression_count += regressed
+        print('%-72s %11.2fx %9.2fx%s' % (key, rate_ratio, memory_ratio, '  REGRESSION' if regressed else ''))
+
+    print(
+        '\n%d of %d results in the baseline, %d regressions'
+        % (len(comparison), len(results), regression_count)
+    )
+
+    return 1 if regression_count > 0 else 0
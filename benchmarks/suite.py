@@ -0,0 +1,501 @@
+"""
+Benchmarks of the public functions in the transforms, gating & compensate
+modules, run on synthetic event data.
+
+Each benchmark has a setup function called with the event count and one
+combination of the benchmark's parameters. The setup function prepares the
+input data (not timed) and returns the function to time, taking no arguments.
+"""
+import itertools
+
+import numpy as np
+
+from flowutils import compensate, gating, pipeline, transforms
+
+
+class Benchmark(object):
+    """
+    A benchmark of a single function
+
+    :param name: benchmark name, e.g. 'transforms.logicle'
+    :param setup: function taking (event_count, **params), returning the function to time
+    :param params: Optional dict of parameter names to the list of values to benchmark, every
+        combination of the values is benchmarked
+    :param per_event: If False, the timed function does not depend on the event count (e.g.
+        parsing a compensation matrix) and is benchmarked once, in calls per second
+    :param max_events: Optional largest event count benchmarked, for slow benchmarks
+    """
+    def __init__(self, name, setup, params=None, per_event=True, max_events=None):
+        self.name = name
+        self.setup = setup
+        self.params = {} if params is None else params
+        self.per_event = per_event
+        self.max_events = max_events
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.name)
+
+    def param_combinations(self):
+        """
+        :return: list of dicts, one for each combination of the parameter values
+        """
+        names = list(self.params)
+        return [dict(zip(names, values)) for values in itertools.product(*self.params.values())]
+
+
+def make_events(event_count, channel_count, dtype=np.float64, seed=1):
+    """
+    Simulates fluorescence channels: mostly positive events, with a spread
+    of negative events from compensation.
+    """
+    rng = np.random.default_rng(seed)
+    events = rng.lognormal(mean=7.0, sigma=2.0, size=(event_count, channel_count))
+    events -= rng.normal(loc=200.0, scale=300.0, size=(event_count, channel_count))
+
+    return events.astype(dtype)
+
+
+def make_points(event_count, dim_count, dtype=np.float64, seed=1):
+    """
+    Normally distributed points centered on the origin, so the benchmark
+    gates contain a portion of the points.
+    """
+    rng = np.random.default_rng(seed)
+    points = rng.normal(scale=100.0, size=(event_count, dim_count))
+
+    return points.astype(dtype)
+
+
+def make_polygon(vertex_count, radius=150.0):
+    """
+    Star shaped polygon, half of its vertices at the radius & half inside,
+    so every edge is tested.
+    """
+    angles = np.linspace(0, 2 * np.pi, vertex_count, endpoint=False)
+    radii = np.where(np.arange(vertex_count) % 2 == 0, radius, radius / 2)
+
+    return np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])
+
+
+def make_spill_matrix(channel_count, seed=1):
+    """
+    Spillover matrix with 1 on the diagonal & spillover into the neighbouring channels
+    """
+    rng = np.random.default_rng(seed)
+    spill = np.eye(channel_count)
+    for offset in (1, 2):
+        spill += np.diag(rng.uniform(0.0, 0.3 / offset, channel_count - offset), k=offset)
+        spill += np.diag(rng.uniform(0.0, 0.05 / offset, channel_count - offset), k=-offset)
+
+    return spill
+
+
+def make_spectral_matrix(fluoro_count, detector_count, seed=1):
+    """
+    Spectral matrix with a row for each fluorochrome, each a peaked emission
+    spectrum across the detectors, normalized to a maximum of 1.
+    """
+    rng = np.random.default_rng(seed)
+    peaks = np.linspace(0, detector_count - 1, fluoro_count)
+    widths = rng.uniform(1.0, 3.0, fluoro_count)
+    detectors = np.arange(detector_count)
+    spectra = np.exp(-0.5 * ((detectors[np.newaxis, :] - peaks[:, np.newaxis]) / widths[:, np.newaxis]) ** 2)
+
+    return spectra / spectra.max(axis=1, keepdims=True)
+
+
+def make_spectral_events(event_count, spectral_matrix, dtype=np.float64, seed=1):
+    """
+    Spectral events: non-negative fluorochrome abundances mixed by the spectral matrix, plus noise
+    """
+    rng = np.random.default_rng(seed)
+    fluoro_count, detector_count = spectral_matrix.shape
+    abundances = rng.lognormal(mean=5.0, sigma=1.5, size=(event_count, fluoro_count))
+    abundances[rng.random((event_count, fluoro_count)) < 0.5] = 0.0
+    events = abundances @ spectral_matrix
+    events += rng.normal(scale=50.0, size=(event_count, detector_count))
+
+    return events.astype(dtype)
+
+
+def matrix_text(spill, delimiter=','):
+    """
+    Compensation matrix text, as found in a CSV file, with a header of channel labels
+    """
+    labels = ['FL%d-A' % (i + 1) for i in range(len(spill))]
+    lines = [delimiter.join(labels)]
+    lines.extend(delimiter.join(repr(float(v)) for v in row) for row in spill)
+
+    return '\n'.join(lines), labels
+
+
+def spill_text(spill):
+    """
+    FCS $SPILL keyword value for the spillover matrix
+    """
+    labels = ['FL%d-A' % (i + 1) for i in range(len(spill))]
+    values = [repr(float(v)) for v in spill.ravel()]
+
+    return ','.join([str(len(spill))] + labels + values)
+
+
+# transforms
+LOGICLE_PARAMS = dict(t=262144, m=4.5, w=0.5, a=0)
+TRANSFORM_PARAMS = {'dtype': ['float64', 'float32'], 'channels': [1, 8]}
+
+
+def _setup_transform(func, inverse_of=None, positive=False, **xform_kwargs):
+    def setup(event_count, dtype, channels):
+        events = make_events(event_count, channels, dtype)
+        if positive:
+            events = np.abs(events) + 1.0
+        channel_indices = list(range(channels))
+        if inverse_of is not None:
+            events = inverse_of(events, channel_indices, **xform_kwargs)
+
+        def run():
+            with np.errstate(invalid='ignore', divide='ignore'):
+                func(events, channel_indices, **xform_kwargs)
+
+        return run
+
+    return setup
+
+
+def _setup_precomputed_transform(xform, inverse=False, stats=False):
+    def setup(event_count, dtype, channels):
+        events = make_events(event_count, channels, dtype)
+        if stats:
+            return lambda: xform.apply(events, stats=transforms.TransformStats(channels))
+        if inverse:
+            events = xform.apply(events)
+            return lambda: xform.inverse(events)
+
+        return lambda: xform.apply(events)
+
+    return setup
+
+
+def _setup_transform_1d(xform):
+    # a single channel as a 1-D array, transformed into a preallocated array, e.g. for
+    # very large event counts: --sizes 10000000 100000000
+    def setup(event_count, dtype):
+        events = make_events(event_count, 1, dtype)[:, 0]
+        out = np.empty_like(events)
+
+        return lambda: xform.apply(events, out=out)
+
+    return setup
+
+
+def _setup_estimate_logicle_params(event_count, dtype, channels):
+    events = make_events(event_count, channels, dtype)
+
+    return lambda: transforms.estimate_logicle_params(events)
+
+
+# gating
+GATING_OUTPUTS = ['mask', 'packed', 'indices']
+
+
+def _setup_ellipsoid(event_count, dims, output):
+    points = make_points(event_count, dims)
+    covariance = np.full((dims, dims), 2000.0) + np.eye(dims) * 8000.0
+    means = np.full(dims, 10.0)
+
+    return lambda: gating.points_in_ellipsoid(covariance, means, 4.0, points, output=output)
+
+
+def _setup_rectangle(event_count, dims):
+    points = make_points(event_count, dims)
+    bounds = [(-100.0, 150.0)] * (dims - 1) + [(None, 50.0)]
+
+    return lambda: gating.points_in_rectangle(bounds, points)
+
+
+def _setup_polygon(event_count, vertices, dtype, output):
+    points = make_points(event_count, 2, dtype)
+    polygon = make_polygon(vertices)
+
+    return lambda: gating.points_in_polygon(polygon, points, output=output)
+
+
+def _setup_polygon_subset(event_count, selected):
+    # gates a parent population given by its indices, e.g. a rare population
+    points = make_points(event_count, 2)
+    polygon = make_polygon(16)
+    indices = np.flatnonzero(np.random.default_rng(1).random(event_count) < selected)
+
+    return lambda: gating.points_in_polygon(polygon, points, output='indices', indices=indices)
+
+
+def _setup_polygons(event_count, polygons, output):
+    points = make_points(event_count, 2)
+    polygon_list = [make_polygon(16, radius=50.0 + 25.0 * i) for i in range(polygons)]
+
+    return lambda: gating.points_in_polygons(polygon_list, points, output=output)
+
+
+def _setup_count_in_polygon(event_count):
+    points = make_points(event_count, 2)
+    polygon = make_polygon(16)
+
+    return lambda: gating.count_in_polygon(polygon, points)
+
+
+def _setup_count_in_ellipsoid(event_count):
+    points = make_points(event_count, 2)
+    covariance = np.array([[2500., 500.], [500., 1600.]])
+    means = np.array([10., -20.])
+
+    return lambda: gating.count_in_ellipsoid(covariance, means, 4.0, points)
+
+
+def _setup_stats_in_gate(event_count, bins):
+    events = make_events(event_count, 8)
+    gate = gating.PolygonGate(make_polygon(16) + 500.0, dimensions=[0, 1])
+    ranges = None if bins is None else [(0.0, 10000.0)] * 6
+
+    return lambda: gating.stats_in_gate(gate, events, columns=range(2, 8), bins=bins, ranges=ranges)
+
+
+def _packed_masks(event_count):
+    points = make_points(event_count, 2)
+    polygon = make_polygon(16)
+    packed_a = gating.points_in_polygon(polygon, points, output='packed')
+    packed_b = gating.points_in_polygon(polygon + 50.0, points, output='packed')
+
+    return packed_a, packed_b
+
+
+def _setup_packed_binary(func):
+    def setup(event_count):
+        packed_a, packed_b = _packed_masks(event_count)
+        return lambda: func(packed_a, packed_b)
+
+    return setup
+
+
+def _setup_packed_not(event_count):
+    packed, _ = _packed_masks(event_count)
+    return lambda: gating.packed_mask_not(packed, event_count)
+
+
+def _setup_packed_count(event_count):
+    packed, _ = _packed_masks(event_count)
+    return lambda: gating.packed_mask_count(packed)
+
+
+def _setup_unpack(event_count):
+    packed, _ = _packed_masks(event_count)
+    return lambda: gating.unpack_mask(packed, event_count)
+
+
+def _setup_evaluate_gates(event_count, output='mask'):
+    events = make_points(event_count, 4)
+    quadrants = [
+        gating.Quadrant([1.0, 1.0], gate_id='Q++'),
+        gating.Quadrant([-1.0, 1.0], gate_id='Q-+'),
+        gating.Quadrant([1.0, -100.0], gate_id='Q+-'),
+        gating.Quadrant([-1.0, -100.0], gate_id='Q--'),
+    ]
+    gates = [
+        gating.RectangleGate([(-250, 250), (None, 250)], gate_id='Range', dimensions=[0, 1], children=[
+            gating.PolygonGate(make_polygon(16), gate_id='Polygon', dimensions=[2, 3], children=[
+                gating.EllipsoidGate(
+                    np.array([[2500., 500.], [500., 1600.]]), np.array([10., -20.]), 4.0,
+                    gate_id='Ellipse', dimensions=[0, 3]
+                )
+            ]),
+            gating.QuadrantGate([0.0, [-50.0, 0.0]], quadrants, gate_id='Quad', dimensions=[2, 1]),
+            gating.BooleanGate('and', ['Polygon', 'Q++'], gate_id='PolyAndQ'),
+        ]),
+        gating.BooleanGate('or', ['Q+-', 'Ellipse'], gate_id='Either'),
+    ]
+
+    return lambda: gating.evaluate_gates(gates, events, output=output)
+
+
+# compensation
+COMPENSATION_PARAMS = {'dtype': ['float64', 'float32'], 'channels': [8, 24]}
+SPECTRAL_PARAMS = {'detectors': [16, 48]}
+
+
+def _setup_compensate(func):
+    def setup(event_count, dtype, channels):
+        # 2 scatter channels before the fluorescent channels
+        events = make_events(event_count, channels + 2, dtype)
+        spill = make_spill_matrix(channels)
+        fluoro_indices = list(range(2, channels + 2))
+
+        return lambda: func(events, spill, fluoro_indices)
+
+    return setup
+
+
+def _setup_compensator(preallocated):
+    def setup(event_count, dtype, channels):
+        events = make_events(event_count, channels, dtype)
+        compensator = compensate.Compensator(make_spill_matrix(channels))
+        if preallocated:
+            out = np.empty_like(events)
+            return lambda: compensator.compensate(events, out=out)
+
+        return lambda: compensator.compensate(events)
+
+    return setup
+
+
+def _setup_spectral(method):
+    def setup(event_count, detectors):
+        spectral_matrix = make_spectral_matrix(detectors // 2, detectors)
+        events = make_spectral_events(event_count, spectral_matrix)
+        weights = 1.0 / np.linspace(50.0, 100.0, detectors) ** 2
+
+        if method == 'ols':
+            return lambda: compensate.compensate_spectral_ols(events, spectral_matrix)
+        if method == 'wls':
+            return lambda: compensate.compensate_spectral_wls(events, spectral_matrix, weights)
+
+        return lambda: compensate.compensate_spectral_nnls(events, spectral_matrix)
+
+    return setup
+
+
+def _setup_parse_compensation_matrix(event_count, channels, cached):
+    text, labels = matrix_text(make_spill_matrix(channels))
+
+    def run():
+        if not cached:
+            compensate.clear_matrix_cache()
+        compensate.parse_compensation_matrix(text, labels)
+
+    return run
+
+
+def _setup_get_spill(event_count, channels, cached):
+    text = spill_text(make_spill_matrix(channels))
+
+    def run():
+        if not cached:
+            compensate.clear_matrix_cache()
+        compensate.get_spill(text)
+
+    return run
+
+
+def _setup_pipeline(event_count, dtype, channels):
+    events = make_events(event_count, channels, dtype)
+    xform = transforms.LogicleTransform(**LOGICLE_PARAMS)
+    preprocess = pipeline.Pipeline(make_spill_matrix(channels), [(list(range(channels)), xform)])
+
+    return lambda: preprocess.apply(events)
+
+
+BENCHMARKS = [
+    Benchmark('transforms.logicle', _setup_transform(transforms.logicle, **LOGICLE_PARAMS), TRANSFORM_PARAMS),
+    Benchmark(
+        'transforms.logicle[lut]',
+        _setup_transform(transforms.logicle, method='lut', **LOGICLE_PARAMS),
+        TRANSFORM_PARAMS
+    ),
+    Benchmark(
+        'transforms.logicle_inverse',
+        _setup_transform(transforms.logicle_inverse, inverse_of=transforms.logicle, **LOGICLE_PARAMS),
+        TRANSFORM_PARAMS
+    ),
+    Benchmark('transforms.hyperlog', _setup_transform(transforms.hyperlog, **LOGICLE_PARAMS), TRANSFORM_PARAMS),
+    Benchmark(
+        'transforms.hyperlog_inverse',
+        _setup_transform(transforms.hyperlog_inverse, inverse_of=transforms.hyperlog, **LOGICLE_PARAMS),
+        TRANSFORM_PARAMS
+    ),
+    Benchmark('transforms.asinh', _setup_transform(transforms.asinh, t=262144, m=4.5, a=0), TRANSFORM_PARAMS),
+    Benchmark(
+        'transforms.asinh_inverse',
+        _setup_transform(transforms.asinh_inverse, inverse_of=transforms.asinh, t=262144, m=4.5, a=0),
+        TRANSFORM_PARAMS
+    ),
+    Benchmark(
+        'transforms.log', _setup_transform(transforms.log, positive=True, t=262144, m=4.5), TRANSFORM_PARAMS
+    ),
+    Benchmark(
+        'transforms.log_inverse',
+        _setup_transform(transforms.log_inverse, inverse_of=transforms.log, positive=True, t=262144, m=4.5),
+        TRANSFORM_PARAMS
+    ),
+    Benchmark('transforms.estimate_logicle_params', _setup_estimate_logicle_params, TRANSFORM_PARAMS),
+    Benchmark(
+        'transforms.LogicleTransform.apply',
+        _setup_precomputed_transform(transforms.LogicleTransform(**LOGICLE_PARAMS)),
+        TRANSFORM_PARAMS
+    ),
+    Benchmark(
+        'transforms.LogicleTransform.apply[stats]',
+        _setup_precomputed_transform(transforms.LogicleTransform(**LOGICLE_PARAMS), stats=True),
+        TRANSFORM_PARAMS
+    ),
+    Benchmark(
+        'transforms.LogicleTransform.apply[1d,out]',
+        _setup_transform_1d(transforms.LogicleTransform(**LOGICLE_PARAMS)),
+        {'dtype': ['float64', 'float32']}
+    ),
+    Benchmark(
+        'transforms.LogicleTransform.inverse',
+        _setup_precomputed_transform(transforms.LogicleTransform(**LOGICLE_PARAMS), inverse=True),
+        TRANSFORM_PARAMS
+    ),
+    Benchmark(
+        'transforms.HyperlogTransform.apply',
+        _setup_precomputed_transform(transforms.HyperlogTransform(**LOGICLE_PARAMS)),
+        TRANSFORM_PARAMS
+    ),
+    Benchmark(
+        'transforms.HyperlogTransform.apply[1d,out]',
+        _setup_transform_1d(transforms.HyperlogTransform(**LOGICLE_PARAMS)),
+        {'dtype': ['float64', 'float32']}
+    ),
+    Benchmark(
+        'transforms.HyperlogTransform.inverse',
+        _setup_precomputed_transform(transforms.HyperlogTransform(**LOGICLE_PARAMS), inverse=True),
+        TRANSFORM_PARAMS
+    ),
+    Benchmark('gating.points_in_ellipsoid', _setup_ellipsoid, {'dims': [2, 6], 'output': GATING_OUTPUTS}),
+    Benchmark(
+        'gating.points_in_polygon',
+        _setup_polygon,
+        {'vertices': [4, 32, 256], 'dtype': ['float64', 'float32'], 'output': GATING_OUTPUTS}
+    ),
+    Benchmark('gating.points_in_polygon.subset', _setup_polygon_subset, {'selected': [0.01, 0.5]}),
+    Benchmark('gating.points_in_polygons', _setup_polygons, {'polygons': [4, 16], 'output': GATING_OUTPUTS}),
+    Benchmark('gating.points_in_rectangle', _setup_rectangle, {'dims': [2, 6]}),
+    Benchmark('gating.count_in_polygon', _setup_count_in_polygon),
+    Benchmark('gating.count_in_ellipsoid', _setup_count_in_ellipsoid),
+    Benchmark('gating.stats_in_gate', _setup_stats_in_gate, {'bins': [None, 256]}),
+    Benchmark('gating.packed_mask_and', _setup_packed_binary(gating.packed_mask_and)),
+    Benchmark('gating.packed_mask_or', _setup_packed_binary(gating.packed_mask_or)),
+    Benchmark('gating.packed_mask_not', _setup_packed_not),
+    Benchmark('gating.packed_mask_count', _setup_packed_count),
+    Benchmark('gating.unpack_mask', _setup_unpack),
+    Benchmark('gating.evaluate_gates', _setup_evaluate_gates),
+    Benchmark('gating.evaluate_gates', _setup_evaluate_gates, {'output': ['indices']}),
+    Benchmark('compensate.compensate', _setup_compensate(compensate.compensate), COMPENSATION_PARAMS),
+    Benchmark(
+        'compensate.inverse_compensate', _setup_compensate(compensate.inverse_compensate), COMPENSATION_PARAMS
+    ),
+    Benchmark('compensate.Compensator.compensate', _setup_compensator(preallocated=False), COMPENSATION_PARAMS),
+    Benchmark('compensate.Compensator.compensate[out]', _setup_compensator(preallocated=True), COMPENSATION_PARAMS),
+    Benchmark('compensate.compensate_spectral_ols', _setup_spectral('ols'), SPECTRAL_PARAMS),
+    Benchmark('compensate.compensate_spectral_wls', _setup_spectral('wls'), SPECTRAL_PARAMS),
+    Benchmark('compensate.compensate_spectral_nnls', _setup_spectral('nnls'), SPECTRAL_PARAMS, max_events=10 ** 5),
+    Benchmark(
+        'compensate.parse_compensation_matrix',
+        _setup_parse_compensation_matrix,
+        {'channels': [8, 40], 'cached': [False, True]},
+        per_event=False
+    ),
+    Benchmark(
+        'compensate.get_spill', _setup_get_spill, {'channels': [8, 40], 'cached': [False, True]}, per_event=False
+    ),
+    Benchmark('pipeline.Pipeline.apply', _setup_pipeline, {'dtype': ['float64', 'float32'], 'channels': [8, 24]}),
+]
@@ -0,0 +1,6 @@
+import sys
+
+from benchmarks import runner
+
+
+sys.exit(runner.main())
@@ -23,7 +23,9 @@ logicle_extension = Extension(
         'src/flowutils/logicle_c_ext/logicle.c'
     ],
     include_dirs=[np.get_include(), 'src/flowutils/logicle_c_ext'],
-    extra_compile_args=['-std=c99', '-DNPY_NO_DEPRECATED_API=NPY_1_7_API_VERSION']
+    # the batched solvers select between results computed for every event, which
+    # only vectorizes if the compiler can assume floating point operations don't trap
+    extra_compile_args=['-std=c99', '-fno-trapping-math', '-DNPY_NO_DEPRECATED_API=NPY_1_7_API_VERSION']
 )
 
 gating_extension = Extension(
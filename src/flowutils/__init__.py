@@ -1,6 +1,6 @@
 """
 Defines public API for FlowUtils
 """
-from . import compensate, transforms, gating
+from . import compensate, transforms, gating, pipeline
 
 from ._version import __version__
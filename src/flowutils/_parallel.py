@@ -0,0 +1,64 @@
+"""
+Helpers for splitting event data into chunks processed by multiple threads
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# chunks smaller than this aren't worth the overhead of a thread
+MIN_CHUNK_SIZE = 16384
+
+
+def chunk_ranges(event_count, chunk_count, chunk_multiple=1):
+    """
+    Splits a range of events into contiguous (start, stop) ranges of roughly equal size.
+
+    :param event_count: total number of events
+    :param chunk_count: maximum number of chunks to create
+    :param chunk_multiple: chunks (except the last) are sized as a multiple of this,
+        e.g. 8 so chunks of bit-packed results start on a byte boundary
+    :return: list of (start, stop) tuples
+    """
+    if event_count == 0:
+        return [(0, 0)]
+
+    chunk_count = max(1, min(chunk_count, event_count // MIN_CHUNK_SIZE))
+    chunk_size = -(-event_count // chunk_count)  # ceiling division
+    chunk_size = -(-chunk_size // chunk_multiple) * chunk_multiple
+
+    return [(start, min(start + chunk_size, event_count)) for start in range(0, event_count, chunk_size)]
+
+
+def run_chunked(func, event_count, n_threads=None, executor=None, chunk_multiple=1):
+    """
+    Calls func(start, stop) over chunks of events, using a pool of threads if requested.
+    The C extension functions release the GIL, so the chunks are processed concurrently.
+
+    :param func: function taking the (start, stop) event range of a chunk
+    :param event_count: total number of events
+    :param n_threads: number of threads to use. If None (default) and no executor is given,
+        func is called once in the current thread for all events.
+    :param executor: optional concurrent.futures.Executor used to run the chunks. If given
+        without n_threads, the events are split into one chunk per CPU.
+    :param chunk_multiple: chunks (except the last) are sized as a multiple of this
+    :return: None
+    """
+    if executor is None and (n_threads is None or n_threads <= 1):
+        func(0, event_count)
+        return
+
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+
+    ranges = chunk_ranges(event_count, n_threads, chunk_multiple)
+
+    if len(ranges) == 1:
+        func(0, event_count)
+    elif executor is not None:
+        futures = [executor.submit(func, start, stop) for start, stop in ranges]
+        for future in futures:
+            future.result()
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            futures = [pool.submit(func, start, stop) for start, stop in ranges]
+            for future in futures:
+                future.result()
@@ -1,26 +1,47 @@
 """
 Utility functions related to compensation tasks
 """
+import functools
 import numpy as np
 import re
 import os
 from pathlib import Path
+from ._parallel import run_chunked
+
+# number of parsed compensation matrices (and spill values) kept, for studies with
+# many files sharing the same few matrices
+MATRIX_CACHE_SIZE = 128
+
+# delimiters of multi-line matrix text & the optional '#' starting the header line
+_DELIMITER_REGEX = re.compile('[\t,]')
+_HEADER_PREFIX_REGEX = re.compile('^#\\s*')
+
+
+@functools.lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def _parse_spill(text):
+    # line breaks may appear anywhere in the values, float() ignores the other surrounding white space
+    spill = text.replace('\n', '').split(',')
+    n = int(spill[0])
+    markers = tuple(item.strip() for item in spill[1:(n + 1)])
+    new_spill = np.reshape(np.array(list(map(float, spill[n + 1:]))), (n, n))
+
+    # the cached array is shared, so it must not be modified
+    new_spill.setflags(write=False)
+
+    return new_spill, markers
 
 
 def get_spill(text):
     """
-    Extracts spillover matrix from FCS text entry.
+    Extracts spillover matrix from FCS text entry. The parsed values are cached,
+    so the same text (e.g. from many FCS files of a study) is only parsed once.
 
     :param text: Text value from the $SPILL or $SPILLOVER metadata keyword in an FCS file
     :return: A tuple containing: (spillover matrix new_spill, column headers)
     """
-    spill = text.split(',')
-    n = int(spill[0])
-    markers = spill[1:(n + 1)]
-    markers = [item.strip().replace('\n', '') for item in markers]
-    items = [item.strip().replace('\n', '') for item in spill[n + 1:]]
-    new_spill = np.reshape(list(map(float, items)), (n, n))
-    return new_spill, markers
+    new_spill, markers = _parse_spill(text)
+
+    return new_spill.copy(), list(markers)
 
 
 def _validate_channel_label_sets(header_labels, fluoro_labels):
@@ -78,18 +99,17 @@ def _parse_multiline_matrix(matrix_text, fluoro_labels):
     # the header contains labels matching the PnN value(FCS text field)
     # and may be tab-delimited or comma-delimited
     # (spaces can't be delimiters b/c they are allowed in the PnN value)
+    fluoro_label_set = set(fluoro_labels)
     header = None
     header_line_index = None
     for i, line in enumerate(matrix_text):
         # header may begin with a '#' and some white space
-        match = re.search('^#\\s*', line)
+        match = _HEADER_PREFIX_REGEX.search(line)
         if match is not None:
             line = line[match.end():]
-        line_values = re.split('[\t,]', line)
-
-        label_diff = set(fluoro_labels).symmetric_difference(line_values)
+        line_values = _DELIMITER_REGEX.split(line)
 
-        if len(label_diff) != 0:
+        if set(line_values) != fluoro_label_set:
             # if any labels are missing or extra ones found, then not a valid header row
             continue
         else:
@@ -97,6 +117,9 @@ def _parse_multiline_matrix(matrix_text, fluoro_labels):
             header_line_index = i
             break
 
+    if header is None:
+        raise ValueError("Header line with the fluorescent channel labels was not found in the matrix text")
+
     matrix_start = header_line_index + 1
     matrix_end = matrix_start + len(fluoro_labels)
 
@@ -108,17 +131,16 @@ def _parse_multiline_matrix(matrix_text, fluoro_labels):
 
     # convert the matrix text to numpy array
     for line in matrix_text:
-        line_values = re.split('[\t,]', line)
-        line_values = [float(value) for value in line_values]
+        line_values = _DELIMITER_REGEX.split(line)
 
         if len(line_values) > len(fluoro_labels):
             raise ValueError("Too many values in line: %s" % line)
         elif len(line_values) < len(fluoro_labels):
             raise ValueError("Too few values in line: %s" % line)
         else:
-            matrix_array.append(line_values)
+            matrix_array.extend(line_values)
 
-    matrix_array = np.array(matrix_array)
+    matrix_array = np.reshape(np.array(list(map(float, matrix_array))), (len(fluoro_labels), len(fluoro_labels)))
 
     return matrix_array, header
 
@@ -153,7 +175,12 @@ def _convert_matrix_text_to_array(matrix_text, fluoro_labels, fluoro_indices):
 
     # re-order matrix according to provided fluoro label order
     idx_order = [header.index(fluoro_label) for fluoro_label in fluoro_labels]
-    matrix = matrix[idx_order, :][:, idx_order]
+    matrix = matrix[np.ix_(idx_order, idx_order)]
+
+    # first index of each label, like list.index()
+    fluoro_label_indices = {}
+    for i, label in enumerate(fluoro_labels):
+        fluoro_label_indices.setdefault(label, i)
 
     header_channel_numbers = []
 
@@ -165,7 +192,9 @@ def _convert_matrix_text_to_array(matrix_text, fluoro_labels, fluoro_indices):
         # to match the original PnN numbers that index from 1 (not 0).
         # We store the channel number in the first row of the numpy array, as it is more
         # reliable to identify parameters than some concatenation of parameter attributes.
-        fluoro_index = fluoro_labels.index(h)
+        if h not in fluoro_label_indices:
+            raise ValueError("%r is not in list" % (h,))
+        fluoro_index = fluoro_label_indices[h]
         true_fluoro_index = fluoro_indices[fluoro_index]
         header_channel_numbers.append(true_fluoro_index + 1)
 
@@ -174,6 +203,27 @@ def _convert_matrix_text_to_array(matrix_text, fluoro_labels, fluoro_indices):
     return matrix_array
 
 
+@functools.lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def _convert_matrix_text_to_array_cached(matrix_text, fluoro_labels, fluoro_indices):
+    # cached by the matrix text & channels, the text is only parsed once for all the
+    # FCS files sharing it. The cached array is shared, so it must not be modified.
+    matrix = _convert_matrix_text_to_array(matrix_text, list(fluoro_labels), list(fluoro_indices))
+    matrix.setflags(write=False)
+
+    return matrix
+
+
+def clear_matrix_cache():
+    """
+    Clears the cache of parsed compensation matrices & spill values, e.g. to free memory
+    after processing a study
+
+    :return: None
+    """
+    _convert_matrix_text_to_array_cached.cache_clear()
+    _parse_spill.cache_clear()
+
+
 def parse_compensation_matrix(compensation, channel_labels, null_channels=None):
     """
     Returns a NumPy array with the compensation matrix, where the first row contains
@@ -183,7 +233,9 @@ def parse_compensation_matrix(compensation, channel_labels, null_channels=None):
         path, a pathlib Path object to a CSV or TSV file or a string of CSV
         text. If a string, both multi-line, traditional CSV, and the single
         line FCS spill formats are supported. If a NumPy array, we assume the
-        columns are in the same order as the channel labels.
+        columns are in the same order as the channel labels. Parsed matrix text
+        is cached, so text shared by many FCS files is only parsed once (see
+        `clear_matrix_cache`).
     :param channel_labels: Channel labels from the FCS file's PnN fields, must be in
         the same order as they appear in the FCS file
     :param null_channels: Specify any empty channels that were collected and
@@ -226,14 +278,16 @@ def parse_compensation_matrix(compensation, channel_labels, null_channels=None):
             # may be a CSV string
             matrix_text = compensation
 
-        matrix = _convert_matrix_text_to_array(matrix_text, fluoro_labels, fluoro_indices)
+        matrix = _convert_matrix_text_to_array_cached(matrix_text, tuple(fluoro_labels), tuple(fluoro_indices))
+        matrix = matrix.copy()
 
     elif isinstance(compensation, Path):
         fh = compensation.open('r')
         matrix_text = fh.read()
         fh.close()
 
-        matrix = _convert_matrix_text_to_array(matrix_text, fluoro_labels, fluoro_indices)
+        matrix = _convert_matrix_text_to_array_cached(matrix_text, tuple(fluoro_labels), tuple(fluoro_indices))
+        matrix = matrix.copy()
     elif isinstance(compensation, np.ndarray):
         matrix = compensation
     else:
@@ -248,72 +302,574 @@ def parse_compensation_matrix(compensation, channel_labels, null_channels=None):
     return matrix
 
 
-def compensate(event_data, spill_matrix, fluoro_indices=None):
+# number of events compensated at a time when writing to an output array in chunks
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def _apply_matrix(event_data, matrix, fluoro_indices=None):
+    """
+    Multiplies the fluorescent channels of the event data by a matrix, returning a new array
+    """
+    event_data = np.asarray(event_data)
+
+    if fluoro_indices is None:
+        # a single matrix multiply, without copying the event data
+        return np.dot(event_data, matrix)
+
+    data = event_data.copy()
+    data[:, fluoro_indices] = np.dot(event_data[:, fluoro_indices], matrix)
+
+    return data
+
+
+def _apply_chunked(event_data, apply_block, out=None, chunk_size=None):
+    """
+    Applies a compensation function to blocks of rows of the event data, writing
+    the compensated blocks to the out array, so only a block at a time is held in
+    memory (e.g. for event data & out arrays that are memory-mapped files).
+
+    :param event_data: NumPy array (or memmap) of the event data
+    :param apply_block: function returning a new array of the compensated events for a block of events
+    :param out: Optional array to store the compensated events, must have the shape of the
+        compensated events. May be event_data to compensate in place.
+    :param chunk_size: Number of events in each block. If None, DEFAULT_CHUNK_SIZE is used when
+        out is given, otherwise the event data is compensated all at once.
+
+    :return: the compensated events (out, if given)
+    """
+    if out is None and chunk_size is None:
+        return apply_block(event_data)
+
+    if chunk_size is None:
+        chunk_size = DEFAULT_CHUNK_SIZE
+    elif chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+
+    event_count = len(event_data)
+    if out is not None and len(out) != event_count:
+        raise ValueError("out must have a row for each event (%d), not %d" % (event_count, len(out)))
+
+    for start in range(0, event_count, chunk_size):
+        block = apply_block(event_data[start:start + chunk_size])
+
+        if out is None:
+            out = np.empty((event_count,) + block.shape[1:], dtype=block.dtype)
+        out[start:start + chunk_size] = block
+
+    if out is None:
+        # no events, but we still want an array of the right shape & type
+        out = apply_block(event_data)
+
+    return out
+
+
+class Compensator(object):
+    """
+    Compensates event data with a fixed spillover matrix. The compensation
+    matrix (the inverse of the spillover matrix) is computed once when the
+    Compensator is created, so compensating many files with the same spillover
+    matrix only factorises it once, and each call is a single matrix multiply.
+
+    :param spill_matrix: Compensation matrix as a NumPy array (without headers)
+    :param fluoro_indices: List of fluorescent channel indices in the event data
+        in the order found in the columns of the provided spill_matrix. Required
+        if the number of columns in event data does not match the spill_matrix or
+        if the order of the columns does not match. If None (default), the
+        event data columns are assumed to match the spill_matrix columns.
+    """
+    def __init__(self, spill_matrix, fluoro_indices=None):
+        spill_matrix = np.asarray(spill_matrix, dtype=np.float64)
+
+        if spill_matrix.ndim != 2 or spill_matrix.shape[0] != spill_matrix.shape[1]:
+            raise ValueError("Spillover matrix must be square, not shape %r" % (spill_matrix.shape,))
+        if fluoro_indices is not None:
+            fluoro_indices = list(fluoro_indices)
+            if len(fluoro_indices) != spill_matrix.shape[0]:
+                raise ValueError(
+                    "Number of fluoro_indices (%d) does not match the spillover matrix size (%d)"
+                    % (len(fluoro_indices), spill_matrix.shape[0])
+                )
+
+        self.spill_matrix = spill_matrix
+        self.fluoro_indices = fluoro_indices
+
+        # compensation is solving events = comp_events * spill_matrix, so the
+        # compensation matrix is the inverse of the spillover matrix
+        self.comp_matrix = np.linalg.inv(spill_matrix)
+
+    @classmethod
+    def from_compensation_matrix(cls, matrix):
+        """
+        Creates a Compensator from a matrix returned by `parse_compensation_matrix`,
+        where the first row contains the channel numbers of the fluorescent channels
+
+        :param matrix: Compensation matrix as NumPy array where header contains the
+            channel numbers (not indices!)
+
+        :return: Compensator instance
+        """
+        matrix = np.asarray(matrix)
+        fluoro_indices = [int(channel_number) - 1 for channel_number in matrix[0]]
+
+        return cls(matrix[1:], fluoro_indices=fluoro_indices)
+
+    def __repr__(self):
+        return '%s(channels=%d)' % (self.__class__.__name__, self.spill_matrix.shape[0])
+
+    def _compensate_block(self, block):
+        return _apply_matrix(block, self.comp_matrix, self.fluoro_indices)
+
+    def _inverse_compensate_block(self, block):
+        return _apply_matrix(block, self.spill_matrix, self.fluoro_indices)
+
+    def compensate(self, event_data, out=None, chunk_size=None):
+        """
+        Compensate NumPy event data
+
+        :param event_data: NumPy array (or memmap) of the event data
+        :param out: Optional array (or memmap) to store the compensated events, compensated
+            in blocks of chunk_size events. May be event_data to compensate in place.
+        :param chunk_size: Number of events compensated at a time. If None, DEFAULT_CHUNK_SIZE
+            is used when out is given, otherwise all the events are compensated at once.
+
+        :return: NumPy array of compensated event data (out, if given). If fluoro_indices were
+            given, the data is returned with the column order found in event_data, with the
+            non-fluorescent columns unmodified.
+        """
+        return _apply_chunked(event_data, self._compensate_block, out=out, chunk_size=chunk_size)
+
+    def inverse_compensate(self, event_data, out=None, chunk_size=None):
+        """
+        Inverse the compensation on NumPy event data
+
+        :param event_data: NumPy array (or memmap) of the event data
+        :param out: Optional array (or memmap) to store the un-compensated events, see `compensate`
+        :param chunk_size: Number of events un-compensated at a time, see `compensate`
+
+        :return: NumPy array of un-compensated event data (out, if given). If fluoro_indices were
+            given, the data is returned with the column order found in event_data, with the
+            non-fluorescent columns unmodified.
+        """
+        return _apply_chunked(event_data, self._inverse_compensate_block, out=out, chunk_size=chunk_size)
+
+    def compensate_blocks(self, blocks):
+        """
+        Compensates a stream of event blocks, e.g. read from a file one block at a time
+
+        :param blocks: iterable of NumPy arrays of event data
+
+        :return: generator of NumPy arrays of compensated event data, one for each block
+        """
+        for block in blocks:
+            yield self._compensate_block(block)
+
+    def inverse_compensate_blocks(self, blocks):
+        """
+        Inverse the compensation on a stream of event blocks
+
+        :param blocks: iterable of NumPy arrays of event data
+
+        :return: generator of NumPy arrays of un-compensated event data, one for each block
+        """
+        for block in blocks:
+            yield self._inverse_compensate_block(block)
+
+
+def compensate(event_data, spill_matrix, fluoro_indices=None, out=None, chunk_size=None):
     """
-    Compensate NumPy event data given spillover matrix.
+    Compensate NumPy event data given spillover matrix. To compensate many
+    files with the same spillover matrix, create a `Compensator` instead, so
+    the matrix is only inverted once.
 
-    :param event_data: NumPy array of the event data
+    :param event_data: NumPy array (or memmap) of the event data
     :param spill_matrix: Compensation matrix as a NumPy array (without headers)
     :param fluoro_indices: List of fluorescent channel indices in given event_data
         in the order found in the columns of the provided spill_matrix. Required
         if the number of columns in event_data does not match the spill_matrix or
         if the order of the columns does not match. If None (default), the
         event_dataa columns are assumed to match the spill_matrix columns.
+    :param out: Optional array (or memmap) to store the compensated events, compensated
+        in blocks of chunk_size events, so the event data is never held in memory all
+        at once. May be event_data to compensate in place.
+    :param chunk_size: Number of events compensated at a time. If None, DEFAULT_CHUNK_SIZE
+        is used when out is given, otherwise all the events are compensated at once.
 
-    :return: NumPy array of compensated event data. If fluoro_indices were given,
+    :return: NumPy array of compensated event data (out, if given). If fluoro_indices were given,
         the data is returned with the column order found in event_data, with the
         non-fluorescent columns unmodified.
     """
-    data = event_data.copy()
-    if fluoro_indices is not None:
-        comp_data = data[:, fluoro_indices]
-    else:
-        comp_data = data
-
-    # this does the actual compensation
-    comp_data = np.linalg.solve(spill_matrix.T, comp_data.T).T
+    compensator = Compensator(spill_matrix, fluoro_indices=fluoro_indices)
 
-    # Re-insert compensated data columns
-    if fluoro_indices is not None:
-        data[:, fluoro_indices] = comp_data
-    else:
-        data = comp_data
-
-    return data
+    return compensator.compensate(event_data, out=out, chunk_size=chunk_size)
 
 
-def inverse_compensate(event_data, spill_matrix, fluoro_indices=None):
+def inverse_compensate(event_data, spill_matrix, fluoro_indices=None, out=None, chunk_size=None):
     """
     Inverse the compensation on NumPy event data given spillover matrix.
 
-    :param event_data: NumPy array of the event data
+    :param event_data: NumPy array (or memmap) of the event data
     :param spill_matrix: Compensation matrix as a NumPy array (without headers)
     :param fluoro_indices: Optional list of indices of the fluorescent channels (only
         these will be extracted & un-compensated). If None (default), all columns
         will be un-compensated.
+    :param out: Optional array (or memmap) to store the un-compensated events, see `compensate`
+    :param chunk_size: Number of events un-compensated at a time, see `compensate`
 
-    :return: NumPy array of un-compensated event data. If fluoro_indices were given,
+    :return: NumPy array of un-compensated event data (out, if given). If fluoro_indices were given,
         the data is returned with the column order given, with the non-fluorescent
         columns unmodified.
     """
-    data = event_data.copy()
-    if fluoro_indices is not None:
-        inv_comp_data = data[:, fluoro_indices]
-    else:
-        inv_comp_data = data
+    def _inverse_compensate_block(block):
+        return _apply_matrix(block, spill_matrix, fluoro_indices)
 
-    inv_comp_data = np.dot(inv_comp_data, spill_matrix)
+    return _apply_chunked(event_data, _inverse_compensate_block, out=out, chunk_size=chunk_size)
 
-    # Re-insert compensated data columns
-    if fluoro_indices is not None:
-        data[:, fluoro_indices] = inv_comp_data
+
+# maximum number of values in the stack of per-event normal equations solved at a time
+MAX_NORMAL_EQUATIONS_SIZE = 1 << 22
+
+
+def _check_weights(weights, detector_count):
+    """
+    Validates detector weights, returning them as a float64 array
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+
+    if weights.shape[-1:] != (detector_count,):
+        raise ValueError("weights must have a value for each detector (%d)" % detector_count)
+    if not np.all(weights > 0):
+        raise ValueError("weights must be positive")
+
+    return weights
+
+
+def _solve_passive_sets(gram, rhs, passive):
+    """
+    Solves the normal equations of each event restricted to its passive set (the
+    fluorochromes free to be non-zero), with the other values fixed at 0. Events
+    sharing a passive set are solved together with a single factorisation.
+    """
+    solution = np.zeros_like(rhs)
+
+    patterns, pattern_events = np.unique(np.packbits(passive, axis=1), axis=0, return_inverse=True)
+    order = np.argsort(pattern_events.ravel(), kind='stable')
+    group_starts = np.searchsorted(pattern_events.ravel()[order], np.arange(len(patterns) + 1))
+
+    for p in range(len(patterns)):
+        events = order[group_starts[p]:group_starts[p + 1]]
+        columns = np.flatnonzero(passive[events[0]])
+        if len(columns) == 0:
+            continue
+
+        system = gram[np.ix_(columns, columns)]
+        solution[np.ix_(events, columns)] = np.linalg.solve(system, rhs[np.ix_(events, columns)].T).T
+
+    return solution
+
+
+def _nnls_block_pivoting(comp_data, rhs, gram, max_iter, tol):
+    """
+    Solves a block of non-negative least squares problems, min ||x - cS|| for c >= 0,
+    from their normal equations c * gram = rhs (gram = S S^T, rhs = x S^T), using the
+    block principal pivoting method of Kim & Park (2011). Each iteration moves all
+    the infeasible fluorochromes of an event between its passive set (free values)
+    and active set (values fixed at 0), falling back to moving one at a time if an
+    event stops improving. Only the events not yet solved are iterated.
+
+    :param comp_data: unconstrained least squares solution of each event, updated in place
+    :param rhs: right-hand side of the normal equations, a row for each event
+    :param gram: Gram matrix of the (weighted) spectral matrix
+    :param max_iter: maximum number of pivoting iterations
+    :param tol: tolerance of the optimality conditions, relative to the largest values
+
+    :return: comp_data
+    """
+    fluoro_count = gram.shape[0]
+    tiny = np.finfo(comp_data.dtype).tiny
+    value_tol = tol * max(np.abs(comp_data).max(initial=0), tiny)
+    gradient_tol = tol * max(np.abs(rhs).max(initial=0), tiny)
+
+    # events with no negative values are already solved, the rest start with
+    # all their fluorochromes in the passive set
+    todo = np.flatnonzero((comp_data < -value_tol).any(axis=1))
+    solution = comp_data[todo]
+    rhs = rhs[todo]
+    passive = np.ones(solution.shape, dtype=bool)
+    best_infeasible_count = np.full(len(todo), fluoro_count + 1)
+    backup_count = np.full(len(todo), 3)
+
+    for _ in range(max_iter):
+        gradient = np.dot(solution, gram) - rhs
+        infeasible = (passive & (solution < -value_tol)) | (~passive & (gradient < -gradient_tol))
+        infeasible_count = infeasible.sum(axis=1)
+
+        solved = infeasible_count == 0
+        comp_data[todo[solved]] = np.maximum(solution[solved], 0)
+
+        unsolved = ~solved
+        todo = todo[unsolved]
+        if len(todo) == 0:
+            break
+        solution = solution[unsolved]
+        rhs = rhs[unsolved]
+        passive = passive[unsolved]
+        infeasible = infeasible[unsolved]
+        infeasible_count = infeasible_count[unsolved]
+        best_infeasible_count = best_infeasible_count[unsolved]
+        backup_count = backup_count[unsolved]
+
+        # exchange every infeasible fluorochrome while the number of infeasible ones decreases,
+        # allowing a few exchanges without improvement, then only the last infeasible one
+        improved = infeasible_count < best_infeasible_count
+        best_infeasible_count[improved] = infeasible_count[improved]
+        backup_count[improved] = 3
+        backup_count[~improved] -= 1
+
+        single = np.flatnonzero(backup_count < 0)
+        if len(single) > 0:
+            last = fluoro_count - 1 - np.argmax(infeasible[single, ::-1], axis=1)
+            infeasible[single] = False
+            infeasible[single, last] = True
+
+        passive ^= infeasible
+        solution = _solve_passive_sets(gram, rhs, passive)
     else:
-        data = inv_comp_data
+        # not solved within max_iter, keep the last (non-negative) solution
+        comp_data[todo] = np.maximum(solution, 0)
 
-    return data
+    return comp_data
 
 
-def compensate_spectral_ols(event_data, spill_matrix, fluoro_indices=None):
+class SpectralUnmixer(object):
+    """
+    Unmixes (compensates) spectral event data with a fixed spectral spillover matrix
+    using the ordinary least squares method (OLS), see `compensate_spectral_ols`.
+    The least squares solution for every event is a multiplication by the
+    pseudo-inverse of the spectral matrix, so the pseudo-inverse is computed once
+    when the SpectralUnmixer is created, and the events are unmixed with a single
+    matrix multiply per block of events.
+
+    Weighted least squares (WLS) uses per-detector weights, typically the inverse
+    of each detector's variance. Fixed weights are also solved by a precomputed
+    matrix, while per-event weights (see `unmix`) solve batches of normal equations.
+
+    Non-negative least squares (NNLS) starts from the (weighted) least squares
+    solution, then only the events with negative values are solved by block
+    principal pivoting, with the events sharing the same set of non-zero
+    fluorochromes solved together.
+
+    :param spill_matrix: Spectral compensation matrix as a NumPy array (without headers),
+        with a row for each fluorochrome and a column for each detector
+    :param fluoro_indices: Optional list of indices of the fluorescent channels (detectors)
+        in the event data, in the order of the spill_matrix columns. If None (default),
+        the event data columns are assumed to match the spill_matrix columns.
+    :param dtype: np.float64 (default) or np.float32. Unmixing in single precision is
+        faster and uses half the memory, with results accurate to ~1e-6 relative.
+    :param weights: Optional weight of each detector (1-D array, e.g. 1 / variance) for
+        weighted least squares. If None (default), ordinary least squares is used.
+    :param non_negative: If True, constrain the unmixed values to be non-negative (NNLS)
+    :param max_iter: maximum number of pivoting iterations for non-negative unmixing
+    :param tol: relative tolerance of the non-negative solution's optimality conditions
+    """
+    def __init__(
+            self,
+            spill_matrix,
+            fluoro_indices=None,
+            dtype=np.float64,
+            weights=None,
+            non_negative=False,
+            max_iter=100,
+            tol=1e-9
+    ):
+        spill_matrix = np.asarray(spill_matrix, dtype=np.float64)
+        dtype = np.dtype(dtype)
+
+        if spill_matrix.ndim != 2 or spill_matrix.shape[0] > spill_matrix.shape[1]:
+            raise ValueError(
+                "Spectral matrix must have a row for each fluorochrome and at least as many "
+                "columns (detectors), not shape %r" % (spill_matrix.shape,)
+            )
+        if dtype not in (np.float32, np.float64):
+            raise ValueError("dtype must be np.float32 or np.float64, not %r" % (dtype,))
+        if fluoro_indices is not None:
+            fluoro_indices = list(fluoro_indices)
+            if len(fluoro_indices) != spill_matrix.shape[1]:
+                raise ValueError(
+                    "Number of fluoro_indices (%d) does not match the spectral matrix columns (%d)"
+                    % (len(fluoro_indices), spill_matrix.shape[1])
+                )
+        if weights is not None:
+            weights = _check_weights(weights, spill_matrix.shape[1])
+
+        self.spill_matrix = spill_matrix
+        self.fluoro_indices = fluoro_indices
+        self.dtype = dtype
+        self.weights = weights
+        self.non_negative = non_negative
+        self.max_iter = max_iter
+        self.tol = tol
+
+        # the (W)LS solution of events = comp_events * spill_matrix is comp_events = events * unmix_matrix,
+        # for OLS the pseudo-inverse of the spill_matrix. These are computed in double precision.
+        if weights is None:
+            weighted_spill = spill_matrix
+            unmix_matrix = np.linalg.pinv(spill_matrix)
+        else:
+            weighted_spill = spill_matrix * weights
+            unmix_matrix = np.linalg.solve(np.dot(weighted_spill, spill_matrix.T), weighted_spill).T
+
+        self.unmix_matrix = unmix_matrix.astype(dtype)
+        self._spill_matrix = spill_matrix.astype(dtype)
+        self._weighted_spill_t = weighted_spill.T.astype(dtype)
+        self._gram = np.dot(weighted_spill, spill_matrix.T).astype(dtype)
+
+        # products of each pair of fluorochrome spectra for every detector, for the
+        # Gram matrices of per-event weights
+        fluoro_count = spill_matrix.shape[0]
+        spill_products = spill_matrix[:, np.newaxis, :] * spill_matrix[np.newaxis, :, :]
+        self._spill_products = spill_products.reshape(fluoro_count * fluoro_count, -1).T.astype(dtype)
+
+        # only the true fluorescent channels (the rows of the matrix) are replaced
+        if fluoro_indices is None:
+            self._true_fluoro_indices = slice(0, fluoro_count)
+        else:
+            self._true_fluoro_indices = fluoro_indices[:fluoro_count]
+
+    def __repr__(self):
+        return '%s(fluorochromes=%d, detectors=%d, dtype=%s)' % (
+            self.__class__.__name__, self.spill_matrix.shape[0], self.spill_matrix.shape[1], self.dtype.name
+        )
+
+    def _solve_event_weights(self, detectors, weights):
+        """
+        Solves the weighted least squares normal equations of each event, for per-event weights
+        """
+        fluoro_count = self._spill_matrix.shape[0]
+        batch_size = max(1, MAX_NORMAL_EQUATIONS_SIZE // (fluoro_count * fluoro_count))
+        comp_data = np.empty((len(detectors), fluoro_count), dtype=self.dtype)
+
+        for start in range(0, len(detectors), batch_size):
+            stop = start + batch_size
+            batch_weights = weights[start:stop]
+
+            # Gram matrix S W S^T & right-hand side x W S^T of each event, the Gram
+            # matrices are computed for all the events with a single matrix multiply
+            gram = np.dot(batch_weights, self._spill_products).reshape(-1, fluoro_count, fluoro_count)
+            rhs = np.dot(detectors[start:stop] * batch_weights, self._spill_matrix.T)
+            comp_data[start:stop] = np.linalg.solve(gram, rhs[:, :, np.newaxis])[:, :, 0]
+
+        return comp_data
+
+    def unmix(
+            self,
+            event_data,
+            out=None,
+            chunk_size=None,
+            n_threads=None,
+            executor=None,
+            return_residuals=False,
+            weights=None
+    ):
+        """
+        Unmix spectral event data
+
+        :param event_data: NumPy array (or memmap) of the event data
+        :param out: Optional array (or memmap) to store the unmixed events. May be event_data
+            to unmix in place.
+        :param chunk_size: Number of events unmixed at a time, bounding the memory used for
+            temporary arrays. If None, DEFAULT_CHUNK_SIZE is used.
+        :param n_threads: Optional number of threads used to unmix chunks of events in parallel
+        :param executor: Optional concurrent.futures.Executor used to unmix chunks of events in parallel
+        :param return_residuals: If True, also return the residual norm of each event, i.e.
+            the (unweighted) distance between the detector values and the fit of the unmixed values
+        :param weights: Optional detector weights for each event (2-D array with a row for each
+            event & a column for each detector), solving the weighted least squares normal
+            equations of each event. Overrides the weights of the unmixer. Not supported for
+            non-negative unmixing.
+
+        :return: NumPy array of unmixed event data (out, if given), with the non-fluorescent
+            columns unmodified. If return_residuals is True, a tuple of the unmixed event data
+            and a 1-D array of the residual norms.
+        """
+        event_count = len(event_data)
+        if chunk_size is None:
+            chunk_size = DEFAULT_CHUNK_SIZE
+        elif chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer")
+
+        if weights is not None:
+            if self.non_negative:
+                raise ValueError("Per-event weights are not supported for non-negative unmixing")
+            weights = np.asarray(weights)
+            if weights.shape != (event_count, self.spill_matrix.shape[1]):
+                raise ValueError(
+                    "weights must have a row for each event & a column for each detector %r, not %r"
+                    % ((event_count, self.spill_matrix.shape[1]), weights.shape)
+                )
+
+        if out is None:
+            # like the event data, unless it isn't floating point (e.g. integer channel values)
+            out_dtype = event_data.dtype if np.issubdtype(event_data.dtype, np.floating) else np.float64
+            out = np.empty(event_data.shape, dtype=out_dtype)
+        elif out.shape != event_data.shape:
+            raise ValueError("out must have the shape of the event data %r, not %r" % (event_data.shape, out.shape))
+        copy_events = out is not event_data
+
+        residuals = np.empty(event_count, dtype=self.dtype) if return_residuals else None
+
+        def _unmix_chunk(start, stop):
+            for block_start in range(start, stop, chunk_size):
+                block_stop = min(block_start + chunk_size, stop)
+                block = event_data[block_start:block_stop]
+
+                if self.fluoro_indices is not None:
+                    detectors = np.asarray(block[:, self.fluoro_indices], dtype=self.dtype)
+                else:
+                    detectors = np.asarray(block, dtype=self.dtype)
+
+                if weights is not None:
+                    block_weights = np.asarray(weights[block_start:block_stop], dtype=self.dtype)
+                    comp_data = self._solve_event_weights(detectors, block_weights)
+                else:
+                    comp_data = np.dot(detectors, self.unmix_matrix)
+
+                if self.non_negative:
+                    rhs = np.dot(detectors, self._weighted_spill_t)
+                    _nnls_block_pivoting(comp_data, rhs, self._gram, self.max_iter, self.tol)
+
+                if residuals is not None:
+                    # before out is written, detectors may be a view of the event data (and of out,
+                    # unmixing in place)
+                    fit = np.dot(comp_data, self._spill_matrix)
+                    residuals[block_start:block_stop] = np.linalg.norm(detectors - fit, axis=1)
+
+                if copy_events:
+                    out[block_start:block_stop] = block
+                out[block_start:block_stop, self._true_fluoro_indices] = comp_data
+
+        # NumPy releases the GIL for matrix multiplies, so chunks of events can be unmixed in parallel threads
+        run_chunked(_unmix_chunk, event_count, n_threads=n_threads, executor=executor)
+
+        if return_residuals:
+            return out, residuals
+
+        return out
+
+    def unmix_blocks(self, blocks, return_residuals=False):
+        """
+        Unmix a stream of spectral event blocks, e.g. read from a file one block at a time
+
+        :param blocks: iterable of NumPy arrays of event data
+        :param return_residuals: If True, also yield the residual norm of each event, see `unmix()`
+
+        :return: generator of NumPy arrays of unmixed event data, one for each block (or
+            tuples of the unmixed event data & residual norms, if return_residuals is True)
+        """
+        for block in blocks:
+            yield self.unmix(np.asarray(block), return_residuals=return_residuals)
+
+
+def compensate_spectral_ols(event_data, spill_matrix, fluoro_indices=None, out=None, chunk_size=None):
     """
     Compensate spectral event data given a spectral spillover matrix using the
     ordinary least squares method (OLS). Unlike conventional flow cytometry
@@ -327,41 +883,124 @@ def compensate_spectral_ols(event_data, spill_matrix, fluoro_indices=None):
     the overdetermined system, there is no inverse function for this method of
     compensation.
 
-    :param event_data: NumPy array of the event data
+    To unmix many files with the same spectral matrix, create a `SpectralUnmixer`
+    instead, so the pseudo-inverse of the matrix is only computed once.
+
+    :param event_data: NumPy array (or memmap) of the event data
     :param spill_matrix: Compensation matrix as a NumPy array (without headers)
     :param fluoro_indices: Optional list of indices of the fluorescent channels (only
         these will be extracted & compensated). If None (default), all columns
         will be compensated.
+    :param out: Optional array (or memmap) to store the compensated events, compensated
+        in blocks of chunk_size events, so the event data is never held in memory all
+        at once. May be event_data to compensate in place.
+    :param chunk_size: Number of events compensated at a time. If None, DEFAULT_CHUNK_SIZE is used.
 
-    :return: NumPy array of compensated event data. If fluoro_indices were given,
+    :return: NumPy array of compensated event data (out, if given). If fluoro_indices were given,
         the data is returned with the column order given, with the non-fluorescent
         columns unmodified.
     """
-    data = event_data.copy()
-    if fluoro_indices is not None:
-        comp_data = data[:, fluoro_indices]
-    else:
-        comp_data = data
-
-    # this does the actual compensation
-    # The NumPy least squares function returns a tuple of 4 items:
-    #     least-squares solution (what we want), residuals, rank, & s
-    # Refer to the NumPy docs for more details. We only want the solution,
-    # but it needs to be transposed back to our data orientation.
-    # So, we'll grab the first tuple item and transpose it to avoid storing
-    # unused variables.
-    comp_data = np.linalg.lstsq(spill_matrix.T, comp_data.T, rcond=-1)[0].T
-
-    # Re-insert compensated data columns, but this isn't as straight-forward
-    # as conventional compensation. For spectral compensation, only the true
-    # fluorescent channels need to be replaced.
-    if fluoro_indices is not None:
-        true_fluoro_indices = fluoro_indices[:spill_matrix.shape[0]]
-        data[:, true_fluoro_indices] = comp_data
+    unmixer = SpectralUnmixer(spill_matrix, fluoro_indices=fluoro_indices)
+
+    return unmixer.unmix(event_data, out=out, chunk_size=chunk_size)
+
+
+def compensate_spectral_wls(
+        event_data,
+        spill_matrix,
+        weights,
+        fluoro_indices=None,
+        out=None,
+        chunk_size=None,
+        n_threads=None,
+        executor=None
+):
+    """
+    Compensate spectral event data given a spectral spillover matrix using the
+    weighted least squares method (WLS), where each detector's contribution to
+    the fit is weighted, typically by the inverse of its variance. See
+    `compensate_spectral_ols` for the layout of the spectral matrix & the
+    fluorescent channels.
+
+    :param event_data: NumPy array (or memmap) of the event data
+    :param spill_matrix: Compensation matrix as a NumPy array (without headers)
+    :param weights: Weight of each detector, in the order of the spill_matrix columns.
+        Either a 1-D array of weights for all events, or a 2-D array with the weights
+        for each event, solved with batched normal equations.
+    :param fluoro_indices: Optional list of indices of the fluorescent channels (only
+        these will be extracted & compensated). If None (default), all columns
+        will be compensated.
+    :param out: Optional array (or memmap) to store the compensated events. May be
+        event_data to compensate in place.
+    :param chunk_size: Number of events compensated at a time. If None, DEFAULT_CHUNK_SIZE is used.
+    :param n_threads: Optional number of threads used to compensate chunks of events in parallel
+    :param executor: Optional concurrent.futures.Executor used to compensate chunks of events in parallel
+
+    :return: NumPy array of compensated event data (out, if given). If fluoro_indices were given,
+        the data is returned with the column order given, with the non-fluorescent
+        columns unmodified.
+    """
+    weights = _check_weights(weights, np.shape(spill_matrix)[1])
+
+    if weights.ndim == 1:
+        unmixer = SpectralUnmixer(spill_matrix, fluoro_indices=fluoro_indices, weights=weights)
+        weights = None
     else:
-        # if we were passed just the fluorescent data (including the non-true
-        # fluorescent channels), then only replace the indices given by the
-        # rows of the given spillover matrix.
-        data[:, :spill_matrix.shape[0]] = comp_data
+        unmixer = SpectralUnmixer(spill_matrix, fluoro_indices=fluoro_indices)
+
+    return unmixer.unmix(
+        event_data, out=out, chunk_size=chunk_size, n_threads=n_threads, executor=executor, weights=weights
+    )
+
+
+def compensate_spectral_nnls(
+        event_data,
+        spill_matrix,
+        fluoro_indices=None,
+        weights=None,
+        out=None,
+        chunk_size=None,
+        n_threads=None,
+        executor=None,
+        max_iter=100,
+        tol=1e-9
+):
+    """
+    Compensate spectral event data given a spectral spillover matrix using
+    non-negative least squares (NNLS), constraining the compensated values
+    of the true fluorescent channels to be >= 0. See `compensate_spectral_ols`
+    for the layout of the spectral matrix & the fluorescent channels.
 
-    return data
+    The events are solved in blocks, starting from the least squares solution.
+    Only the events with negative values are then solved with block principal
+    pivoting, batching events with the same set of non-zero fluorochromes.
+
+    :param event_data: NumPy array (or memmap) of the event data
+    :param spill_matrix: Compensation matrix as a NumPy array (without headers)
+    :param fluoro_indices: Optional list of indices of the fluorescent channels (only
+        these will be extracted & compensated). If None (default), all columns
+        will be compensated.
+    :param weights: Optional weight of each detector (1-D array, e.g. 1 / variance)
+        for a weighted fit. If None (default), the detectors are weighted equally.
+    :param out: Optional array (or memmap) to store the compensated events. May be
+        event_data to compensate in place.
+    :param chunk_size: Number of events compensated at a time. If None, DEFAULT_CHUNK_SIZE is used.
+    :param n_threads: Optional number of threads used to compensate chunks of events in parallel
+    :param executor: Optional concurrent.futures.Executor used to compensate chunks of events in parallel
+    :param max_iter: maximum number of pivoting iterations
+    :param tol: tolerance of the optimality conditions, relative to the largest values in the block
+
+    :return: NumPy array of compensated event data (out, if given). If fluoro_indices were given,
+        the data is returned with the column order given, with the non-fluorescent
+        columns unmodified.
+    """
+    unmixer = SpectralUnmixer(
+        spill_matrix,
+        fluoro_indices=fluoro_indices,
+        weights=weights,
+        non_negative=True,
+        max_iter=max_iter,
+        tol=tol
+    )
+
+    return unmixer.unmix(event_data, out=out, chunk_size=chunk_size, n_threads=n_threads, executor=executor)
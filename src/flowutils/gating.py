@@ -4,18 +4,194 @@ Utility functions related to gating operations
 import numpy as np
 # noinspection PyUnresolvedReferences
 from . import gating_c
+from ._parallel import run_chunked
+
+
+class GateNode(object):
+    """
+    Base class for the gates of a gate tree evaluated by `evaluate_gates()`.
+    Gates can also be used on their own to test points with `contains()`.
+
+    :param gate_id: ID of the gate, used as the key of its results (required in a gate tree)
+    :param dimensions: column indices of the events the gate is drawn on. If None,
+        the events are expected to only have the gate's columns, in order.
+    :param children: gates drawn on the events inside this gate
+    """
+    def __init__(self, gate_id=None, dimensions=None, children=None):
+        self.gate_id = gate_id
+        self.dimensions = None if dimensions is None else [int(d) for d in dimensions]
+        self.children = list(children) if children is not None else []
+
+    def __repr__(self):
+        return '%s(gate_id=%r)' % (self.__class__.__name__, self.gate_id)
+
+    def contains(self, points, n_threads=None, executor=None, output='mask', indices=None):
+        """
+        Determines whether points in an array are inside the gate
+
+        :param points: NumPy array of data points, with a column for each gate dimension
+        :param n_threads: Optional number of threads used to test chunks of points in parallel
+        :param executor: Optional concurrent.futures.Executor used to test chunks of points in parallel
+        :param output: 'mask' (default) for a boolean array, 'packed' for packed bits, or
+            'indices' ('indices32') for an np.intp (np.uint32) array of the indices of the points inside
+        :param indices: Optional indices of the points to test, e.g. the events inside a parent gate
+
+        :return: NumPy 1-D array of boolean values for each point (or packed bits, or indices). True is
+            inside the gate.
+        """
+        return self._test(np.asarray(points), None, output, indices, n_threads, executor)
+
+    def count(self, points, n_threads=None, executor=None):
+        """
+        Counts the points inside the gate, without making a mask of the points
+
+        :param points: NumPy array of data points, with a column for each gate dimension
+        :param n_threads: Optional number of threads used to test chunks of points in parallel
+        :param executor: Optional concurrent.futures.Executor used to test chunks of points in parallel
+
+        :return: number of points inside the gate
+        """
+        points = np.asarray(points)
+
+        return _accumulate_in_gate(self, lambda start, stop: points[start:stop], len(points), n_threads, executor)
+
+    def _populations(self, events, indices, n_threads=None, executor=None):
+        """
+        Returns a list of (gate, indices) tuples for the populations this gate divides
+        the events into, with the indices of the events in each population. Only the
+        events in indices (all the events if None) are tested. Most gates define a
+        single population.
+        """
+        return [(self, self._test(events, self.dimensions, 'indices', indices, n_threads, executor))]
+
+    def _test(self, points, columns, output, indices, n_threads, executor):
+        """
+        Tests the points (or the given columns of the points) in chunks, see `contains()`
+        """
+        def _c_test(chunk, point_count, results, subset):
+            return self._c_test(chunk, point_count, results, subset, columns)
+
+        return _test_points(_c_test, points, output, indices=indices, n_threads=n_threads, executor=executor)
+
+    def _c_test(self, points, point_count, results, subset, columns):
+        """
+        Calls the gating_c function testing points against the gate. Used by `contains()`
+        & `evaluate_gates()`.
+        """
+        raise TypeError("%s does not support testing points" % self.__class__.__name__)
+
+    def _accumulate(self, points, events=None, stats=None):
+        """
+        Counts the points inside the gate. If events are given (with a row for
+        each point), the statistics of the events inside are added to stats, a
+        `GateStats` instance. Used by `count()` & `stats_in_gate()`.
+        """
+        raise TypeError("%s does not support counts or statistics of its events" % self.__class__.__name__)
+
+
+class EllipsoidGate(GateNode):
+    """
+    An ellipsoid gate, for testing points for inclusion in a true ellipsoid in
+    n-dimensions. The inverse of the covariance matrix is computed once when
+    the gate is created, and reused each time points are tested, so a gate
+    applied to many samples (or chunks of a sample) is only factorised once.
+
+    :param covariance_matrix: Covariance matrix for the ellipsoid shape (NxN array)
+    :param means: center point of the ellipsoid for n-dimensions
+    :param distance_square: square of the Mahalanobis distance, controlling
+        the size of the ellipsoid. The distance square parameter is conceptually
+        similar to the number of standard deviations representing the boundary
+        for an n-dimensional distribution of points.
+    :param gate_id: ID of the gate, see `GateNode`
+    :param dimensions: column indices of the events the gate is drawn on, see `GateNode`
+    :param children: gates drawn on the events inside this gate
+    """
+    def __init__(self, covariance_matrix, means, distance_square, gate_id=None, dimensions=None, children=None):
+        super().__init__(gate_id=gate_id, dimensions=dimensions, children=children)
+
+        covariance_matrix = np.asarray(covariance_matrix, dtype=np.float64)
+        means = np.ascontiguousarray(means, dtype=np.float64)
+
+        if means.ndim != 1:
+            raise ValueError("means must be a 1-D array")
+        dim_count = len(means)
+        if covariance_matrix.shape != (dim_count, dim_count):
+            raise ValueError(
+                "covariance_matrix must have shape (%d, %d) to match the means, not %r"
+                % (dim_count, dim_count, covariance_matrix.shape)
+            )
+
+        self.covariance_matrix = covariance_matrix
+        self.means = means
+        self.distance_square = float(distance_square)
+
+        # Get the inverse covariance matrix, used to rotate the points instead of rotating the ellipse
+        self.inv_covariance_matrix = np.ascontiguousarray(np.linalg.inv(covariance_matrix))
+
+    def contains(self, points, n_threads=None, executor=None, output='mask', indices=None):
+        """
+        Determines whether points in an array are inside the ellipsoid. Points on
+        the edge are considered inclusive. The Mahalanobis distance of each point
+        is computed without making any intermediate (n x d) arrays, and float32
+        points are tested without making a float64 copy.
+
+        :param points: NumPy array of data points to test for ellipsoid inclusion,
+            with a column for each dimension of the ellipsoid
+        :param n_threads: Optional number of threads used to test chunks of points in parallel
+        :param executor: Optional concurrent.futures.Executor used to test chunks of points
+            in parallel (e.g. a shared ThreadPoolExecutor)
+        :param output: 'mask' (default) for a boolean array, 'packed' for a uint8 array
+            of the boolean values packed into bits (the same as np.packbits(mask)), or
+            'indices' ('indices32') for an np.intp (np.uint32) array of the indices of the points inside
+        :param indices: Optional indices of the points to test, see `points_in_polygon()`
+
+        :return: NumPy 1-D array of boolean values for each point (or packed bits, or indices). True is
+            inside ellipsoid.
+        """
+        points = self._check_points(points)
+
+        return self._test(points, None, output, indices, n_threads, executor)
+
+    def _check_points(self, points):
+        points = np.asarray(points)
+        if points.ndim != 2 or points.shape[1] != len(self.means):
+            raise ValueError(
+                "points must be a 2-D array with %d columns, not shape %r" % (len(self.means), points.shape)
+            )
+
+        return points
+
+    def _c_test(self, points, point_count, results, subset, columns):
+        return gating_c.points_in_ellipsoid(
+            self.inv_covariance_matrix, self.means, self.distance_square, points, point_count, results, subset, columns
+        )
+
+    def _accumulate(self, points, events=None, stats=None):
+        points = self._check_points(points)
+
+        return gating_c.stats_in_ellipsoid(
+            self.inv_covariance_matrix, self.means, self.distance_square, points, len(points),
+            *_stats_args(events, stats)
+        )
 
 
 def points_in_ellipsoid(
         ellipsoid_covariance_matrix,
         ellipsoid_means,
         ellipsoid_distance_square,
-        points
+        points,
+        n_threads=None,
+        executor=None,
+        output='mask',
+        indices=None
 ):
     """
     Determines whether points in an array are inside an ellipsoid. Points on the
     edge are considered inclusive. True ellipsoids in n-dimensions are supported.
 
+    To test several arrays of points against the same ellipsoid, create an
+    `EllipsoidGate` instead, so the covariance matrix is only inverted once.
+
     :param ellipsoid_covariance_matrix: Covariance matrix for the ellipsoid shape (NxN array)
     :param ellipsoid_means: center point of the ellipsoid for n-dimensions
     :param ellipsoid_distance_square: square of the Mahalanobis distance, controlling
@@ -23,41 +199,901 @@ def points_in_ellipsoid(
         similar to the number of standard deviations representing the boundary
         for an n-dimensional distribution of points.
     :param points: NumPy array of data points to test for ellipsoid inclusion
+    :param n_threads: Optional number of threads used to test chunks of points in parallel
+    :param executor: Optional concurrent.futures.Executor used to test chunks of points
+        in parallel (e.g. a shared ThreadPoolExecutor)
+    :param output: 'mask' (default) for a boolean array, 'packed' for a uint8 array
+        of the boolean values packed into bits (the same as np.packbits(mask)), or
+        'indices' ('indices32') for an np.intp (np.uint32) array of the indices of the points inside
+    :param indices: Optional indices of the points to test, see `points_in_polygon()`
 
-    :return: NumPy 1-D array of boolean values for each point. True is inside ellipsoid.
+    :return: NumPy 1-D array of boolean values for each point (or packed bits, or indices). True is
+        inside ellipsoid.
     """
     # we only take points that have already been filtered by the correct
     # columns (i.e. those columns that are included in the ellipsoid
+    gate = EllipsoidGate(ellipsoid_covariance_matrix, ellipsoid_means, ellipsoid_distance_square)
+
+    return gate.contains(points, n_threads=n_threads, executor=executor, output=output, indices=indices)
+
+
+# output options returning the indices of the points inside a gate, with their dtype
+_INDEX_OUTPUTS = {'indices': np.dtype(np.intp), 'indices32': np.dtype(np.uint32)}
+
+
+def _new_results(point_count, output, gate_count=None):
+    """
+    Allocates the array gate results are written to: a bool mask or,
+    for output='packed', a uint8 array of bits packed like np.packbits.
+    """
+    if output == 'mask':
+        shape = (point_count,) if gate_count is None else (point_count, gate_count)
+        return np.empty(shape, dtype=bool)
+    elif output == 'packed':
+        byte_count = (point_count + 7) // 8
+        shape = (byte_count,) if gate_count is None else (gate_count, byte_count)
+        return np.empty(shape, dtype=np.uint8)
+
+    raise ValueError("output must be 'mask', 'packed', 'indices' or 'indices32', not %r" % (output,))
+
+
+def _results_chunk(results, start, stop, output):
+    """
+    Returns the part of a results array for the points from start to stop. For packed
+    results, start must be a multiple of 8 so the chunk starts on a byte boundary.
+    """
+    if output == 'packed':
+        return results[..., start // 8:(stop + 7) // 8]
+
+    return results[start:stop]
+
+
+def _test_points(c_test, points, output, indices=None, gate_count=None, n_threads=None, executor=None):
+    """
+    Tests chunks of points against one gate, or gate_count gates, where
+    c_test(points, point_count, results, subset) calls a gating_c function.
+    If indices are given, only those points are tested, in chunks of the
+    indices, and a mask (or packed mask) has a value for each of the indices.
+    Indices of the points inside are returned as an array for each gate.
+    """
+    if indices is not None:
+        indices = np.asarray(indices)
+        if indices.size == 0:
+            indices = indices.astype(np.intp)
+        if indices.ndim != 1 or not np.issubdtype(indices.dtype, np.integer):
+            raise ValueError("indices must be a 1-D array of integer indices of the points")
+    tested_count = len(points) if indices is None else len(indices)
 
-    # First, subtract ellipse centers (consider the ellipse at the origin)
-    points_translated = points - ellipsoid_means
+    if output in _INDEX_OUTPUTS:
+        index_dtype = _INDEX_OUTPUTS[output]
+        chunk_indices = {}
 
-    # Get the inverse covariance matrix
-    ell_cov_mat_inv = np.linalg.inv(ellipsoid_covariance_matrix)
+        def _test_chunk(start, stop):
+            if indices is not None:
+                chunk_indices[start] = c_test(points, stop - start, index_dtype, indices[start:stop])
+                return
 
-    # Matrix multiplication of translated points by inverse covariance matrix,
-    # rotates the points instead of rotating the ellipse
-    points_rot = np.dot(points_translated, ell_cov_mat_inv)
-    points_rot = points_rot * points_translated
+            found = c_test(points[start:stop], stop - start, index_dtype, None)
+            # the C function returns the rows of the chunk, offset them to the rows of the points
+            for gate_indices in (found if gate_count is not None else [found]):
+                gate_indices += start
+            chunk_indices[start] = found
 
-    # Points are inclusive if they are <= than the distance square
-    # since boundary points are considered inclusive
-    results = points_rot.sum(axis=1) <= ellipsoid_distance_square
+        # the C function releases the GIL, so chunks of points can be tested in parallel threads
+        run_chunked(_test_chunk, tested_count, n_threads=n_threads, executor=executor)
+
+        return _join_indices([chunk_indices[start] for start in sorted(chunk_indices)], gate_count)
+
+    results = _new_results(tested_count, output, gate_count)
+
+    def _test_chunk(start, stop):
+        chunk_results = _results_chunk(results, start, stop, output)
+        if indices is None:
+            c_test(points[start:stop], stop - start, chunk_results, None)
+        else:
+            c_test(points, stop - start, chunk_results, indices[start:stop])
+
+    # the C function releases the GIL, so chunks of points can be tested in parallel threads
+    run_chunked(_test_chunk, tested_count, n_threads=n_threads, executor=executor, chunk_multiple=8)
 
     return results
 
 
-def points_in_polygon(poly_vertices, points):
+def _join_indices(chunks, gate_count):
+    """
+    Joins the indices found in each chunk of points, in order. For several
+    gates, each chunk has a list of indices for each gate.
+    """
+    if gate_count is None:
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+    return [gate_chunks[0] if len(gate_chunks) == 1 else np.concatenate(gate_chunks) for gate_chunks in zip(*chunks)]
+
+
+def points_in_polygon(poly_vertices, points, n_threads=None, executor=None, output='mask', indices=None):
     """
     Determines whether points in an array are inside a polygon. Points on the
     edge of the polygon are considered inclusive. This function uses the
     winding number method and is robust to complex polygons with crossing
     boundaries, including the presence of 'holes' created by boundary crosses.
 
+    Polygons with many vertices (e.g. gates drawn from density contours) are
+    first indexed by dividing the polygon into horizontal slabs, so each point
+    is only tested against the edges in its slab. The results are identical
+    to testing every edge.
+
+    float32 points are tested natively without making a float64 copy. The
+    results are identical to testing the same points converted to float64.
+
+    :param poly_vertices: Polygon vertices (NumPy array of 2-D points)
+    :param points: NumPy array of data points to test for polygon inclusion
+    :param n_threads: Optional number of threads used to test chunks of points in parallel
+    :param executor: Optional concurrent.futures.Executor used to test chunks of points
+        in parallel (e.g. a shared ThreadPoolExecutor)
+    :param output: 'mask' (default) for a boolean array, or 'packed' for a uint8 array
+        of the boolean values packed into bits, the same as np.packbits(mask). Packed
+        masks use 1/8 of the memory and can be combined with the packed_mask functions.
+        'indices' returns an np.intp array of the indices of the points inside, the
+        same as np.flatnonzero(mask), with the indices written as the points are tested,
+        so rare populations only use memory for the points inside. 'indices32' returns
+        np.uint32 indices, using half the memory, for arrays of fewer than 2^32 points.
+    :param indices: Optional array of the indices of the points to test, e.g. the indices
+        of the events inside a parent gate. Only those points are read, without copying
+        them. A mask (or packed mask) has a value for each of the indices, while output
+        'indices' returns the indices (of points) of those inside the polygon.
+
+    :return: NumPy 1-D array of boolean values for each point (or packed bits, or indices). True is
+        inside polygon.
+    """
+    return PolygonGate(poly_vertices).contains(
+        points, n_threads=n_threads, executor=executor, output=output, indices=indices
+    )
+
+
+def points_in_polygons(poly_vertices_list, points, n_threads=None, executor=None, output='mask', indices=None):
+    """
+    Determines whether points in an array are inside each of several polygons,
+    e.g. sibling polygon gates drawn on the same 2-D projection. The results
+    are identical to calling `points_in_polygon()` for each polygon, but the
+    points are only read once, with each block of points tested against
+    every polygon.
+
+    :param poly_vertices_list: list of polygon vertices (each a NumPy array of 2-D points)
+    :param points: NumPy array of data points to test for polygon inclusion
+    :param n_threads: Optional number of threads used to test chunks of points in parallel
+    :param executor: Optional concurrent.futures.Executor used to test chunks of points
+        in parallel (e.g. a shared ThreadPoolExecutor)
+    :param output: 'mask' (default) for a boolean array, 'packed' for a uint8 array
+        with a row of packed bits for each polygon (the same as np.packbits(mask.T, axis=1)),
+        or 'indices' ('indices32') for a list of np.intp (np.uint32) arrays of the indices
+        of the points inside each polygon
+    :param indices: Optional indices of the points to test, see `points_in_polygon()`
+
+    :return: NumPy 2-D array of boolean values, with a row for each point and
+        a column for each polygon. True is inside polygon. For packed output,
+        a row of packed bits for each polygon. For indices, a list of arrays.
+    """
+    points = np.asarray(points)
+    poly_vertices_list = [np.ascontiguousarray(v, dtype=np.float64) for v in poly_vertices_list]
+
+    def _c_test(chunk, point_count, results, subset):
+        return gating_c.points_in_polygons(poly_vertices_list, chunk, point_count, results, subset)
+
+    return _test_points(
+        _c_test, points, output, indices=indices, gate_count=len(poly_vertices_list),
+        n_threads=n_threads, executor=executor
+    )
+
+
+def _rectangle_bounds(bounds):
+    """
+    Converts a sequence of (min, max) pairs to arrays of the minimums and
+    maximums, with NaN for the open ends (None).
+    """
+    try:
+        bounds = [(lo, hi) for lo, hi in bounds]
+    except (TypeError, ValueError):
+        raise ValueError("bounds must be a sequence of (min, max) pairs, one for each dimension")
+
+    mins = np.array([np.nan if lo is None else lo for lo, _ in bounds], dtype=np.float64)
+    maxs = np.array([np.nan if hi is None else hi for _, hi in bounds], dtype=np.float64)
+
+    return mins, maxs
+
+
+def points_in_rectangle(bounds, points, n_threads=None, executor=None, output='mask', indices=None):
+    """
+    Determines whether points in an array are inside a rectangle (range gate)
+    in n-dimensions. Following GatingML, the minimum of each range is inclusive
+    and the maximum is exclusive, i.e. min <= x < max. Each point is read once,
+    with all the dimensions tested in a single pass, and no temporary masks.
+
+    :param bounds: sequence of (min, max) pairs, one for each column of points. Use
+        None for an open end, e.g. [(100, None), (None, 5000)]. A dimension open at
+        both ends does not constrain the points.
+    :param points: NumPy array of data points to test for rectangle inclusion, with
+        a column for each pair of bounds
+    :param n_threads: Optional number of threads used to test chunks of points in parallel
+    :param executor: Optional concurrent.futures.Executor used to test chunks of points
+        in parallel (e.g. a shared ThreadPoolExecutor)
+    :param output: 'mask' (default) for a boolean array, 'packed' for a uint8 array
+        of the boolean values packed into bits (the same as np.packbits(mask)), or
+        'indices' ('indices32') for an np.intp (np.uint32) array of the indices of the points inside
+    :param indices: Optional indices of the points to test, see `points_in_polygon()`
+
+    :return: NumPy 1-D array of boolean values for each point (or packed bits, or indices). True is
+        inside rectangle.
+    """
+    mins, maxs = _rectangle_bounds(bounds)
+
+    points = np.asarray(points)
+    if points.ndim != 2 or points.shape[1] != len(mins):
+        raise ValueError("points must be a 2-D array with %d columns, not shape %r" % (len(mins), points.shape))
+
+    def _c_test(chunk, point_count, results, subset):
+        return gating_c.points_in_rectangle(mins, maxs, chunk, point_count, results, subset)
+
+    return _test_points(_c_test, points, output, indices=indices, n_threads=n_threads, executor=executor)
+
+
+def packed_mask_and(packed_a, packed_b, out=None):
+    """
+    Combines packed masks, True where both masks are True (e.g. events in both gates)
+
+    :param packed_a: packed mask (uint8 array, as returned by a gating function with output='packed')
+    :param packed_b: packed mask for the same events
+    :param out: Optional uint8 array to store the result, may be one of the input masks
+
+    :return: packed mask
+    """
+    return np.bitwise_and(packed_a, packed_b, out=out)
+
+
+def packed_mask_or(packed_a, packed_b, out=None):
+    """
+    Combines packed masks, True where either mask is True (e.g. events in either gate)
+
+    :param packed_a: packed mask (uint8 array, as returned by a gating function with output='packed')
+    :param packed_b: packed mask for the same events
+    :param out: Optional uint8 array to store the result, may be one of the input masks
+
+    :return: packed mask
+    """
+    return np.bitwise_or(packed_a, packed_b, out=out)
+
+
+def packed_mask_not(packed, point_count, out=None):
+    """
+    Inverts a packed mask (e.g. events outside a gate). The padding bits of
+    the last byte stay False, so counts of the inverted mask are correct.
+
+    :param packed: packed mask (uint8 array, as returned by a gating function with output='packed')
+    :param point_count: number of points in the mask
+    :param out: Optional uint8 array to store the result, may be the input mask
+
+    :return: packed mask
+    """
+    out = np.invert(packed, out=out)
+
+    padding = -point_count % 8
+    if padding:
+        out[..., -1] &= np.uint8((0xFF << padding) & 0xFF)
+
+    return out
+
+
+def packed_mask_count(packed):
+    """
+    Counts the True values in a packed mask (e.g. the number of events in a gate)
+
+    :param packed: packed mask (uint8 array, as returned by a gating function with output='packed')
+
+    :return: number of True values, or a NumPy array of counts for each row of a 2-D packed mask
+    """
+    packed = np.asarray(packed)
+    counts = np.zeros(packed.shape[:-1], dtype=np.int64)
+
+    # count in chunks to limit the size of the temporary array of bit counts
+    chunk_size = 1 << 20
+    for start in range(0, packed.shape[-1], chunk_size):
+        counts += np.bitwise_count(packed[..., start:start + chunk_size]).sum(axis=-1, dtype=np.int64)
+
+    if counts.ndim == 0:
+        return int(counts)
+
+    return counts
+
+
+def unpack_mask(packed, point_count):
+    """
+    Expands a packed mask to a boolean array
+
+    :param packed: packed mask (uint8 array, as returned by a gating function with output='packed')
+    :param point_count: number of points in the mask
+
+    :return: NumPy array of boolean values, for a 2-D packed mask a row for each polygon
+    """
+    return np.unpackbits(packed, axis=-1, count=point_count).view(bool)
+
+
+class RectangleGate(GateNode):
+    """
+    A rectangle (range) gate in n-dimensions, see `points_in_rectangle()`
+
+    :param bounds: sequence of (min, max) pairs, one for each gate dimension, with
+        None for an open end. The minimum is inclusive and the maximum exclusive.
+    :param gate_id: ID of the gate, see `GateNode`
+    :param dimensions: column indices of the events the gate is drawn on, see `GateNode`
+    :param children: gates drawn on the events inside this gate
+    """
+    def __init__(self, bounds, gate_id=None, dimensions=None, children=None):
+        super().__init__(gate_id=gate_id, dimensions=dimensions, children=children)
+
+        self.mins, self.maxs = _rectangle_bounds(bounds)
+        self.bounds = [
+            (None if np.isnan(lo) else lo, None if np.isnan(hi) else hi) for lo, hi in zip(self.mins, self.maxs)
+        ]
+
+    def contains(self, points, n_threads=None, executor=None, output='mask', indices=None):
+        points = self._check_points(points)
+
+        return self._test(points, None, output, indices, n_threads, executor)
+
+    def _check_points(self, points):
+        points = np.asarray(points)
+        if points.ndim != 2 or points.shape[1] != len(self.mins):
+            raise ValueError(
+                "points must be a 2-D array with %d columns, not shape %r" % (len(self.mins), points.shape)
+            )
+
+        return points
+
+    def _c_test(self, points, point_count, results, subset, columns):
+        return gating_c.points_in_rectangle(self.mins, self.maxs, points, point_count, results, subset, columns)
+
+    def _accumulate(self, points, events=None, stats=None):
+        points = self._check_points(points)
+
+        return gating_c.stats_in_rectangle(self.mins, self.maxs, points, len(points), *_stats_args(events, stats))
+
+
+class PolygonGate(GateNode):
+    """
+    A 2-D polygon gate, see `points_in_polygon()`
+
+    :param vertices: Polygon vertices (NumPy array of 2-D points)
+    :param gate_id: ID of the gate, see `GateNode`
+    :param dimensions: column indices of the events the gate is drawn on, see `GateNode`
+    :param children: gates drawn on the events inside this gate
+    """
+    def __init__(self, vertices, gate_id=None, dimensions=None, children=None):
+        super().__init__(gate_id=gate_id, dimensions=dimensions, children=children)
+
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float64)
+        if self.vertices.ndim != 2 or self.vertices.shape[1] != 2:
+            raise ValueError("vertices must be a 2-D array of shape (n, 2), not %r" % (self.vertices.shape,))
+
+    def _c_test(self, points, point_count, results, subset, columns):
+        return gating_c.points_in_polygon(
+            self.vertices, len(self.vertices), points, point_count, results, subset, columns
+        )
+
+    def _accumulate(self, points, events=None, stats=None):
+        return gating_c.stats_in_polygon(self.vertices, points, len(points), *_stats_args(events, stats))
+
+
+class Quadrant(GateNode):
+    """
+    One of the populations of a `QuadrantGate`
+
+    :param location: a point inside the quadrant, with a value for each dimension
+        of the quadrant gate
+    :param gate_id: ID of the quadrant, used as the key of its results
+    :param children: gates drawn on the events inside this quadrant
+    """
+    def __init__(self, location, gate_id=None, children=None):
+        super().__init__(gate_id=gate_id, children=children)
+
+        self.location = np.asarray(location, dtype=np.float64)
+
+    def contains(self, points, n_threads=None, executor=None, output='mask', indices=None):
+        raise TypeError("A quadrant is a population of its quadrant gate, evaluate it with evaluate_gates()")
+
+
+class QuadrantGate(GateNode):
+    """
+    A quadrant gate, dividing the events into regions with divider values on
+    each dimension. Like range gates, the regions include their lower divider
+    and exclude their upper divider, and NaN values are not in any quadrant.
+    The regions of all the events are computed in one pass, then each quadrant
+    selects its events.
+
+    :param dividers: sequence of divider values for each dimension (a single value
+        or a sequence of values)
+    :param quadrants: list of `Quadrant` populations
+    :param gate_id: ID of the gate. Quadrant gates don't have results of their own,
+        only their quadrants do.
+    :param dimensions: column indices of the events the gate is drawn on, see `GateNode`
+    """
+    def __init__(self, dividers, quadrants, gate_id=None, dimensions=None):
+        super().__init__(gate_id=gate_id, dimensions=dimensions)
+
+        self.dividers = [np.sort(np.atleast_1d(np.asarray(d, dtype=np.float64))) for d in dividers]
+        self.quadrants = list(quadrants)
+
+        for quadrant in self.quadrants:
+            if quadrant.location.shape != (len(self.dividers),):
+                raise ValueError(
+                    "Quadrant %r location must have %d values, one for each divided dimension"
+                    % (quadrant.gate_id, len(self.dividers))
+                )
+
+    def regions(self, points):
+        """
+        Returns the region of each point, as a single index combining the position
+        of the point between the dividers of each dimension. NaN values are in region -1.
+
+        :param points: NumPy array of data points, with a column for each divided dimension
+
+        :return: NumPy 1-D array of region indices
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, len(self.dividers))
+        regions = np.zeros(len(points), dtype=np.intp)
+
+        for k, dividers in enumerate(self.dividers):
+            # values equal to a divider are in the region above it
+            regions *= len(dividers) + 1
+            regions += np.searchsorted(dividers, points[:, k], side='right')
+
+        regions[np.isnan(points).any(axis=1)] = -1
+
+        return regions
+
+    def contains(self, points, n_threads=None, executor=None, output='mask', indices=None):
+        raise TypeError("A quadrant gate has no single population, evaluate its quadrants with evaluate_gates()")
+
+    def _populations(self, events, indices, n_threads=None, executor=None):
+        # the regions are computed for a copy of the gate's columns of the events in indices
+        regions = self.regions(_gate_points(events, indices, self.dimensions))
+
+        populations = []
+        for quadrant in self.quadrants:
+            in_quadrant = np.flatnonzero(regions == self.regions(quadrant.location)[0])
+            populations.append((quadrant, in_quadrant if indices is None else indices[in_quadrant]))
+
+        return populations
+
+
+class BooleanGate(GateNode):
+    """
+    A boolean gate, combining the results of other gates in the gate tree. Like
+    any gate, a boolean gate only includes events from its parent gate.
+
+    :param operation: 'and', 'or', or 'not'
+    :param arguments: IDs of the gates to combine ('not' takes a single gate)
+    :param gate_id: ID of the gate, see `GateNode`
+    :param children: gates drawn on the events inside this gate
+    """
+    OPERATIONS = ('and', 'or', 'not')
+
+    def __init__(self, operation, arguments, gate_id=None, children=None):
+        super().__init__(gate_id=gate_id, children=children)
+
+        if operation not in self.OPERATIONS:
+            raise ValueError("operation must be 'and', 'or', or 'not', not %r" % (operation,))
+        self.operation = operation
+        self.arguments = list(arguments)
+
+        if operation == 'not' and len(self.arguments) != 1:
+            raise ValueError("A 'not' boolean gate takes a single argument")
+        elif len(self.arguments) == 0:
+            raise ValueError("A boolean gate needs at least one argument")
+
+    def contains(self, points, n_threads=None, executor=None, output='mask', indices=None):
+        raise TypeError("A boolean gate depends on other gates, evaluate it with evaluate_gates()")
+
+    def combine(self, argument_masks):
+        """
+        Combines the masks of the argument gates
+
+        :param argument_masks: list of boolean arrays, one for each argument gate
+
+        :return: NumPy 1-D array of boolean values
+        """
+        if self.operation == 'not':
+            return ~argument_masks[0]
+        elif self.operation == 'and':
+            return np.logical_and.reduce(argument_masks)
+
+        return np.logical_or.reduce(argument_masks)
+
+
+def _gate_points(events, indices, dimensions):
+    """
+    Returns the events in indices (all the events if None) for the dimensions
+    of a gate, copying only the selected events & columns.
+    """
+    if indices is None:
+        return events if dimensions is None else events[:, dimensions]
+    elif dimensions is None:
+        return events[indices]
+
+    return events[np.ix_(indices, dimensions)]
+
+
+def evaluate_gates(gates, events, n_threads=None, executor=None, output='mask'):
+    """
+    Evaluates a tree of gates. Each gate is only tested against the events
+    inside its parent gate: the indices of the parent's events are passed to
+    the C functions, which read only those events (in place, without copying
+    them) and return the indices of the events inside the gate. The work &
+    memory for each gate scale with the number of events in its parent
+    instead of the total number of events.
+
+    Boolean gates are evaluated once the gates they depend on have been evaluated.
+
+    :param gates: list of the top-level gates (`GateNode` instances), with their
+        child gates in the `children` of each gate (or each `Quadrant`)
+    :param events: NumPy array of events, with a column for each parameter. The
+        `dimensions` of the gates are column indices into this array.
+    :param n_threads: Optional number of threads used by each gate to test chunks of events in parallel
+    :param executor: Optional concurrent.futures.Executor used by each gate to test chunks of events in parallel
+    :param output: 'mask' (default) for a boolean mask of the events in each gate, or 'indices'
+        for an np.intp array of the indices of the events in each gate, which only uses memory
+        for the events inside (e.g. for rare populations)
+
+    :return: tuple of 2 dictionaries keyed by gate ID: the boolean mask (or indices) of
+        the events in each gate, and the number of events in each gate
+    """
+    if output not in ('mask', 'indices'):
+        raise ValueError("output must be 'mask' or 'indices', not %r" % (output,))
+
+    events = np.asarray(events)
+    if events.ndim != 2:
+        raise ValueError("events must be a 2-D array, not shape %r" % (events.shape,))
+    event_count = len(events)
+
+    gate_indices = {}
+    masks = {}
+    pending = []
+
+    def _mask(gate_id):
+        if gate_id not in masks:
+            mask = np.zeros(event_count, dtype=bool)
+            mask[gate_indices[gate_id]] = True
+            masks[gate_id] = mask
+
+        return masks[gate_id]
+
+    def _add_population(gate, population_indices):
+        if gate.gate_id is None:
+            raise ValueError("Every gate in a gate tree needs a gate_id")
+        if gate.gate_id in gate_indices:
+            raise ValueError("Duplicate gate_id %r in the gate tree" % (gate.gate_id,))
+
+        gate_indices[gate.gate_id] = population_indices
+
+        for child in gate.children:
+            _evaluate(child, population_indices)
+
+    def _evaluate(gate, indices):
+        if isinstance(gate, BooleanGate):
+            if not all(gate_id in gate_indices for gate_id in gate.arguments):
+                # evaluated after the gates it depends on
+                pending.append((gate, indices))
+                return
+
+            if indices is None:
+                argument_masks = [_mask(gate_id) for gate_id in gate.arguments]
+                _add_population(gate, np.flatnonzero(gate.combine(argument_masks)))
+            else:
+                # whether each of the parent's events is in the argument gates (the indices are sorted)
+                argument_masks = [
+                    np.isin(indices, gate_indices[gate_id], assume_unique=True) for gate_id in gate.arguments
+                ]
+                _add_population(gate, indices[gate.combine(argument_masks)])
+            return
+
+        for population, population_indices in gate._populations(
+                events, indices, n_threads=n_threads, executor=executor):
+            _add_population(population, population_indices)
+
+    for gate in gates:
+        _evaluate(gate, None)
+
+    while pending:
+        waiting = pending
+        pending = []
+        evaluated_count = len(gate_indices)
+        for gate, indices in waiting:
+            _evaluate(gate, indices)
+
+        if len(gate_indices) == evaluated_count:
+            missing = sorted(
+                set(gate_id for gate, _ in pending for gate_id in gate.arguments if gate_id not in gate_indices),
+                key=str
+            )
+            raise ValueError("Boolean gates refer to gates missing from the gate tree: %r" % (missing,))
+
+    counts = {gate_id: len(indices) for gate_id, indices in gate_indices.items()}
+    if output == 'indices':
+        return gate_indices, counts
+
+    masks = {gate_id: _mask(gate_id) for gate_id in gate_indices}
+
+    return masks, counts
+
+
+# events are tested in chunks of this size when counting or accumulating statistics,
+# so only the gate's columns of a chunk are copied at a time
+_ACCUMULATE_CHUNK_SIZE = 65536
+
+
+class GateStats(object):
+    """
+    Summary statistics of the events inside a gate, accumulated by `stats_in_gate()`
+    while the events are tested, without making a mask or copying the events inside:
+
+    - the number of events
+    - the sum & sum of squares of each column, for the means & variances
+    - optional histograms of each column, with evenly spaced bins over a fixed range,
+      for the medians & other quantiles
+
+    Statistics of the same columns, e.g. accumulated for each sample of a batch,
+    are combined with `merge`.
+
+    :param columns: column indices of the events to accumulate statistics for
+    :param bins: Optional number of histogram bins for each column
+    :param ranges: (min, max) histogram range for each column, required with bins.
+        Like np.histogram, values outside the range are not counted in the histograms.
+    """
+    def __init__(self, columns, bins=None, ranges=None):
+        self.columns = np.array(columns, dtype=np.intp).reshape(-1)
+        column_count = len(self.columns)
+
+        self.count = 0
+        self.sums = np.zeros(column_count, dtype=np.float64)
+        self.sums_sq = np.zeros(column_count, dtype=np.float64)
+
+        self.bins = bins
+        self.ranges = None
+        self.histograms = None
+        if bins is not None:
+            if bins < 1:
+                raise ValueError("bins must be a positive integer")
+            if ranges is None:
+                raise ValueError("ranges are required for histograms, a (min, max) pair for each column")
+
+            self.ranges = np.array(ranges, dtype=np.float64).reshape(-1, 2)
+            if len(self.ranges) != column_count:
+                raise ValueError("ranges must have a (min, max) pair for each of the %d columns" % column_count)
+            if not np.all(self.ranges[:, 0] < self.ranges[:, 1]):
+                raise ValueError("Each histogram range must have a min less than its max")
+
+            self.histograms = np.zeros((column_count, bins), dtype=np.int64)
+
+    def __repr__(self):
+        return '%s(columns=%d, count=%d)' % (self.__class__.__name__, len(self.columns), self.count)
+
+    def _empty_copy(self):
+        return GateStats(self.columns, bins=self.bins, ranges=self.ranges)
+
+    @property
+    def mean(self):
+        """
+        Mean of each column, NaN if there are no events
+        """
+        if self.count == 0:
+            return np.full(len(self.columns), np.nan)
+
+        return self.sums / self.count
+
+    @property
+    def variance(self):
+        """
+        Variance of each column (population variance, like np.var), NaN if there are no events
+        """
+        if self.count == 0:
+            return np.full(len(self.columns), np.nan)
+
+        mean = self.sums / self.count
+
+        return np.maximum(self.sums_sq / self.count - mean * mean, 0.0)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def bin_edges(self):
+        """
+        Edges of the histogram bins, an array of shape (columns, bins + 1)
+        """
+        if self.histograms is None:
+            return None
+
+        return np.array([np.linspace(lo, hi, self.bins + 1) for lo, hi in self.ranges])
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+    def quantile(self, q):
+        """
+        Estimates quantiles of each column from the histograms, interpolating
+        linearly within the bins, so the error is at most the width of a bin.
+        Only the values within the histogram ranges are included.
+
+        :param q: quantile or sequence of quantiles, between 0 and 1
+
+        :return: NumPy array of shape (columns,) for a single quantile, otherwise
+            (columns, len(q)). NaN for columns without values in the histogram range.
+        """
+        if self.histograms is None:
+            raise ValueError("Quantiles are estimated from the histograms, accumulate the statistics with bins")
+
+        q_array = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if np.any((q_array < 0) | (q_array > 1)):
+            raise ValueError("Quantiles must be between 0 and 1")
+
+        result = np.full((len(self.columns), len(q_array)), np.nan)
+        for i, (histogram, edges) in enumerate(zip(self.histograms, self.bin_edges)):
+            total = histogram.sum()
+            if total == 0:
+                continue
+
+            cumulative = np.concatenate([[0], np.cumsum(histogram)])
+            result[i] = np.interp(q_array * total, cumulative, edges)
+
+        if np.ndim(q) == 0:
+            return result[:, 0]
+
+        return result
+
+    def merge(self, other):
+        """
+        Adds the statistics of another GateStats instance of the same columns & bins
+
+        :param other: GateStats instance
+
+        :return: this GateStats instance
+        """
+        same_histograms = (self.histograms is None and other.histograms is None) or (
+            self.histograms is not None and other.histograms is not None and
+            self.histograms.shape == other.histograms.shape and np.array_equal(self.ranges, other.ranges)
+        )
+        if not np.array_equal(self.columns, other.columns) or not same_histograms:
+            raise ValueError("Cannot merge statistics of different columns or histogram bins")
+
+        self.count += other.count
+        self.sums += other.sums
+        self.sums_sq += other.sums_sq
+        if self.histograms is not None:
+            self.histograms += other.histograms
+
+        return self
+
+
+def _stats_args(events, stats):
+    """
+    Returns the trailing arguments of the gating_c.stats_in_* functions: none to
+    only count the points inside a gate, or the events & accumulators of stats
+    """
+    if events is None:
+        return ()
+
+    return events, stats.columns, stats.sums, stats.sums_sq, stats.histograms, stats.ranges
+
+
+def _accumulate_in_gate(gate, get_points, event_count, n_threads, executor, events=None, stats=None):
+    """
+    Counts the points inside a gate, testing chunks of events at a time, where
+    get_points(start, stop) returns the points of the events from start to stop.
+    If events are given, the statistics of the events inside are added to stats.
+    """
+    chunk_results = []
+
+    def _accumulate_chunk(start, stop):
+        chunk_count = 0
+        chunk_stats = None if stats is None else stats._empty_copy()
+
+        for chunk_start in range(start, stop, _ACCUMULATE_CHUNK_SIZE):
+            chunk_stop = min(chunk_start + _ACCUMULATE_CHUNK_SIZE, stop)
+            points = get_points(chunk_start, chunk_stop)
+            chunk_events = None if events is None else events[chunk_start:chunk_stop]
+            chunk_count += gate._accumulate(points, chunk_events, chunk_stats)
+
+        if chunk_stats is not None:
+            chunk_stats.count = chunk_count
+        chunk_results.append((chunk_count, chunk_stats))
+
+    # the C functions release the GIL, so chunks of events can be tested in parallel threads
+    run_chunked(_accumulate_chunk, event_count, n_threads=n_threads, executor=executor)
+
+    for _, chunk_stats in chunk_results:
+        if chunk_stats is not None:
+            stats.merge(chunk_stats)
+
+    return sum(count for count, _ in chunk_results)
+
+
+def count_in_polygon(poly_vertices, points, n_threads=None, executor=None):
+    """
+    Counts the points inside a polygon, the same as the number of True values
+    returned by `points_in_polygon()`, without making a mask of the points.
+
     :param poly_vertices: Polygon vertices (NumPy array of 2-D points)
     :param points: NumPy array of data points to test for polygon inclusion
+    :param n_threads: Optional number of threads used to test chunks of points in parallel
+    :param executor: Optional concurrent.futures.Executor used to test chunks of points
+        in parallel (e.g. a shared ThreadPoolExecutor)
+
+    :return: number of points inside the polygon
+    """
+    return PolygonGate(poly_vertices).count(points, n_threads=n_threads, executor=executor)
+
 
-    :return: NumPy 1-D array of boolean values for each point. True is inside polygon.
+def count_in_ellipsoid(
+        ellipsoid_covariance_matrix,
+        ellipsoid_means,
+        ellipsoid_distance_square,
+        points,
+        n_threads=None,
+        executor=None
+):
     """
-    wind_counts = gating_c.points_in_polygon(poly_vertices, len(poly_vertices), points, len(points))
-    return wind_counts % 2 != 0
+    Counts the points inside an ellipsoid, the same as the number of True values
+    returned by `points_in_ellipsoid()`, without making a mask of the points.
+
+    :param ellipsoid_covariance_matrix: Covariance matrix for the ellipsoid shape (NxN array)
+    :param ellipsoid_means: center point of the ellipsoid for n-dimensions
+    :param ellipsoid_distance_square: square of the Mahalanobis distance, controlling
+        the size of the ellipsoid
+    :param points: NumPy array of data points to test for ellipsoid inclusion
+    :param n_threads: Optional number of threads used to test chunks of points in parallel
+    :param executor: Optional concurrent.futures.Executor used to test chunks of points
+        in parallel (e.g. a shared ThreadPoolExecutor)
+
+    :return: number of points inside the ellipsoid
+    """
+    gate = EllipsoidGate(ellipsoid_covariance_matrix, ellipsoid_means, ellipsoid_distance_square)
+
+    return gate.count(points, n_threads=n_threads, executor=executor)
+
+
+def stats_in_gate(gate, events, columns=None, bins=None, ranges=None, stats=None, n_threads=None, executor=None):
+    """
+    Computes summary statistics of the events inside a gate while testing the
+    events, without making a mask or copying the events inside. The events are
+    tested in chunks, so the extra memory used doesn't grow with the number of
+    events, e.g. for large memory-mapped files.
+
+    :param gate: a `PolygonGate`, `EllipsoidGate` or `RectangleGate`. Its `dimensions`
+        are the column indices of the events the gate is drawn on.
+    :param events: NumPy array of events, with a column for each parameter
+    :param columns: column indices of the events to compute statistics for. If None, all columns.
+    :param bins: Optional number of histogram bins for each column, for medians & other quantiles
+    :param ranges: (min, max) histogram range for each column, required with bins
+    :param stats: Optional `GateStats` instance to add the statistics to, e.g. for the
+        statistics of a batch of samples. If given, its columns & histogram bins are used.
+    :param n_threads: Optional number of threads used to test chunks of events in parallel
+    :param executor: Optional concurrent.futures.Executor used to test chunks of events in parallel
+
+    :return: `GateStats` instance
+    """
+    events = np.asarray(events)
+    if events.ndim != 2:
+        raise ValueError("events must be a 2-D array, not shape %r" % (events.shape,))
+
+    if stats is None:
+        if columns is None:
+            columns = range(events.shape[1])
+        stats = GateStats(columns, bins=bins, ranges=ranges)
+
+    def _get_points(start, stop):
+        return _gate_points(events[start:stop], None, gate.dimensions)
+
+    # the statistics of each chunk of events (with their counts) are merged into stats
+    _accumulate_in_gate(gate, _get_points, len(events), n_threads, executor, events=events, stats=stats)
+
+    return stats
@@ -5,11 +5,11 @@
 
 static PyObject *wrap_calc_wind_count(PyObject *self, PyObject *args) {
     double point_x, point_y;
-    int vert_count;
+    Py_ssize_t vert_count;
     PyObject *poly_vertices;
 
     // parse the input args tuple
-    if (!PyArg_ParseTuple(args, "ddiO!", &point_x, &point_y, &vert_count, &PyArray_Type, &poly_vertices)) {
+    if (!PyArg_ParseTuple(args, "ddnO!", &point_x, &point_y, &vert_count, &PyArray_Type, &poly_vertices)) {
         return NULL;
     }
 
@@ -18,6 +18,11 @@ static PyObject *wrap_calc_wind_count(PyObject *self, PyObject *args) {
         PyErr_SetString(PyExc_RuntimeError, "Failed to convert poly_vertices to NumPy array");
         return NULL;
     }
+    if (vert_count < 1 || vert_count * 2 > PyArray_SIZE(poly_vert_array)) {
+        Py_DECREF(poly_vert_array);
+        PyErr_SetString(PyExc_ValueError, "vert_count does not match the number of poly_vertices");
+        return NULL;
+    }
     double *poly_vertices_c = (double *) PyArray_DATA(poly_vert_array);
 
     // now we can call our function!
@@ -28,14 +33,381 @@ static PyObject *wrap_calc_wind_count(PyObject *self, PyObject *args) {
     return Py_BuildValue("i", wind_count);
 }
 
+static PyArrayObject *convert_points(PyObject *points, Py_ssize_t point_count, npy_intp dim_count, int *points_type) {
+    // float32 points are tested natively, anything else is converted to float64
+    *points_type = NPY_DOUBLE;
+    if (PyArray_Check(points) && PyArray_TYPE((PyArrayObject *) points) == NPY_FLOAT) {
+        *points_type = NPY_FLOAT;
+    }
+
+    PyArrayObject *points_array = (PyArrayObject *) PyArray_FROM_OTF(points, *points_type, NPY_ARRAY_IN_ARRAY);
+    if (!points_array) {
+        PyErr_SetString(PyExc_RuntimeError, "Failed to convert points to NumPy array");
+        return NULL;
+    }
+
+    if (point_count < 0 || point_count * dim_count > PyArray_SIZE(points_array)) {
+        Py_DECREF(points_array);
+        PyErr_SetString(PyExc_ValueError, "point_count does not match the number of points");
+        return NULL;
+    }
+
+    return points_array;
+}
+
+static int check_results(PyArrayObject *results_array, npy_intp point_count, npy_intp polygon_count, int ndim) {
+    /*
+    Checks the array the results are written to. A bool array holds a mask
+    of shape (point_count,) for 1 polygon or (point_count, polygon_count).
+    A uint8 array holds packed bits (like np.packbits) of shape (byte_count,)
+    for 1 polygon or (polygon_count, byte_count). Returns 1 if the results
+    are packed, 0 if not, or -1 with an exception set if the array is invalid.
+    */
+    npy_intp byte_count = (point_count + 7) / 8;
+    int type_num = PyArray_TYPE(results_array);
+
+    if (PyArray_NDIM(results_array) != ndim || !PyArray_ISWRITEABLE(results_array)) {
+        PyErr_Format(PyExc_ValueError, "results must be a writeable %d-D array", ndim);
+        return -1;
+    }
+
+    if (type_num == NPY_BOOL) {
+        if (!PyArray_IS_C_CONTIGUOUS(results_array) || PyArray_DIM(results_array, 0) != point_count ||
+                (ndim == 2 && PyArray_DIM(results_array, 1) != polygon_count)) {
+            PyErr_SetString(PyExc_ValueError, "bool results must be C-contiguous with a row for each point");
+            return -1;
+        }
+        return 0;
+    }
+
+    if (type_num == NPY_UINT8) {
+        if (PyArray_DIM(results_array, ndim - 1) != byte_count ||
+                (byte_count > 1 && PyArray_STRIDE(results_array, ndim - 1) != 1) ||
+                (ndim == 2 && PyArray_DIM(results_array, 0) != polygon_count)) {
+            PyErr_SetString(
+                PyExc_ValueError, "packed results must have contiguous rows of (point_count + 7) // 8 bytes"
+            );
+            return -1;
+        }
+        return 1;
+    }
+
+    PyErr_SetString(PyExc_TypeError, "results must be a bool or uint8 (packed) array");
+    return -1;
+}
+
+// arrays & memory referenced by a point_source, released by release_point_source
+struct point_arrays {
+    PyArrayObject *points;
+    PyArrayObject *subset;
+    npy_intp *column_offsets;
+};
+
+static void release_point_source(struct point_arrays *arrays) {
+    Py_XDECREF(arrays->points);
+    Py_XDECREF(arrays->subset);
+    free(arrays->column_offsets);
+    memset(arrays, 0, sizeof(struct point_arrays));
+}
+
+static int init_point_source(
+        struct point_source *source,
+        struct point_arrays *arrays,
+        PyObject *points,
+        npy_intp point_count,
+        npy_intp dim_count,
+        PyObject *subset,
+        PyObject *columns
+) {
+    /*
+    Prepares the points tested by a gate. float32 & float64 2-D arrays are read in
+    place, with any strides, anything else is converted to a float64 array. If
+    columns is not None, the gate dimensions are those columns of the points,
+    otherwise the points have a column for each dimension. If subset is not None,
+    the points tested are the rows in subset[:point_count], otherwise the first
+    point_count rows. Returns 0, or -1 with an exception set.
+    */
+    memset(arrays, 0, sizeof(struct point_arrays));
+
+    int points_type = NPY_DOUBLE;
+    if (PyArray_Check(points) && PyArray_TYPE((PyArrayObject *) points) == NPY_FLOAT) {
+        points_type = NPY_FLOAT;
+    }
+    npy_intp item_size = points_type == NPY_FLOAT ? sizeof(float) : sizeof(double);
+
+    arrays->points = (PyArrayObject *) PyArray_FROM_OTF(points, points_type, NPY_ARRAY_ALIGNED);
+    if (!arrays->points) {
+        PyErr_SetString(PyExc_RuntimeError, "Failed to convert points to NumPy array");
+        return -1;
+    }
+
+    npy_intp row_count, column_count, row_stride, column_stride;
+    if (PyArray_NDIM(arrays->points) == 2) {
+        row_count = PyArray_DIM(arrays->points, 0);
+        column_count = PyArray_DIM(arrays->points, 1);
+        row_stride = PyArray_STRIDE(arrays->points, 0);
+        column_stride = PyArray_STRIDE(arrays->points, 1);
+    } else if (columns == Py_None && dim_count > 0) {
+        // other shapes are read as contiguous rows of dim_count values
+        PyArrayObject *contiguous = (PyArrayObject *) PyArray_FROM_OTF(
+            (PyObject *) arrays->points, points_type, NPY_ARRAY_IN_ARRAY
+        );
+        Py_DECREF(arrays->points);
+        arrays->points = contiguous;
+        if (!arrays->points) {
+            return -1;
+        }
+        row_count = PyArray_SIZE(arrays->points) / dim_count;
+        column_count = dim_count;
+        row_stride = dim_count * item_size;
+        column_stride = item_size;
+    } else {
+        PyErr_SetString(PyExc_ValueError, "points must be a 2-D array");
+        return -1;
+    }
+
+    if (columns != Py_None) {
+        PyArrayObject *columns_array = (PyArrayObject *) PyArray_FROM_OTF(columns, NPY_INTP, NPY_ARRAY_IN_ARRAY);
+        if (!columns_array) {
+            return -1;
+        }
+        if (PyArray_SIZE(columns_array) != dim_count) {
+            Py_DECREF(columns_array);
+            PyErr_Format(PyExc_ValueError, "columns must have %zd indices, one for each dimension", (Py_ssize_t) dim_count);
+            return -1;
+        }
+
+        arrays->column_offsets = malloc((dim_count > 0 ? dim_count : 1) * sizeof(npy_intp));
+        if (!arrays->column_offsets) {
+            Py_DECREF(columns_array);
+            PyErr_NoMemory();
+            return -1;
+        }
+        const npy_intp *columns_c = (const npy_intp *) PyArray_DATA(columns_array);
+        for (npy_intp k = 0; k < dim_count; k++) {
+            if (columns_c[k] < 0 || columns_c[k] >= column_count) {
+                Py_DECREF(columns_array);
+                PyErr_Format(PyExc_IndexError, "column %zd is out of range of the points", (Py_ssize_t) columns_c[k]);
+                return -1;
+            }
+            arrays->column_offsets[k] = columns_c[k] * column_stride;
+        }
+        Py_DECREF(columns_array);
+    } else if (column_count != dim_count) {
+        PyErr_Format(PyExc_ValueError, "points must have %zd columns, one for each dimension", (Py_ssize_t) dim_count);
+        return -1;
+    } else if (column_stride != item_size) {
+        arrays->column_offsets = malloc((dim_count > 0 ? dim_count : 1) * sizeof(npy_intp));
+        if (!arrays->column_offsets) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        for (npy_intp k = 0; k < dim_count; k++) {
+            arrays->column_offsets[k] = k * column_stride;
+        }
+    }
+
+    const npy_intp *subset_c = NULL;
+    if (subset != Py_None) {
+        arrays->subset = (PyArrayObject *) PyArray_FROM_OTF(subset, NPY_INTP, NPY_ARRAY_IN_ARRAY);
+        if (!arrays->subset) {
+            return -1;
+        }
+        if (PyArray_NDIM(arrays->subset) != 1 || point_count < 0 || point_count > PyArray_DIM(arrays->subset, 0)) {
+            PyErr_SetString(PyExc_ValueError, "point_count does not match the number of indices in subset");
+            return -1;
+        }
+        subset_c = (const npy_intp *) PyArray_DATA(arrays->subset);
+        for (npy_intp i = 0; i < point_count; i++) {
+            if (subset_c[i] < 0 || subset_c[i] >= row_count) {
+                PyErr_Format(PyExc_IndexError, "index %zd is out of range of the points", (Py_ssize_t) subset_c[i]);
+                return -1;
+            }
+        }
+    } else if (point_count < 0 || point_count > row_count) {
+        PyErr_SetString(PyExc_ValueError, "point_count does not match the number of points");
+        return -1;
+    }
+
+    source->data = PyArray_BYTES(arrays->points);
+    source->row_stride = row_stride;
+    source->column_offsets = arrays->column_offsets;
+    source->dim_count = dim_count;
+    source->is_float = points_type == NPY_FLOAT;
+    source->subset = subset_c;
+    source->point_count = point_count;
+
+    return 0;
+}
+
+static int init_output(
+        struct gate_output *output,
+        PyObject *results,
+        const struct point_source *source,
+        PyArrayObject *points_array,
+        npy_intp gate_count,
+        int ndim
+) {
+    /*
+    Prepares the output of the results of testing points against gate_count gates:
+    either a bool mask or uint8 (packed) array the results are written to (see
+    check_results), or the dtype (intp or uint32) of new arrays of the indices of
+    the points inside each gate. Returns 0, or -1 with an exception set.
+    */
+    memset(output, 0, sizeof(struct gate_output));
+
+    if (PyArray_Check(results)) {
+        PyArrayObject *results_array = (PyArrayObject *) results;
+        int packed = check_results(results_array, source->point_count, gate_count, ndim);
+        if (packed < 0) {
+            return -1;
+        }
+        output->mode = packed ? GATE_OUTPUT_PACKED : GATE_OUTPUT_MASK;
+        output->results = PyArray_DATA(results_array);
+        output->packed_row_stride = ndim == 2 ? PyArray_STRIDE(results_array, 0) : 0;
+        return 0;
+    }
+
+    int type_num = PyArray_DescrCheck(results) ? ((PyArray_Descr *) results)->type_num : NPY_NOTYPE;
+    if (PyArray_EquivTypenums(type_num, NPY_UINT32)) {
+        // the indices are rows of the points
+        if (PyArray_DIM(points_array, 0) > NPY_MAX_UINT32) {
+            PyErr_SetString(PyExc_ValueError, "uint32 indices can't index more than 2^32 points");
+            return -1;
+        }
+        output->uint32_indices = true;
+    } else if (!PyArray_EquivTypenums(type_num, NPY_INTP)) {
+        PyErr_SetString(
+            PyExc_TypeError, "results must be a bool or uint8 (packed) array, or an intp or uint32 dtype for indices"
+        );
+        return -1;
+    }
+
+    output->mode = GATE_OUTPUT_INDICES;
+    output->index_buffers = calloc(gate_count > 0 ? gate_count : 1, sizeof(struct index_buffer));
+    if (!output->index_buffers) {
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    return 0;
+}
+
+static void release_output(struct gate_output *output, npy_intp gate_count) {
+    if (output->index_buffers) {
+        free_index_buffers(output->index_buffers, gate_count);
+        free(output->index_buffers);
+        output->index_buffers = NULL;
+    }
+}
+
+static PyObject *index_array(struct index_buffer *buffer, bool uint32_indices) {
+    // moves the indices of a buffer to a new NumPy array, shrinking the buffer to fit
+    npy_intp dims[1];
+    dims[0] = buffer->count;
+    int type_num = uint32_indices ? NPY_UINT32 : NPY_INTP;
+
+    if (buffer->count == 0) {
+        return PyArray_SimpleNew(1, dims, type_num);
+    }
+
+    void *indices = realloc(buffer->indices, buffer->count * (uint32_indices ? sizeof(npy_uint32) : sizeof(npy_intp)));
+    if (indices) {
+        buffer->indices = indices;
+    }
+
+    PyObject *arr = PyArray_SimpleNewFromData(1, dims, type_num, buffer->indices);
+    if (!arr) {
+        return NULL;
+    }
+
+    // enable our array to free the memory we allocated for the indices
+    PyArray_ENABLEFLAGS((PyArrayObject *) arr, NPY_ARRAY_OWNDATA);
+    buffer->indices = NULL;
+    buffer->count = 0;
+    buffer->capacity = 0;
+
+    return arr;
+}
+
+static PyObject *output_results(struct gate_output *output, PyObject *results, npy_intp gate_count, int ndim) {
+    // returns the results array, or the indices of the points inside the gate (or a list of
+    // indices arrays for each gate if ndim is 2)
+    if (output->mode != GATE_OUTPUT_INDICES) {
+        Py_INCREF(results);
+        return results;
+    }
+
+    if (ndim == 1) {
+        return index_array(&output->index_buffers[0], output->uint32_indices);
+    }
+
+    PyObject *index_list = PyList_New(gate_count);
+    if (!index_list) {
+        return NULL;
+    }
+    for (npy_intp j = 0; j < gate_count; j++) {
+        PyObject *indices = index_array(&output->index_buffers[j], output->uint32_indices);
+        if (!indices) {
+            Py_DECREF(index_list);
+            return NULL;
+        }
+        PyList_SET_ITEM(index_list, j, indices);
+    }
+
+    return index_list;
+}
+
+static PyObject *run_points_in_polygons(
+        PyObject *results,
+        const struct polygon *polygons,
+        npy_intp polygon_count,
+        int ndim,
+        PyObject *points,
+        npy_intp point_count,
+        PyObject *subset,
+        PyObject *columns
+) {
+    // tests the points against the polygons with the GIL released, returning the results
+    struct point_source source;
+    struct point_arrays point_arrays;
+    if (init_point_source(&source, &point_arrays, points, point_count, 2, subset, columns) < 0) {
+        release_point_source(&point_arrays);
+        return NULL;
+    }
+
+    struct gate_output output;
+    if (init_output(&output, results, &source, point_arrays.points, polygon_count, ndim) < 0) {
+        release_output(&output, polygon_count);
+        release_point_source(&point_arrays);
+        return NULL;
+    }
+
+    int status;
+    Py_BEGIN_ALLOW_THREADS
+    status = test_polygons(&output, polygons, polygon_count, &source);
+    Py_END_ALLOW_THREADS
+
+    PyObject *result = status == 0 ? output_results(&output, results, polygon_count, ndim) : PyErr_NoMemory();
+
+    release_output(&output, polygon_count);
+    release_point_source(&point_arrays);
+
+    return result;
+}
+
 static PyObject *wrap_points_in_polygon(PyObject *self, PyObject *args) {
     PyObject *poly_vertices;
     PyObject *points;
-    int vert_count;
-    int point_count;
+    Py_ssize_t vert_count;
+    Py_ssize_t point_count;
+    PyObject *results = Py_None;
+    PyObject *subset = Py_None;
+    PyObject *columns = Py_None;
 
     // parse the input args tuple
-    if (!PyArg_ParseTuple(args, "OiOi", &poly_vertices, &vert_count, &points, &point_count)) {
+    if (!PyArg_ParseTuple(
+            args, "OnOn|OOO", &poly_vertices, &vert_count, &points, &point_count, &results, &subset, &columns)) {
         return NULL;
     }
 
@@ -44,19 +416,59 @@ static PyObject *wrap_points_in_polygon(PyObject *self, PyObject *args) {
         PyErr_SetString(PyExc_RuntimeError, "Failed to convert poly_vertices to NumPy array");
         return NULL;
     }
+    if (vert_count < 1 || vert_count * 2 > PyArray_SIZE(poly_vert_array)) {
+        Py_DECREF(poly_vert_array);
+        PyErr_SetString(PyExc_ValueError, "vert_count does not match the number of poly_vertices");
+        return NULL;
+    }
     double *poly_vertices_c = (double *) PyArray_DATA(poly_vert_array);
 
-    PyArrayObject *points_array = (PyArrayObject *) PyArray_FROM_OTF(points, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    // if given results (an array, or the dtype of indices), the mask, packed mask or
+    // indices of the points inside the polygon are returned
+    if (results != Py_None) {
+        struct polygon poly;
+        Py_BEGIN_ALLOW_THREADS
+        init_polygon(&poly, poly_vertices_c, vert_count);
+        Py_END_ALLOW_THREADS
+
+        PyObject *result = run_points_in_polygons(results, &poly, 1, 1, points, point_count, subset, columns);
+
+        free_polygon(&poly);
+        Py_DECREF(poly_vert_array);
+
+        return result;
+    }
+
+    if (subset != Py_None || columns != Py_None) {
+        Py_DECREF(poly_vert_array);
+        PyErr_SetString(PyExc_ValueError, "subset & columns require results");
+        return NULL;
+    }
+
+    int points_type;
+    PyArrayObject *points_array = convert_points(points, point_count, 2, &points_type);
     if (!points_array) {
-        PyErr_SetString(PyExc_RuntimeError, "Failed to convert points to NumPy array");
+        Py_DECREF(poly_vert_array);
         return NULL;
     }
-    double *points_c = (double *) PyArray_DATA(points_array);
 
-    // now we can call our function!
+    // otherwise, return the winding count of each point
     int *is_in_polygon = malloc(point_count * sizeof(int));
+    if (!is_in_polygon && point_count > 0) {
+        Py_DECREF(poly_vert_array);
+        Py_DECREF(points_array);
+        return PyErr_NoMemory();
+    }
 
-    points_in_polygon(is_in_polygon, poly_vertices_c, vert_count, points_c, point_count);
+    Py_BEGIN_ALLOW_THREADS
+    if (points_type == NPY_FLOAT) {
+        float *points_c = (float *) PyArray_DATA(points_array);
+        points_in_polygon_float(is_in_polygon, poly_vertices_c, vert_count, points_c, point_count);
+    } else {
+        double *points_c = (double *) PyArray_DATA(points_array);
+        points_in_polygon(is_in_polygon, poly_vertices_c, vert_count, points_c, point_count);
+    }
+    Py_END_ALLOW_THREADS
 
     Py_DECREF(poly_vert_array);
     Py_DECREF(points_array);
@@ -72,9 +484,572 @@ static PyObject *wrap_points_in_polygon(PyObject *self, PyObject *args) {
     return arr;
 }
 
+static void release_polygons(PyArrayObject **vert_arrays, struct polygon *polygons, npy_intp polygon_count) {
+    for (npy_intp i = 0; i < polygon_count; i++) {
+        if (polygons) {
+            free_polygon(&polygons[i]);
+        }
+        Py_XDECREF(vert_arrays[i]);
+    }
+    free(vert_arrays);
+    free(polygons);
+}
+
+static PyObject *wrap_points_in_polygons(PyObject *self, PyObject *args) {
+    PyObject *poly_vertices_list;
+    PyObject *points;
+    Py_ssize_t point_count;
+    PyObject *results;
+    PyObject *subset = Py_None;
+    PyObject *columns = Py_None;
+
+    // parse the input args tuple
+    if (!PyArg_ParseTuple(
+            args, "OOnO|OO", &poly_vertices_list, &points, &point_count, &results, &subset, &columns)) {
+        return NULL;
+    }
+
+    PyObject *poly_seq = PySequence_Fast(poly_vertices_list, "poly_vertices_list must be a sequence of polygons");
+    if (!poly_seq) {
+        return NULL;
+    }
+    npy_intp polygon_count = PySequence_Fast_GET_SIZE(poly_seq);
+
+    PyArrayObject **vert_arrays = calloc(polygon_count > 0 ? polygon_count : 1, sizeof(PyArrayObject *));
+    if (!vert_arrays) {
+        Py_DECREF(poly_seq);
+        return PyErr_NoMemory();
+    }
+
+    for (npy_intp i = 0; i < polygon_count; i++) {
+        PyObject *poly_vertices = PySequence_Fast_GET_ITEM(poly_seq, i);
+        vert_arrays[i] = (PyArrayObject *) PyArray_FROM_OTF(poly_vertices, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+        if (!vert_arrays[i]) {
+            release_polygons(vert_arrays, NULL, polygon_count);
+            Py_DECREF(poly_seq);
+            PyErr_SetString(PyExc_RuntimeError, "Failed to convert poly_vertices to NumPy array");
+            return NULL;
+        }
+        if (PyArray_NDIM(vert_arrays[i]) != 2 || PyArray_DIM(vert_arrays[i], 0) < 1 ||
+                PyArray_DIM(vert_arrays[i], 1) != 2) {
+            release_polygons(vert_arrays, NULL, polygon_count);
+            Py_DECREF(poly_seq);
+            PyErr_Format(PyExc_ValueError, "polygon %zd vertices must be an array of 2-D points", (Py_ssize_t) i);
+            return NULL;
+        }
+    }
+    Py_DECREF(poly_seq);
+
+    struct polygon *polygons = malloc((polygon_count > 0 ? polygon_count : 1) * sizeof(struct polygon));
+    if (!polygons) {
+        release_polygons(vert_arrays, NULL, polygon_count);
+        return PyErr_NoMemory();
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (npy_intp i = 0; i < polygon_count; i++) {
+        init_polygon(&polygons[i], (double *) PyArray_DATA(vert_arrays[i]), PyArray_DIM(vert_arrays[i], 0));
+    }
+    Py_END_ALLOW_THREADS
+
+    // results are written directly to a bool mask or packed uint8 array, or returned as a list of indices
+    PyObject *result = run_points_in_polygons(
+        results, polygons, polygon_count, 2, points, point_count, subset, columns
+    );
+
+    release_polygons(vert_arrays, polygons, polygon_count);
+
+    return result;
+}
+
+static PyObject *wrap_points_in_ellipsoid(PyObject *self, PyObject *args) {
+    PyObject *inv_cov_matrix;
+    PyObject *means;
+    double distance_square;
+    PyObject *points;
+    Py_ssize_t point_count;
+    PyObject *results;
+    PyObject *subset = Py_None;
+    PyObject *columns = Py_None;
+
+    // parse the input args tuple
+    if (!PyArg_ParseTuple(
+            args, "OOdOnO|OO", &inv_cov_matrix, &means, &distance_square, &points, &point_count,
+            &results, &subset, &columns)) {
+        return NULL;
+    }
+
+    PyArrayObject *means_array = (PyArrayObject *) PyArray_FROM_OTF(means, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (!means_array) {
+        return NULL;
+    }
+    npy_intp dim_count = PyArray_SIZE(means_array);
+
+    PyArrayObject *inv_cov_array = (PyArrayObject *) PyArray_FROM_OTF(inv_cov_matrix, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (!inv_cov_array) {
+        Py_DECREF(means_array);
+        return NULL;
+    }
+    if (PyArray_NDIM(inv_cov_array) != 2 || PyArray_DIM(inv_cov_array, 0) != dim_count ||
+            PyArray_DIM(inv_cov_array, 1) != dim_count) {
+        Py_DECREF(means_array);
+        Py_DECREF(inv_cov_array);
+        PyErr_SetString(PyExc_ValueError, "inv_cov_matrix must be a square matrix matching the number of means");
+        return NULL;
+    }
+
+    struct point_source source;
+    struct point_arrays point_arrays;
+    struct gate_output output;
+    memset(&output, 0, sizeof(struct gate_output));
+    if (init_point_source(&source, &point_arrays, points, point_count, dim_count, subset, columns) < 0 ||
+            init_output(&output, results, &source, point_arrays.points, 1, 1) < 0) {
+        release_output(&output, 1);
+        release_point_source(&point_arrays);
+        Py_DECREF(means_array);
+        Py_DECREF(inv_cov_array);
+        return NULL;
+    }
+
+    const double *inv_cov_c = (const double *) PyArray_DATA(inv_cov_array);
+    const double *means_c = (const double *) PyArray_DATA(means_array);
+    int status;
+
+    Py_BEGIN_ALLOW_THREADS
+    status = test_ellipsoid(&output, inv_cov_c, means_c, distance_square, &source);
+    Py_END_ALLOW_THREADS
+
+    PyObject *result = status == 0 ? output_results(&output, results, 1, 1) : PyErr_NoMemory();
+
+    release_output(&output, 1);
+    release_point_source(&point_arrays);
+    Py_DECREF(means_array);
+    Py_DECREF(inv_cov_array);
+
+    return result;
+}
+
+static PyObject *wrap_points_in_rectangle(PyObject *self, PyObject *args) {
+    PyObject *mins;
+    PyObject *maxs;
+    PyObject *points;
+    Py_ssize_t point_count;
+    PyObject *results;
+    PyObject *subset = Py_None;
+    PyObject *columns = Py_None;
+
+    // parse the input args tuple
+    if (!PyArg_ParseTuple(args, "OOOnO|OO", &mins, &maxs, &points, &point_count, &results, &subset, &columns)) {
+        return NULL;
+    }
+
+    PyArrayObject *mins_array = (PyArrayObject *) PyArray_FROM_OTF(mins, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (!mins_array) {
+        return NULL;
+    }
+    npy_intp dim_count = PyArray_SIZE(mins_array);
+
+    PyArrayObject *maxs_array = (PyArrayObject *) PyArray_FROM_OTF(maxs, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (!maxs_array) {
+        Py_DECREF(mins_array);
+        return NULL;
+    }
+    if (PyArray_SIZE(maxs_array) != dim_count) {
+        Py_DECREF(mins_array);
+        Py_DECREF(maxs_array);
+        PyErr_SetString(PyExc_ValueError, "mins and maxs must have the same number of dimensions");
+        return NULL;
+    }
+
+    struct point_source source;
+    struct point_arrays point_arrays;
+    struct gate_output output;
+    memset(&output, 0, sizeof(struct gate_output));
+    if (init_point_source(&source, &point_arrays, points, point_count, dim_count, subset, columns) < 0 ||
+            init_output(&output, results, &source, point_arrays.points, 1, 1) < 0) {
+        release_output(&output, 1);
+        release_point_source(&point_arrays);
+        Py_DECREF(mins_array);
+        Py_DECREF(maxs_array);
+        return NULL;
+    }
+
+    const double *mins_c = (const double *) PyArray_DATA(mins_array);
+    const double *maxs_c = (const double *) PyArray_DATA(maxs_array);
+    int status;
+
+    Py_BEGIN_ALLOW_THREADS
+    status = test_rectangle(&output, mins_c, maxs_c, &source);
+    Py_END_ALLOW_THREADS
+
+    PyObject *result = status == 0 ? output_results(&output, results, 1, 1) : PyErr_NoMemory();
+
+    release_output(&output, 1);
+    release_point_source(&point_arrays);
+    Py_DECREF(mins_array);
+    Py_DECREF(maxs_array);
+
+    return result;
+}
+
+// arrays referenced by a gate_stats, released by release_stats_arrays
+struct stats_arrays {
+    PyArrayObject *events;
+    PyArrayObject *columns;
+    PyArrayObject *hist_ranges;
+};
+
+static void release_stats_arrays(struct stats_arrays *arrays) {
+    Py_XDECREF(arrays->events);
+    Py_XDECREF(arrays->columns);
+    Py_XDECREF(arrays->hist_ranges);
+}
+
+static int check_accumulator(PyObject *array, int type_num, int ndim, npy_intp row_count, const char *name) {
+    // accumulators are added to in place, so must be writeable C-contiguous arrays of the exact type
+    if (!PyArray_Check(array) || PyArray_TYPE((PyArrayObject *) array) != type_num ||
+            PyArray_NDIM((PyArrayObject *) array) != ndim || PyArray_DIM((PyArrayObject *) array, 0) != row_count ||
+            !PyArray_IS_C_CONTIGUOUS((PyArrayObject *) array) || !PyArray_ISWRITEABLE((PyArrayObject *) array)) {
+        PyErr_Format(
+            PyExc_ValueError, "%s must be a writeable C-contiguous %s array with a row for each column",
+            name, type_num == NPY_INT64 ? "int64" : "float64"
+        );
+        return -1;
+    }
+
+    return 0;
+}
+
+static int init_gate_stats(
+        struct gate_stats *stats,
+        struct stats_arrays *arrays,
+        PyObject *events,
+        PyObject *columns,
+        PyObject *sums,
+        PyObject *sums_sq,
+        PyObject *histograms,
+        PyObject *hist_ranges,
+        npy_intp point_count
+) {
+    /*
+    Prepares the statistics of the events inside a gate. The events have a row
+    for each point (strided rows & columns are read in place), and the sums,
+    sums of squares & histograms (optional, None for none) of the columns are
+    added to. Returns 0, or -1 with an exception set.
+    */
+    memset(stats, 0, sizeof(struct gate_stats));
+    memset(arrays, 0, sizeof(struct stats_arrays));
+
+    int events_type = NPY_DOUBLE;
+    if (PyArray_Check(events) && PyArray_TYPE((PyArrayObject *) events) == NPY_FLOAT) {
+        events_type = NPY_FLOAT;
+    }
+    arrays->events = (PyArrayObject *) PyArray_FROM_OTF(events, events_type, NPY_ARRAY_ALIGNED);
+    if (!arrays->events) {
+        return -1;
+    }
+    if (PyArray_NDIM(arrays->events) != 2 || PyArray_DIM(arrays->events, 0) < point_count) {
+        PyErr_SetString(PyExc_ValueError, "events must be a 2-D array with a row for each point");
+        return -1;
+    }
+
+    arrays->columns = (PyArrayObject *) PyArray_FROM_OTF(columns, NPY_INTP, NPY_ARRAY_IN_ARRAY);
+    if (!arrays->columns) {
+        return -1;
+    }
+    npy_intp column_count = PyArray_SIZE(arrays->columns);
+    const npy_intp *columns_c = (const npy_intp *) PyArray_DATA(arrays->columns);
+    for (npy_intp k = 0; k < column_count; k++) {
+        if (columns_c[k] < 0 || columns_c[k] >= PyArray_DIM(arrays->events, 1)) {
+            PyErr_Format(PyExc_IndexError, "column %zd is out of range of the events", (Py_ssize_t) columns_c[k]);
+            return -1;
+        }
+    }
+
+    if (check_accumulator(sums, NPY_DOUBLE, 1, column_count, "sums") < 0 ||
+            check_accumulator(sums_sq, NPY_DOUBLE, 1, column_count, "sums_sq") < 0) {
+        return -1;
+    }
+
+    if (histograms != Py_None) {
+        if (check_accumulator(histograms, NPY_INT64, 2, column_count, "histograms") < 0) {
+            return -1;
+        }
+        arrays->hist_ranges = (PyArrayObject *) PyArray_FROM_OTF(hist_ranges, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+        if (!arrays->hist_ranges) {
+            return -1;
+        }
+        if (PyArray_SIZE(arrays->hist_ranges) != column_count * 2) {
+            PyErr_SetString(PyExc_ValueError, "hist_ranges must have a (min, max) pair for each column");
+            return -1;
+        }
+        stats->histograms = (npy_int64 *) PyArray_DATA((PyArrayObject *) histograms);
+        stats->bin_count = PyArray_DIM((PyArrayObject *) histograms, 1);
+        stats->hist_ranges = (const double *) PyArray_DATA(arrays->hist_ranges);
+    }
+
+    stats->events = PyArray_BYTES(arrays->events);
+    stats->row_stride = PyArray_STRIDE(arrays->events, 0);
+    stats->column_stride = PyArray_STRIDE(arrays->events, 1);
+    stats->is_float = events_type == NPY_FLOAT;
+    stats->columns = columns_c;
+    stats->column_count = column_count;
+    stats->sums = (double *) PyArray_DATA((PyArrayObject *) sums);
+    stats->sums_sq = (double *) PyArray_DATA((PyArrayObject *) sums_sq);
+
+    return 0;
+}
+
+static int init_stats_output(
+        struct gate_output *output,
+        npy_int64 *count,
+        struct gate_stats *stats,
+        struct stats_arrays *arrays,
+        PyObject *events,
+        PyObject *stats_args[5],
+        npy_intp point_count
+) {
+    // Counts the points inside a gate, with the statistics of their events if events
+    // is not None (stats_args are the columns, sums, sums_sq, histograms & hist_ranges)
+    memset(output, 0, sizeof(struct gate_output));
+    memset(arrays, 0, sizeof(struct stats_arrays));
+    output->mode = GATE_OUTPUT_COUNT;
+    output->counts = count;
+
+    if (events == Py_None) {
+        return 0;
+    }
+
+    for (int i = 0; i < 3; i++) {
+        if (stats_args[i] == NULL || stats_args[i] == Py_None) {
+            PyErr_SetString(PyExc_TypeError, "columns, sums & sums_sq are required for the statistics of events");
+            return -1;
+        }
+    }
+
+    if (init_gate_stats(
+            stats, arrays, events, stats_args[0], stats_args[1], stats_args[2],
+            stats_args[3] == NULL ? Py_None : stats_args[3], stats_args[4] == NULL ? Py_None : stats_args[4],
+            point_count) < 0) {
+        return -1;
+    }
+
+    output->mode = GATE_OUTPUT_STATS;
+    output->stats = stats;
+
+    return 0;
+}
+
+static PyObject *wrap_stats_in_polygon(PyObject *self, PyObject *args) {
+    PyObject *poly_vertices;
+    PyObject *points;
+    Py_ssize_t point_count;
+    PyObject *events = Py_None;
+    PyObject *stats_args[5] = {NULL, NULL, NULL, NULL, NULL};
+
+    // parse the input args tuple
+    if (!PyArg_ParseTuple(
+            args, "OOn|OOOOOO", &poly_vertices, &points, &point_count, &events,
+            &stats_args[0], &stats_args[1], &stats_args[2], &stats_args[3], &stats_args[4])) {
+        return NULL;
+    }
+
+    PyArrayObject *poly_vert_array = (PyArrayObject *) PyArray_FROM_OTF(poly_vertices, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (!poly_vert_array) {
+        PyErr_SetString(PyExc_RuntimeError, "Failed to convert poly_vertices to NumPy array");
+        return NULL;
+    }
+    if (PyArray_NDIM(poly_vert_array) != 2 || PyArray_DIM(poly_vert_array, 0) < 1 ||
+            PyArray_DIM(poly_vert_array, 1) != 2) {
+        Py_DECREF(poly_vert_array);
+        PyErr_SetString(PyExc_ValueError, "poly_vertices must be an array of 2-D points");
+        return NULL;
+    }
+
+    struct point_source source;
+    struct point_arrays point_arrays;
+    struct gate_output output;
+    struct gate_stats stats;
+    struct stats_arrays stats_arrays;
+    npy_int64 count = 0;
+    memset(&stats_arrays, 0, sizeof(struct stats_arrays));
+    if (init_point_source(&source, &point_arrays, points, point_count, 2, Py_None, Py_None) < 0 ||
+            init_stats_output(&output, &count, &stats, &stats_arrays, events, stats_args, point_count) < 0) {
+        release_stats_arrays(&stats_arrays);
+        release_point_source(&point_arrays);
+        Py_DECREF(poly_vert_array);
+        return NULL;
+    }
+
+    struct polygon poly;
+    int status;
+
+    Py_BEGIN_ALLOW_THREADS
+    init_polygon(&poly, (double *) PyArray_DATA(poly_vert_array), PyArray_DIM(poly_vert_array, 0));
+    status = test_polygons(&output, &poly, 1, &source);
+    free_polygon(&poly);
+    Py_END_ALLOW_THREADS
+
+    release_stats_arrays(&stats_arrays);
+    release_point_source(&point_arrays);
+    Py_DECREF(poly_vert_array);
+
+    if (status != 0) {
+        return PyErr_NoMemory();
+    }
+
+    return PyLong_FromLongLong(count);
+}
+
+static PyObject *wrap_stats_in_ellipsoid(PyObject *self, PyObject *args) {
+    PyObject *inv_cov_matrix;
+    PyObject *means;
+    double distance_square;
+    PyObject *points;
+    Py_ssize_t point_count;
+    PyObject *events = Py_None;
+    PyObject *stats_args[5] = {NULL, NULL, NULL, NULL, NULL};
+
+    // parse the input args tuple
+    if (!PyArg_ParseTuple(
+            args, "OOdOn|OOOOOO", &inv_cov_matrix, &means, &distance_square, &points, &point_count, &events,
+            &stats_args[0], &stats_args[1], &stats_args[2], &stats_args[3], &stats_args[4])) {
+        return NULL;
+    }
+
+    PyArrayObject *means_array = (PyArrayObject *) PyArray_FROM_OTF(means, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (!means_array) {
+        return NULL;
+    }
+    npy_intp dim_count = PyArray_SIZE(means_array);
+
+    PyArrayObject *inv_cov_array = (PyArrayObject *) PyArray_FROM_OTF(inv_cov_matrix, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (!inv_cov_array) {
+        Py_DECREF(means_array);
+        return NULL;
+    }
+    if (PyArray_NDIM(inv_cov_array) != 2 || PyArray_DIM(inv_cov_array, 0) != dim_count ||
+            PyArray_DIM(inv_cov_array, 1) != dim_count) {
+        Py_DECREF(means_array);
+        Py_DECREF(inv_cov_array);
+        PyErr_SetString(PyExc_ValueError, "inv_cov_matrix must be a square matrix matching the number of means");
+        return NULL;
+    }
+
+    struct point_source source;
+    struct point_arrays point_arrays;
+    struct gate_output output;
+    struct gate_stats stats;
+    struct stats_arrays stats_arrays;
+    npy_int64 count = 0;
+    memset(&stats_arrays, 0, sizeof(struct stats_arrays));
+    if (init_point_source(&source, &point_arrays, points, point_count, dim_count, Py_None, Py_None) < 0 ||
+            init_stats_output(&output, &count, &stats, &stats_arrays, events, stats_args, point_count) < 0) {
+        release_stats_arrays(&stats_arrays);
+        release_point_source(&point_arrays);
+        Py_DECREF(means_array);
+        Py_DECREF(inv_cov_array);
+        return NULL;
+    }
+
+    const double *inv_cov_c = (const double *) PyArray_DATA(inv_cov_array);
+    const double *means_c = (const double *) PyArray_DATA(means_array);
+    int status;
+
+    Py_BEGIN_ALLOW_THREADS
+    status = test_ellipsoid(&output, inv_cov_c, means_c, distance_square, &source);
+    Py_END_ALLOW_THREADS
+
+    release_stats_arrays(&stats_arrays);
+    release_point_source(&point_arrays);
+    Py_DECREF(means_array);
+    Py_DECREF(inv_cov_array);
+
+    if (status != 0) {
+        return PyErr_NoMemory();
+    }
+
+    return PyLong_FromLongLong(count);
+}
+
+static PyObject *wrap_stats_in_rectangle(PyObject *self, PyObject *args) {
+    PyObject *mins;
+    PyObject *maxs;
+    PyObject *points;
+    Py_ssize_t point_count;
+    PyObject *events = Py_None;
+    PyObject *stats_args[5] = {NULL, NULL, NULL, NULL, NULL};
+
+    // parse the input args tuple
+    if (!PyArg_ParseTuple(
+            args, "OOOn|OOOOOO", &mins, &maxs, &points, &point_count, &events,
+            &stats_args[0], &stats_args[1], &stats_args[2], &stats_args[3], &stats_args[4])) {
+        return NULL;
+    }
+
+    PyArrayObject *mins_array = (PyArrayObject *) PyArray_FROM_OTF(mins, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (!mins_array) {
+        return NULL;
+    }
+    npy_intp dim_count = PyArray_SIZE(mins_array);
+
+    PyArrayObject *maxs_array = (PyArrayObject *) PyArray_FROM_OTF(maxs, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (!maxs_array) {
+        Py_DECREF(mins_array);
+        return NULL;
+    }
+    if (PyArray_SIZE(maxs_array) != dim_count) {
+        Py_DECREF(mins_array);
+        Py_DECREF(maxs_array);
+        PyErr_SetString(PyExc_ValueError, "mins and maxs must have the same number of dimensions");
+        return NULL;
+    }
+
+    struct point_source source;
+    struct point_arrays point_arrays;
+    struct gate_output output;
+    struct gate_stats stats;
+    struct stats_arrays stats_arrays;
+    npy_int64 count = 0;
+    memset(&stats_arrays, 0, sizeof(struct stats_arrays));
+    if (init_point_source(&source, &point_arrays, points, point_count, dim_count, Py_None, Py_None) < 0 ||
+            init_stats_output(&output, &count, &stats, &stats_arrays, events, stats_args, point_count) < 0) {
+        release_stats_arrays(&stats_arrays);
+        release_point_source(&point_arrays);
+        Py_DECREF(mins_array);
+        Py_DECREF(maxs_array);
+        return NULL;
+    }
+
+    const double *mins_c = (const double *) PyArray_DATA(mins_array);
+    const double *maxs_c = (const double *) PyArray_DATA(maxs_array);
+    int status;
+
+    Py_BEGIN_ALLOW_THREADS
+    status = test_rectangle(&output, mins_c, maxs_c, &source);
+    Py_END_ALLOW_THREADS
+
+    release_stats_arrays(&stats_arrays);
+    release_point_source(&point_arrays);
+    Py_DECREF(mins_array);
+    Py_DECREF(maxs_array);
+
+    if (status != 0) {
+        return PyErr_NoMemory();
+    }
+
+    return PyLong_FromLongLong(count);
+}
+
 static PyMethodDef module_methods[] = {
     {"calc_wind_count", wrap_calc_wind_count, METH_VARARGS, NULL},
     {"points_in_polygon", wrap_points_in_polygon, METH_VARARGS, NULL},
+    {"points_in_polygons", wrap_points_in_polygons, METH_VARARGS, NULL},
+    {"points_in_ellipsoid", wrap_points_in_ellipsoid, METH_VARARGS, NULL},
+    {"points_in_rectangle", wrap_points_in_rectangle, METH_VARARGS, NULL},
+    {"stats_in_polygon", wrap_stats_in_polygon, METH_VARARGS, NULL},
+    {"stats_in_ellipsoid", wrap_stats_in_ellipsoid, METH_VARARGS, NULL},
+    {"stats_in_rectangle", wrap_stats_in_rectangle, METH_VARARGS, NULL},
     {NULL, NULL, 0, NULL}
 };
 
@@ -1,5 +1,8 @@
-#include <stdlib.h>
 #include "gate_helpers.h"
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <stdbool.h>
 
 double point_is_left(
         double point_a_x,
@@ -14,16 +17,50 @@ double point_is_left(
     return is_left;
 }
 
-int calc_wind_count(double point_x, double point_y, int vert_count, double *poly_vertices) {
+static inline int edge_wind_count(
+        double vert_a_x,
+        double vert_a_y,
+        double vert_b_x,
+        double vert_b_y,
+        double point_x,
+        double point_y
+) {
+    // winding count contribution of the edge from vertex a to vertex b
+    double is_left;
+
+    if (vert_a_y <= point_y) {
+        if (point_y < vert_b_y) {
+            // point crosses & edge travels upward
+            is_left = point_is_left(vert_a_x, vert_a_y, vert_b_x, vert_b_y, point_x, point_y);
+            if (is_left > 0) {
+                // point is left of edge
+                return 1;  // valid 'up' intersection
+            }
+        }
+    } else {
+        if (vert_b_y <= point_y) {
+            // point crosses & edge travels downward
+            is_left = point_is_left(vert_a_x, vert_a_y, vert_b_x, vert_b_y, point_x, point_y);
+
+            if (is_left < 0) {
+                // point is right of edge
+                return -1;  // valid 'down' intersect
+            }
+        }
+    }
+
+    return 0;
+}
+
+int calc_wind_count(double point_x, double point_y, npy_intp vert_count, double *poly_vertices) {
 	int wind_count = 0;
 	double vert_a_x;
 	double vert_a_y;
 	double vert_b_x;
 	double vert_b_y;
-	double is_left;
 
     // loop through all edges of the polygon
-    for (int i=0; i<vert_count; i++) {
+    for (npy_intp i=0; i<vert_count; i++) {
         //edge from poly_vertices[i] to poly_vertices[i+1]
         vert_a_x = poly_vertices[(i * 2) + 0];
         vert_a_y = poly_vertices[(i * 2) + 1];
@@ -36,32 +73,234 @@ int calc_wind_count(double point_x, double point_y, int vert_count, double *poly
             vert_b_y = poly_vertices[(i * 2) + 3];
         }
 
-        if (vert_a_y <= point_y) {
-            if (point_y < vert_b_y) {
-                // point crosses & edge travels upward
-                is_left = point_is_left(vert_a_x, vert_a_y, vert_b_x, vert_b_y, point_x, point_y);
-                if (is_left > 0) {
-                    // point is left of edge
-                    wind_count += 1;  // valid 'up' intersection
-                }
-            }
-        } else {
-            if (vert_b_y <= point_y) {
-                // point crosses & edge travels downward
-                is_left = point_is_left(vert_a_x, vert_a_y, vert_b_x, vert_b_y, point_x, point_y);
+        wind_count += edge_wind_count(vert_a_x, vert_a_y, vert_b_x, vert_b_y, point_x, point_y);
+    }
 
-                if (is_left < 0) {
-                    // point is right of edge
-                    wind_count -= 1;  // valid 'down' intersect
-                }
-            }
+    return wind_count;
+}
+
+static struct bounding_box calc_bounding_box(double *poly_vertices, npy_intp vert_count) {
+    // find the polygon's bounding box & store the min/max values
+    struct bounding_box bbox;
+    bbox.min_x = poly_vertices[0];
+    bbox.max_x = poly_vertices[0];
+    bbox.min_y = poly_vertices[1];
+    bbox.max_y = poly_vertices[1];
+    double vert_x, vert_y;
+
+    for (npy_intp i=1; i<vert_count; i++) {
+        vert_x = poly_vertices[(i * 2) + 0];
+        vert_y = poly_vertices[(i * 2) + 1];
+
+        if (vert_x < bbox.min_x) {
+            bbox.min_x = vert_x;
+        }
+        else if (vert_x > bbox.max_x) {
+            bbox.max_x = vert_x;
+        }
+        if (vert_y < bbox.min_y) {
+            bbox.min_y = vert_y;
+        }
+        else if (vert_y > bbox.max_y) {
+            bbox.max_y = vert_y;
+        }
+    }
+
+    return bbox;
+}
+
+static int point_wind_count(
+        double point_x,
+        double point_y,
+        const struct bounding_box *bbox,
+        npy_intp vert_count,
+        double *poly_vertices
+) {
+    // points outside the bounding box can't be in the polygon
+    if (point_x < bbox->min_x || point_x > bbox->max_x || point_y < bbox->min_y || point_y > bbox->max_y) {
+        return 0;
+    }
+
+    return calc_wind_count(point_x, point_y, vert_count, poly_vertices);
+}
+
+// polygons with fewer vertices are tested against every edge
+#define POLYGON_INDEX_MIN_VERTICES 16
+
+// limit on the average number of slabs an edge is stored in
+#define POLYGON_INDEX_MAX_EDGE_SLABS 8
+
+static inline npy_intp polygon_slab(const struct polygon_index *index, double y) {
+    // Slab containing y. This is monotone in y (even with rounding) and is
+    // used both to build the index & to look up points, so a point's slab
+    // always holds every edge spanning the point's y value.
+    double slab = floor((y - index->bbox.min_y) * index->slab_scale);
+    if (!(slab >= 0)) {
+        return 0;  // also catches NaN
+    }
+    if (slab >= (double) index->slab_count) {
+        return index->slab_count - 1;
+    }
+    return (npy_intp) slab;
+}
+
+static npy_intp count_slab_edges(struct polygon_index *index, double *poly_vertices, npy_intp vert_count) {
+    // total number of edges stored in the slabs for the current slab count,
+    // also fills in the number of edges in each slab (offset by 1)
+    npy_intp total = 0;
+    memset(index->slab_offsets, 0, (index->slab_count + 1) * sizeof(npy_intp));
+
+    for (npy_intp i=0; i<vert_count; i++) {
+        double vert_a_y = poly_vertices[(i * 2) + 1];
+        double vert_b_y = poly_vertices[((i + 1) % vert_count) * 2 + 1];
+
+        // horizontal edges never contribute to the winding count
+        if (vert_a_y == vert_b_y) {
+            continue;
         }
+
+        npy_intp first = polygon_slab(index, vert_a_y < vert_b_y ? vert_a_y : vert_b_y);
+        npy_intp last = polygon_slab(index, vert_a_y < vert_b_y ? vert_b_y : vert_a_y);
+        for (npy_intp slab=first; slab<=last; slab++) {
+            index->slab_offsets[slab + 1]++;
+        }
+        total += last - first + 1;
+    }
+
+    return total;
+}
+
+int build_polygon_index(struct polygon_index *index, double *poly_vertices, npy_intp vert_count) {
+    /*
+    Builds an index of the polygon edges, dividing the polygon's bounding box
+    into horizontal slabs of equal height. Each slab stores (in CSR layout)
+    the edges whose y range overlaps the slab, so a point only needs to be
+    tested against the edges of the slab containing it. Returns 0 on success
+    or -1 if memory could not be allocated.
+    */
+    index->bbox = calc_bounding_box(poly_vertices, vert_count);
+    index->slab_offsets = NULL;
+    index->slab_edges = NULL;
+
+    // start with about one slab per vertex, halving the number of slabs
+    // if too many edges span multiple slabs
+    npy_intp slab_count = vert_count;
+    double height = index->bbox.max_y - index->bbox.min_y;
+    if (!(height > 0)) {
+        slab_count = 1;
+    }
+
+    npy_intp total;
+    while (1) {
+        index->slab_count = slab_count;
+        index->slab_scale = slab_count > 1 ? slab_count / height : 0;
+
+        free(index->slab_offsets);
+        index->slab_offsets = malloc((slab_count + 1) * sizeof(npy_intp));
+        if (index->slab_offsets == NULL) {
+            return -1;
+        }
+
+        total = count_slab_edges(index, poly_vertices, vert_count);
+        if (slab_count == 1 || total <= POLYGON_INDEX_MAX_EDGE_SLABS * vert_count) {
+            break;
+        }
+        slab_count /= 2;
+    }
+
+    // convert the slab edge counts to offsets
+    for (npy_intp slab=0; slab<slab_count; slab++) {
+        index->slab_offsets[slab + 1] += index->slab_offsets[slab];
+    }
+
+    // store each edge's vertices (a_x, a_y, b_x, b_y), in polygon order within each slab
+    index->slab_edges = malloc((total > 0 ? total : 1) * 4 * sizeof(double));
+    npy_intp *fill = malloc(slab_count * sizeof(npy_intp));
+    if (index->slab_edges == NULL || fill == NULL) {
+        free(fill);
+        free_polygon_index(index);
+        return -1;
+    }
+    memcpy(fill, index->slab_offsets, slab_count * sizeof(npy_intp));
+
+    for (npy_intp i=0; i<vert_count; i++) {
+        npy_intp j = (i + 1) % vert_count;
+        double vert_a_y = poly_vertices[(i * 2) + 1];
+        double vert_b_y = poly_vertices[(j * 2) + 1];
+
+        if (vert_a_y == vert_b_y) {
+            continue;
+        }
+
+        npy_intp first = polygon_slab(index, vert_a_y < vert_b_y ? vert_a_y : vert_b_y);
+        npy_intp last = polygon_slab(index, vert_a_y < vert_b_y ? vert_b_y : vert_a_y);
+        for (npy_intp slab=first; slab<=last; slab++) {
+            double *edge = index->slab_edges + fill[slab] * 4;
+            edge[0] = poly_vertices[(i * 2) + 0];
+            edge[1] = vert_a_y;
+            edge[2] = poly_vertices[(j * 2) + 0];
+            edge[3] = vert_b_y;
+            fill[slab]++;
+        }
+    }
+
+    free(fill);
+
+    return 0;
+}
+
+void free_polygon_index(struct polygon_index *index) {
+    free(index->slab_offsets);
+    free(index->slab_edges);
+    index->slab_offsets = NULL;
+    index->slab_edges = NULL;
+}
+
+int indexed_wind_count(const struct polygon_index *index, double point_x, double point_y) {
+    // points outside the bounding box can't be in the polygon
+    const struct bounding_box *bbox = &index->bbox;
+    if (point_x < bbox->min_x || point_x > bbox->max_x || point_y < bbox->min_y || point_y > bbox->max_y) {
+        return 0;
+    }
+
+    npy_intp slab = polygon_slab(index, point_y);
+    const double *edge = index->slab_edges + index->slab_offsets[slab] * 4;
+    const double *end = index->slab_edges + index->slab_offsets[slab + 1] * 4;
+    int wind_count = 0;
+
+    for (; edge < end; edge += 4) {
+        wind_count += edge_wind_count(edge[0], edge[1], edge[2], edge[3], point_x, point_y);
     }
 
     return wind_count;
 }
 
-int * points_in_polygon(int *wind_counts, double *poly_vertices, int vert_count, double *points, int point_count) {
+void init_polygon(struct polygon *poly, double *poly_vertices, npy_intp vert_count) {
+    // Prepares a polygon for testing points, indexing polygons with many
+    // vertices. If the index can't be allocated, every edge is tested.
+    poly->vertices = poly_vertices;
+    poly->vert_count = vert_count;
+    poly->bbox = calc_bounding_box(poly_vertices, vert_count);
+    poly->indexed = vert_count >= POLYGON_INDEX_MIN_VERTICES &&
+        build_polygon_index(&poly->index, poly_vertices, vert_count) == 0;
+}
+
+void free_polygon(struct polygon *poly) {
+    if (poly->indexed) {
+        free_polygon_index(&poly->index);
+        poly->indexed = 0;
+    }
+}
+
+static inline int polygon_wind_count(const struct polygon *poly, double point_x, double point_y) {
+    if (poly->indexed) {
+        return indexed_wind_count(&poly->index, point_x, point_y);
+    }
+
+    return point_wind_count(point_x, point_y, &poly->bbox, poly->vert_count, poly->vertices);
+}
+
+int * points_in_polygon(int *wind_counts, double *poly_vertices, npy_intp vert_count, double *points, npy_intp point_count) {
     /*
     Determines whether points in an array are inside a polygon. Points on the
     edge of the polygon are considered inclusive. This function uses the
@@ -78,58 +317,558 @@ int * points_in_polygon(int *wind_counts, double *poly_vertices, int vert_count,
 
         https://web.archive.org/web/20210504233957/http://geomalgorithms.com/a03-_inclusion.html
 
+    Polygons with many vertices are indexed first (see init_polygon) so
+    each point is only tested against the edges near it, giving the same
+    winding counts as testing every edge.
+
     :param poly_vertices: Polygon vertices (array of 2-D points)
     :param vert_count: Number of vertices in polygon
     :param points: Points to test for polygon inclusion
     :param point_count: Number of points
     :return: Array of winding counts for each point. True is inside polygon.
     */
+    struct polygon poly;
+    init_polygon(&poly, poly_vertices, vert_count);
+
+    for (npy_intp i=0; i<point_count; i++) {
+        wind_counts[i] = polygon_wind_count(&poly, points[i * 2], points[(i * 2) + 1]);
+    }
+
+    free_polygon(&poly);
+
+    return wind_counts;
+}
+
+int * points_in_polygon_float(int *wind_counts, double *poly_vertices, npy_intp vert_count, float *points, npy_intp point_count) {
+    /*
+    Single precision version of points_in_polygon. Each point is converted
+    to double precision before testing, which is exact, so the results are
+    identical to testing the points after converting them to a float64 array.
+    */
+    struct polygon poly;
+    init_polygon(&poly, poly_vertices, vert_count);
+
+    for (npy_intp i=0; i<point_count; i++) {
+        wind_counts[i] = polygon_wind_count(&poly, (double) points[i * 2], (double) points[(i * 2) + 1]);
+    }
+
+    free_polygon(&poly);
+
+    return wind_counts;
+}
+
+// number of points tested against all the polygons at a time, small enough
+// for the points & their results to stay in cache (must be a multiple of 8)
+#define POINT_BLOCK_SIZE 1024
+
+static inline int polygon_contains(const struct polygon *poly, double point_x, double point_y) {
+    // the bounding box was already checked
     int wind_count;
-    double point_x;
-    double point_y;
-
-    // First, find the polygon's bounding box & store the min/max values
-    double min_x = poly_vertices[0];
-    double max_x = poly_vertices[0];
-    double min_y = poly_vertices[1];
-    double max_y = poly_vertices[1];
-    double vert_x, vert_y;
-    
-    for (int i=1; i<vert_count; i++) {
-        vert_x = poly_vertices[(i * 2) + 0];
-        vert_y = poly_vertices[(i * 2) + 1];
-        
-        if (vert_x < min_x) {
-            min_x = vert_x;
+    if (poly->indexed) {
+        wind_count = indexed_wind_count(&poly->index, point_x, point_y);
+    } else {
+        wind_count = calc_wind_count(point_x, point_y, poly->vert_count, poly->vertices);
+    }
+
+    return (wind_count % 2) != 0;
+}
+
+static void test_polygons_block(
+        npy_bool *block_results,
+        const struct polygon *polygons,
+        npy_intp polygon_count,
+        const double *block_points,
+        npy_intp count
+) {
+    // Tests a block of points against every polygon, storing the results for
+    // polygon j in block_results[j * POINT_BLOCK_SIZE]. For each polygon, the
+    // bounding box of every point is checked first (without branching) and
+    // only the points inside the bounding box are tested further.
+    npy_intp candidates[POINT_BLOCK_SIZE];
+
+    for (npy_intp j=0; j<polygon_count; j++) {
+        const struct polygon *poly = &polygons[j];
+        const struct bounding_box bbox = poly->bbox;
+        npy_bool *poly_results = block_results + j * POINT_BLOCK_SIZE;
+        npy_intp candidate_count = 0;
+
+        for (npy_intp i=0; i<count; i++) {
+            double point_x = block_points[i * 2];
+            double point_y = block_points[(i * 2) + 1];
+
+            // same test as point_wind_count, so NaN coordinates are candidates
+            int outside = (point_x < bbox.min_x) | (point_x > bbox.max_x) |
+                (point_y < bbox.min_y) | (point_y > bbox.max_y);
+            poly_results[i] = 0;
+            candidates[candidate_count] = i;
+            candidate_count += !outside;
         }
-        else if (vert_x > max_x) {
-            max_x = vert_x;
+
+        for (npy_intp k=0; k<candidate_count; k++) {
+            npy_intp i = candidates[k];
+            poly_results[i] = polygon_contains(poly, block_points[i * 2], block_points[(i * 2) + 1]);
         }
-        if (vert_y < min_y) {
-            min_y = vert_y;
+    }
+}
+
+static void pack_bits(npy_uint8 *packed, const npy_bool *bits, npy_intp count) {
+    // packs bools into bytes, with the first in the most significant bit
+    // like np.packbits, padding a partial last byte with zeros
+    npy_intp i = 0;
+    for (; i + 8 <= count; i += 8) {
+        packed[i / 8] = (npy_uint8) (
+            (bits[i] << 7) | (bits[i + 1] << 6) | (bits[i + 2] << 5) | (bits[i + 3] << 4) |
+            (bits[i + 4] << 3) | (bits[i + 5] << 2) | (bits[i + 6] << 1) | bits[i + 7]
+        );
+    }
+    if (i < count) {
+        npy_uint8 byte = 0;
+        for (npy_intp k=0; i + k < count; k++) {
+            byte |= (npy_uint8) (bits[i + k] << (7 - k));
         }
-        else if (vert_y > max_y) {
-            max_y = vert_y;
+        packed[i / 8] = byte;
+    }
+}
+
+static inline npy_intp source_row(const struct point_source *source, npy_intp i) {
+    // row of the points array of the i-th tested point
+    return source->subset != NULL ? source->subset[i] : i;
+}
+
+static inline const char *source_value(const struct point_source *source, npy_intp row, npy_intp k) {
+    // address of the value of dimension k of a row
+    npy_intp column_offset;
+    if (source->column_offsets != NULL) {
+        column_offset = source->column_offsets[k];
+    } else {
+        column_offset = k * (npy_intp) (source->is_float ? sizeof(float) : sizeof(double));
+    }
+
+    return source->data + (row * source->row_stride) + column_offset;
+}
+
+static const double *load_points_block(
+        const struct point_source *source,
+        npy_intp start,
+        npy_intp count,
+        double *block
+) {
+    /*
+    Returns a block of count points from the start-th tested point, as a
+    row-major array of doubles (count x dim_count). Contiguous float64 points
+    are returned in place, otherwise the points are gathered into block.
+    Converting float32 values to double precision is exact, so the results are
+    identical to testing the points after converting them to a float64 array.
+    */
+    npy_intp dim_count = source->dim_count;
+
+    if (!source->is_float && source->subset == NULL && source->column_offsets == NULL &&
+            source->row_stride == dim_count * (npy_intp) sizeof(double)) {
+        return (const double *) (source->data + (start * source->row_stride));
+    }
+
+    if (source->is_float && source->subset == NULL && source->column_offsets == NULL &&
+            source->row_stride == dim_count * (npy_intp) sizeof(float)) {
+        const float *values = (const float *) (source->data + (start * source->row_stride));
+        for (npy_intp i=0; i<count * dim_count; i++) {
+            block[i] = values[i];
+        }
+        return block;
+    }
+
+    for (npy_intp i=0; i<count; i++) {
+        npy_intp row = source_row(source, start + i);
+        for (npy_intp k=0; k<dim_count; k++) {
+            const char *value = source_value(source, row, k);
+            block[(i * dim_count) + k] = source->is_float ? (double) *(const float *) value : *(const double *) value;
         }
     }
 
-    for (int i=0; i<point_count; i++) {
-        point_x = points[i * 2];
-        point_y = points[(i * 2) + 1];
+    return block;
+}
 
-        if (point_x < min_x || point_x > max_x || point_y < min_y || point_y > max_y) {
-            wind_count = 0;
-        } else {
-            wind_count = calc_wind_count(
-                point_x,
-                point_y,
-                vert_count,
-                poly_vertices
-            );
+static void gather_column_block(
+        const struct point_source *source,
+        npy_intp k,
+        npy_intp start,
+        npy_intp count,
+        double *column
+) {
+    // Gathers the values of dimension k of a block of count points of a subset, from the start-th tested point
+    for (npy_intp i=0; i<count; i++) {
+        const char *value = source_value(source, source->subset[start + i], k);
+        column[i] = source->is_float ? (double) *(const float *) value : *(const double *) value;
+    }
+}
+
+static void accumulate_stats(
+        struct gate_stats *stats,
+        const struct point_source *source,
+        const npy_bool *block_results,
+        npy_intp start,
+        npy_intp count
+) {
+    // Adds the events of a block of points inside the gate to the statistics. The
+    // rows inside are gathered first, then each column is read for those rows only.
+    npy_intp inside[POINT_BLOCK_SIZE];
+    npy_intp inside_count = 0;
+
+    for (npy_intp i=0; i<count; i++) {
+        inside[inside_count] = i;
+        inside_count += block_results[i] != 0;
+    }
+    if (inside_count == 0) {
+        return;
+    }
+    for (npy_intp m=0; m<inside_count; m++) {
+        inside[m] = source_row(source, start + inside[m]);
+    }
+
+    for (npy_intp k=0; k<stats->column_count; k++) {
+        const char *column = stats->events + (stats->columns[k] * stats->column_stride);
+        npy_int64 *histogram = stats->histograms != NULL ? stats->histograms + (k * stats->bin_count) : NULL;
+        double hist_min = 0, hist_max = 0, bin_scale = 0;
+        if (histogram != NULL) {
+            hist_min = stats->hist_ranges[k * 2];
+            hist_max = stats->hist_ranges[(k * 2) + 1];
+            bin_scale = (double) stats->bin_count / (hist_max - hist_min);
         }
 
-        wind_counts[i] = wind_count;
+        double sum = 0;
+        double sum_sq = 0;
+        for (npy_intp m=0; m<inside_count; m++) {
+            const char *value_ptr = column + (inside[m] * stats->row_stride);
+            double value = stats->is_float ? (double) *(const float *) value_ptr : *(const double *) value_ptr;
+
+            sum += value;
+            sum_sq += value * value;
+
+            // NaN values are not in the range of any bin
+            if (histogram != NULL && value >= hist_min && value <= hist_max) {
+                npy_intp bin = (npy_intp) ((value - hist_min) * bin_scale);
+                histogram[bin < stats->bin_count ? bin : stats->bin_count - 1]++;
+            }
+        }
+
+        stats->sums[k] += sum;
+        stats->sums_sq[k] += sum_sq;
     }
+}
 
-    return wind_counts;
+static int append_indices(
+        struct index_buffer *buffer,
+        bool uint32_indices,
+        const struct point_source *source,
+        const npy_bool *block_results,
+        npy_intp start,
+        npy_intp count
+) {
+    // Appends the rows of a block of points inside a gate to an index buffer,
+    // growing the buffer (at least doubling it) when it can't hold every point
+    // of the block. Returns 0, or -1 if the buffer could not be grown.
+    if (buffer->capacity - buffer->count < count) {
+        npy_intp capacity = buffer->capacity * 2 > buffer->count + count ? buffer->capacity * 2 : buffer->count + count;
+        if (capacity < POINT_BLOCK_SIZE) {
+            capacity = POINT_BLOCK_SIZE;
+        }
+
+        void *indices = realloc(buffer->indices, capacity * (uint32_indices ? sizeof(npy_uint32) : sizeof(npy_intp)));
+        if (indices == NULL) {
+            return -1;
+        }
+        buffer->indices = indices;
+        buffer->capacity = capacity;
+    }
+
+    // every row is written, but the count only advances for the rows inside
+    npy_intp index_count = buffer->count;
+    if (uint32_indices) {
+        npy_uint32 *indices = (npy_uint32 *) buffer->indices;
+        for (npy_intp i=0; i<count; i++) {
+            indices[index_count] = (npy_uint32) source_row(source, start + i);
+            index_count += block_results[i] != 0;
+        }
+    } else {
+        npy_intp *indices = (npy_intp *) buffer->indices;
+        for (npy_intp i=0; i<count; i++) {
+            indices[index_count] = source_row(source, start + i);
+            index_count += block_results[i] != 0;
+        }
+    }
+    buffer->count = index_count;
+
+    return 0;
+}
+
+void free_index_buffers(struct index_buffer *buffers, npy_intp gate_count) {
+    for (npy_intp j=0; j<gate_count; j++) {
+        free(buffers[j].indices);
+        buffers[j].indices = NULL;
+        buffers[j].count = 0;
+        buffers[j].capacity = 0;
+    }
+}
+
+static int write_block_results(
+        struct gate_output *output,
+        const struct point_source *source,
+        const npy_bool *block_results,
+        npy_intp gate_count,
+        npy_intp start,
+        npy_intp count
+) {
+    // Writes the results of a block of points from the start-th tested point, where
+    // the results for gate j are in block_results[j * POINT_BLOCK_SIZE]. Returns 0,
+    // or -1 if memory could not be allocated.
+    if (output->counts != NULL) {
+        for (npy_intp j=0; j<gate_count; j++) {
+            const npy_bool *gate_results = block_results + (j * POINT_BLOCK_SIZE);
+            npy_int64 inside_count = 0;
+            for (npy_intp i=0; i<count; i++) {
+                inside_count += gate_results[i] != 0;
+            }
+            output->counts[j] += inside_count;
+        }
+    }
+
+    switch (output->mode) {
+        case GATE_OUTPUT_MASK: {
+            npy_bool *mask = (npy_bool *) output->results + (start * gate_count);
+            if (gate_count == 1) {
+                memcpy(mask, block_results, count * sizeof(npy_bool));
+                break;
+            }
+            for (npy_intp i=0; i<count; i++) {
+                for (npy_intp j=0; j<gate_count; j++) {
+                    mask[(i * gate_count) + j] = block_results[(j * POINT_BLOCK_SIZE) + i];
+                }
+            }
+            break;
+        }
+        case GATE_OUTPUT_PACKED:
+            for (npy_intp j=0; j<gate_count; j++) {
+                npy_uint8 *packed_row = (npy_uint8 *) output->results + (j * output->packed_row_stride);
+                pack_bits(packed_row + start / 8, block_results + (j * POINT_BLOCK_SIZE), count);
+            }
+            break;
+        case GATE_OUTPUT_INDICES:
+            for (npy_intp j=0; j<gate_count; j++) {
+                if (append_indices(
+                        &output->index_buffers[j], output->uint32_indices, source,
+                        block_results + (j * POINT_BLOCK_SIZE), start, count) != 0) {
+                    return -1;
+                }
+            }
+            break;
+        case GATE_OUTPUT_STATS:
+            accumulate_stats(output->stats, source, block_results, start, count);
+            break;
+        case GATE_OUTPUT_COUNT:
+            break;
+    }
+
+    return 0;
+}
+
+int test_polygons(
+        struct gate_output *output,
+        const struct polygon *polygons,
+        npy_intp polygon_count,
+        const struct point_source *points
+) {
+    /*
+    Tests blocks of points against every polygon, so the points are only
+    read from memory once, writing the results of each block to the output
+    (a mask, packed bits, indices, counts, or statistics of the events inside).
+
+    :param output: where the results are written, see gate_output
+    :param polygons: Polygons prepared by init_polygon
+    :param polygon_count: Number of polygons (1 for statistics)
+    :param points: Points to test, with 2 dimensions
+    :return: 0 on success, -1 if memory could not be allocated
+    */
+    double block_buffer[POINT_BLOCK_SIZE * 2];
+    npy_bool *block_results = malloc((polygon_count > 0 ? polygon_count : 1) * POINT_BLOCK_SIZE * sizeof(npy_bool));
+    if (block_results == NULL) {
+        return -1;
+    }
+
+    int status = 0;
+    for (npy_intp start=0; start<points->point_count && status == 0; start+=POINT_BLOCK_SIZE) {
+        npy_intp count = points->point_count - start < POINT_BLOCK_SIZE ? points->point_count - start : POINT_BLOCK_SIZE;
+        const double *block_points = load_points_block(points, start, count, block_buffer);
+
+        test_polygons_block(block_results, polygons, polygon_count, block_points, count);
+        status = write_block_results(output, points, block_results, polygon_count, start, count);
+    }
+
+    free(block_results);
+
+    return status;
+}
+
+int test_ellipsoid(
+        struct gate_output *output,
+        const double *inv_cov_matrix,
+        const double *means,
+        double distance_square,
+        const struct point_source *points
+) {
+    /*
+    Tests blocks of points for ellipsoid inclusion, writing the results of each
+    block to the output. Points on the edge are considered inclusive. The inverse
+    covariance matrix is computed once by the caller, and each point's
+    Mahalanobis distance is computed without any intermediate arrays.
+
+    :param output: where the results are written, see gate_output
+    :param inv_cov_matrix: Inverse of the ellipsoid's covariance matrix (row-major, dim_count x dim_count)
+    :param means: Center point of the ellipsoid
+    :param distance_square: Square of the Mahalanobis distance of the ellipsoid boundary
+    :param points: Points to test, with dim_count dimensions
+    :return: 0 on success, -1 if memory could not be allocated
+    */
+    npy_bool block_results[POINT_BLOCK_SIZE];
+    npy_intp dim_count = points->dim_count;
+    double *translated = malloc((dim_count > 0 ? dim_count : 1) * sizeof(double));
+    double *block_buffer = malloc((dim_count > 0 ? dim_count : 1) * POINT_BLOCK_SIZE * sizeof(double));
+    if (translated == NULL || block_buffer == NULL) {
+        free(translated);
+        free(block_buffer);
+        return -1;
+    }
+
+    int status = 0;
+    for (npy_intp start=0; start<points->point_count && status == 0; start+=POINT_BLOCK_SIZE) {
+        npy_intp count = points->point_count - start < POINT_BLOCK_SIZE ? points->point_count - start : POINT_BLOCK_SIZE;
+        const double *block_points = load_points_block(points, start, count, block_buffer);
+
+        for (npy_intp i=0; i<count; i++) {
+            const double *point = block_points + (i * dim_count);
+
+            // translate the point, considering the ellipsoid at the origin
+            for (npy_intp k=0; k<dim_count; k++) {
+                translated[k] = point[k] - means[k];
+            }
+
+            // square of the Mahalanobis distance: the translated point is rotated by
+            // the inverse covariance matrix, then multiplied by the translated point
+            double distance = 0;
+            for (npy_intp j=0; j<dim_count; j++) {
+                double rotated = 0;
+                for (npy_intp k=0; k<dim_count; k++) {
+                    rotated += translated[k] * inv_cov_matrix[(k * dim_count) + j];
+                }
+                distance += rotated * translated[j];
+            }
+
+            // points on the boundary are inclusive
+            block_results[i] = distance <= distance_square;
+        }
+
+        status = write_block_results(output, points, block_results, 1, start, count);
+    }
+
+    free(translated);
+    free(block_buffer);
+
+    return status;
+}
+
+static npy_bool test_rectangle_dimension(
+        npy_bool *block_results,
+        const char *values,
+        npy_intp stride,
+        npy_intp count,
+        double lo,
+        double hi,
+        bool is_float
+) {
+    /*
+    Clears the results of a block of points outside the range of a dimension,
+    where the range is lo <= x < hi, and values are stride bytes apart. The
+    tests are branch-free so they can be vectorized: a NaN hi never excludes a
+    point, and NaN values are excluded by the test against lo. Returns whether
+    any point in the block is still inside.
+    */
+    npy_bool any_inside = 0;
+
+    if (is_float) {
+        for (npy_intp i=0; i<count; i++) {
+            double value = *(const float *) (values + (i * stride));
+            block_results[i] &= (value >= lo) & !(value >= hi);
+            any_inside |= block_results[i];
+        }
+    } else {
+        for (npy_intp i=0; i<count; i++) {
+            double value = *(const double *) (values + (i * stride));
+            block_results[i] &= (value >= lo) & !(value >= hi);
+            any_inside |= block_results[i];
+        }
+    }
+
+    return any_inside;
+}
+
+int test_rectangle(
+        struct gate_output *output,
+        const double *mins,
+        const double *maxs,
+        const struct point_source *points
+) {
+    /*
+    Tests blocks of points for rectangle (range gate) inclusion in n-dimensions,
+    writing the results of each block to the output. Following GatingML, the
+    minimum of each range is inclusive and the maximum is exclusive. Each block
+    of points is tested one dimension at a time, stopping early once no point in
+    the block is inside the rectangle.
+
+    :param output: where the results are written, see gate_output
+    :param mins: Minimum of each dimension, NaN for no minimum
+    :param maxs: Maximum of each dimension, NaN for no maximum
+    :param points: Points to test
+    :return: 0 on success, -1 if memory could not be allocated
+    */
+    npy_bool block_results[POINT_BLOCK_SIZE];
+    double values[POINT_BLOCK_SIZE];
+
+    int status = 0;
+    for (npy_intp start=0; start<points->point_count && status == 0; start+=POINT_BLOCK_SIZE) {
+        npy_intp count = points->point_count - start < POINT_BLOCK_SIZE ? points->point_count - start : POINT_BLOCK_SIZE;
+
+        memset(block_results, 1, count * sizeof(npy_bool));
+
+        for (npy_intp k=0; k<points->dim_count; k++) {
+            if (isnan(mins[k]) && isnan(maxs[k])) {
+                // dimension is open at both ends, it doesn't constrain the points
+                continue;
+            }
+
+            // an open minimum only excludes NaN values
+            double lo = isnan(mins[k]) ? -INFINITY : mins[k];
+
+            // the values of a subset are gathered, otherwise they're read in place
+            bool stop;
+            if (points->subset != NULL) {
+                gather_column_block(points, k, start, count, values);
+                stop = !test_rectangle_dimension(
+                    block_results, (const char *) values, sizeof(double), count, lo, maxs[k], false
+                );
+            } else {
+                stop = !test_rectangle_dimension(
+                    block_results, source_value(points, start, k), points->row_stride, count, lo, maxs[k],
+                    points->is_float
+                );
+            }
+
+            // stop once every point in the block is outside the rectangle, so the
+            // values of the remaining dimensions are not read
+            if (stop) {
+                break;
+            }
+        }
+
+        status = write_block_results(output, points, block_results, 1, start, count);
+    }
+
+    return status;
 }
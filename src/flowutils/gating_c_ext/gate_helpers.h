@@ -1,2 +1,107 @@
-int calc_wind_count(double point_x, double point_y, int vert_count, double *poly_vertices);
-int * points_in_polygon(int *wind_counts, double *poly_vertices, int vert_count, double *points, int point_count);
+#include <numpy/npy_common.h>
+#include <stdbool.h>
+
+struct bounding_box {
+    double min_x;
+    double max_x;
+    double min_y;
+    double max_y;
+};
+
+struct polygon_index {
+    struct bounding_box bbox;
+
+    // horizontal slabs of equal height covering the bounding box
+    npy_intp slab_count;
+    double slab_scale;  // slabs per unit of y
+
+    // edges overlapping each slab in CSR layout: the edges of slab i are
+    // slab_edges[slab_offsets[i] * 4] up to slab_edges[slab_offsets[i + 1] * 4],
+    // stored as (a_x, a_y, b_x, b_y)
+    npy_intp *slab_offsets;
+    double *slab_edges;
+};
+
+// a polygon prepared for testing points, see init_polygon
+struct polygon {
+    double *vertices;
+    npy_intp vert_count;
+    struct bounding_box bbox;
+    int indexed;
+    struct polygon_index index;
+};
+
+// the points tested by a gate: rows of a 2-D array of float32 or float64 values read
+// in place, optionally only some of the columns (the gate dimensions) & some of the rows
+struct point_source {
+    const char *data;
+    npy_intp row_stride;             // bytes between rows
+    const npy_intp *column_offsets;  // byte offset of each dimension in a row, NULL for the first dim_count values
+    npy_intp dim_count;
+    bool is_float;
+    const npy_intp *subset;          // optional (NULL for every row) rows of the points to test, in order
+    npy_intp point_count;            // number of points tested: rows, or indices in subset
+};
+
+// statistics of the events inside a gate, accumulated as each block of points is tested
+struct gate_stats {
+    // event data with a row for each tested point, the rows & columns may be strided
+    const char *events;
+    npy_intp row_stride;
+    npy_intp column_stride;
+    bool is_float;
+
+    // columns of the events to accumulate statistics for
+    const npy_intp *columns;
+    npy_intp column_count;
+
+    // sums & sums of squares of each column, added to the existing values
+    double *sums;
+    double *sums_sq;
+
+    // optional (NULL for none) histograms of bin_count bins for each column, covering
+    // hist_ranges[k * 2] to hist_ranges[(k * 2) + 1]. Like np.histogram, the last bin
+    // includes its upper edge, and values outside the range are not counted.
+    npy_int64 *histograms;
+    npy_intp bin_count;
+    const double *hist_ranges;
+};
+
+enum gate_output_mode {
+    GATE_OUTPUT_MASK,    // bool array of (point_count, gate_count), row-major
+    GATE_OUTPUT_PACKED,  // packed bits (like np.packbits) with a row for each gate
+    GATE_OUTPUT_INDICES, // rows of the points inside each gate, appended to an index_buffer
+    GATE_OUTPUT_COUNT,   // only the number of points inside each gate
+    GATE_OUTPUT_STATS    // statistics of the events inside a single gate
+};
+
+// a growable array of indices, see free_index_buffers
+struct index_buffer {
+    void *indices;  // npy_intp, or npy_uint32 for uint32_indices
+    npy_intp count;
+    npy_intp capacity;
+};
+
+// where the results of each block of tested points are written
+struct gate_output {
+    enum gate_output_mode mode;
+    void *results;               // mask or packed bits
+    npy_intp packed_row_stride;  // bytes between the packed rows of each gate
+    npy_int64 *counts;           // optional (NULL for none) number of points inside each gate, added to
+    struct gate_stats *stats;
+    struct index_buffer *index_buffers;  // a buffer for each gate, initially empty (zeroed)
+    bool uint32_indices;
+};
+
+int calc_wind_count(double point_x, double point_y, npy_intp vert_count, double *poly_vertices);
+int build_polygon_index(struct polygon_index *index, double *poly_vertices, npy_intp vert_count);
+void free_polygon_index(struct polygon_index *index);
+int indexed_wind_count(const struct polygon_index *index, double point_x, double point_y);
+void init_polygon(struct polygon *poly, double *poly_vertices, npy_intp vert_count);
+void free_polygon(struct polygon *poly);
+int * points_in_polygon(int *wind_counts, double *poly_vertices, npy_intp vert_count, double *points, npy_intp point_count);
+int * points_in_polygon_float(int *wind_counts, double *poly_vertices, npy_intp vert_count, float *points, npy_intp point_count);
+void free_index_buffers(struct index_buffer *buffers, npy_intp gate_count);
+int test_polygons(struct gate_output *output, const struct polygon *polygons, npy_intp polygon_count, const struct point_source *points);
+int test_ellipsoid(struct gate_output *output, const double *inv_cov_matrix, const double *means, double distance_square, const struct point_source *points);
+int test_rectangle(struct gate_output *output, const double *mins, const double *maxs, const struct point_source *points);
@@ -1,6 +1,7 @@
 #include <Python.h>
 #define NPY_NO_DEPRECATED_API NPY_1_7_API_VERSION // to avoid a warning
 #include <numpy/arrayobject.h>
+#include <structmember.h>
 #include "logicle.h"
 
 static PyObject *wrap_logicle_scale(PyObject *self, PyObject *args) {
@@ -20,13 +21,15 @@ static PyObject *wrap_logicle_scale(PyObject *self, PyObject *args) {
     }
 
     // get length of input array
-    int n = (int)PyArray_DIM(x_array, 0);
+    npy_intp n = PyArray_DIM(x_array, 0);
 
     // get pointers to the data as C-type
     double *xc = (double*)PyArray_DATA(x_array);
 
     // now we can call our function!
+    Py_BEGIN_ALLOW_THREADS
     logicle_scale(t, w, m, a, xc, n);
+    Py_END_ALLOW_THREADS
 
     return (PyObject *) x_array;
 }
@@ -48,13 +51,15 @@ static PyObject *wrap_logicle_inverse(PyObject *self, PyObject *args) {
     }
 
     // get length of input array
-    int n = (int)PyArray_DIM(x_array, 0);
+    npy_intp n = PyArray_DIM(x_array, 0);
 
     // get pointers to the data as C-type
     double *xc = (double*)PyArray_DATA(x_array);
 
     // now we can call our function!
+    Py_BEGIN_ALLOW_THREADS
     logicle_inverse(t, w, m, a, xc, n);
+    Py_END_ALLOW_THREADS
 
     return (PyObject *) x_array;
 }
@@ -76,13 +81,15 @@ static PyObject *wrap_hyperlog_scale(PyObject *self, PyObject *args) {
     }
 
     // get length of input array
-    int n = (int)PyArray_DIM(x_array, 0);
+    npy_intp n = PyArray_DIM(x_array, 0);
 
     // get pointers to the data as C-type
     double *xc = (double*)PyArray_DATA(x_array);
 
     // now we can call our function!
+    Py_BEGIN_ALLOW_THREADS
     hyperlog_scale(t, w, m, a, xc, n);
+    Py_END_ALLOW_THREADS
 
     return (PyObject *) x_array;
 }
@@ -104,23 +111,457 @@ static PyObject *wrap_hyperlog_inverse(PyObject *self, PyObject *args) {
     }
 
     // get length of input array
-    int n = (int)PyArray_DIM(x_array, 0);
+    npy_intp n = PyArray_DIM(x_array, 0);
 
     // get pointers to the data as C-type
     double *xc = (double*)PyArray_DATA(x_array);
 
     // now we can call our function!
+    Py_BEGIN_ALLOW_THREADS
     hyperlog_inverse(t, w, m, a, xc, n);
+    Py_END_ALLOW_THREADS
 
     return (PyObject *) x_array;
 }
 
 
+// Transform objects store the (T, W, M, A) parameters along with everything
+// derived from them (solved d value, Taylor series coefficients, etc.), so
+// repeated calls do not need to re-initialize the transform.
+// strided transform functions for each supported data type
+struct transform_funcs {
+    transform_strided_func scale;
+    transform_strided_func inverse;
+    transform_strided_func scale_float;
+    transform_strided_func inverse_float;
+};
+
+static const struct transform_funcs logicle_funcs = {
+    logicle_scale_strided,
+    logicle_inverse_strided,
+    logicle_scale_strided_float,
+    logicle_inverse_strided_float
+};
+
+// Logicle using the lookup table for the scale, the inverse is always exact
+static const struct transform_funcs logicle_lookup_funcs = {
+    logicle_lookup_scale_strided,
+    logicle_inverse_strided,
+    logicle_lookup_scale_strided_float,
+    logicle_inverse_strided_float
+};
+
+static const struct transform_funcs hyperlog_funcs = {
+    hyperlog_scale_strided,
+    hyperlog_inverse_strided,
+    hyperlog_scale_strided_float,
+    hyperlog_inverse_strided_float
+};
+
+typedef struct {
+    PyObject_HEAD
+    struct logicle_params params;
+    const struct transform_funcs *funcs;
+} TransformObject;
+
+static transform_strided_func get_transform_func(TransformObject *xform, int type_num, int inverse) {
+    if (type_num == NPY_FLOAT) {
+        return inverse ? xform->funcs->inverse_float : xform->funcs->scale_float;
+    }
+    return inverse ? xform->funcs->inverse : xform->funcs->scale;
+}
+
+static int parse_transform_params(PyObject *args, PyObject *kwds, double *t, double *w, double *m, double *a) {
+    static char *kwlist[] = {"t", "w", "m", "a", NULL};
+
+    return PyArg_ParseTupleAndKeywords(args, kwds, "dddd", kwlist, t, w, m, a);
+}
+
+static int Logicle_init(TransformObject *self, PyObject *args, PyObject *kwds) {
+    double t, w, m, a;
+    int lut_bins = 0;
+    static char *kwlist[] = {"t", "w", "m", "a", "lut_bins", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "dddd|i", kwlist, &t, &w, &m, &a, &lut_bins)) {
+        return -1;
+    }
+    if (lut_bins < 0) {
+        PyErr_SetString(PyExc_ValueError, "lut_bins must be non-negative");
+        return -1;
+    }
+
+    // release any lookup table from a previous initialization
+    logicle_free_lookup(&self->params);
+    logicle_initialize(&self->params, t, w, m, a);
+    self->funcs = &logicle_funcs;
+
+    if (lut_bins > 0) {
+        if (logicle_build_lookup(&self->params, lut_bins) < 0) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        self->funcs = &logicle_lookup_funcs;
+    }
+
+    return 0;
+}
+
+static void Transform_dealloc(TransformObject *self) {
+    logicle_free_lookup(&self->params);
+    Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+static int Hyperlog_init(TransformObject *self, PyObject *args, PyObject *kwds) {
+    double t, w, m, a;
+
+    if (!parse_transform_params(args, kwds, &t, &w, &m, &a)) {
+        return -1;
+    }
+
+    hyperlog_initialize(&self->params, t, w, m, a);
+    self->funcs = &hyperlog_funcs;
+
+    return 0;
+}
+
+static PyObject *apply_transform(TransformObject *self, PyObject *x, int inverse) {
+    if (self->funcs == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "Transform object was not initialized");
+        return NULL;
+    }
+    if (!PyArray_Check(x)) {
+        PyErr_SetString(PyExc_TypeError, "x must be a NumPy array");
+        return NULL;
+    }
+
+    PyArrayObject *x_array = (PyArrayObject *) x;
+    int type_num = PyArray_TYPE(x_array);
+
+    // float64 & float32 arrays are transformed in place without making any copies
+    if ((type_num == NPY_DOUBLE || type_num == NPY_FLOAT) && PyArray_ISALIGNED(x_array) && PyArray_ISWRITEABLE(x_array)) {
+        transform_strided_func func = get_transform_func(self, type_num, inverse);
+
+        char *xc = PyArray_DATA(x_array);
+
+        if (PyArray_NDIM(x_array) == 1) {
+            npy_intp n = PyArray_DIM(x_array, 0);
+            npy_intp stride = PyArray_STRIDE(x_array, 0);
+
+            Py_BEGIN_ALLOW_THREADS
+            func(&self->params, xc, n, stride);
+            Py_END_ALLOW_THREADS
+
+            Py_INCREF(x);
+            return x;
+        } else if (PyArray_IS_C_CONTIGUOUS(x_array)) {
+            npy_intp n = PyArray_SIZE(x_array);
+            npy_intp stride = PyArray_ITEMSIZE(x_array);
+
+            Py_BEGIN_ALLOW_THREADS
+            func(&self->params, xc, n, stride);
+            Py_END_ALLOW_THREADS
+
+            Py_INCREF(x);
+            return x;
+        }
+    }
+
+    // otherwise, transform a float64 copy that gets written back to x
+    PyArrayObject *x_copy = (PyArrayObject *) PyArray_FromArray(
+        x_array, PyArray_DescrFromType(NPY_DOUBLE), NPY_ARRAY_INOUT_ARRAY2
+    );
+    if (!x_copy) {
+        return NULL;
+    }
+
+    transform_strided_func func = get_transform_func(self, NPY_DOUBLE, inverse);
+    char *xc = PyArray_DATA(x_copy);
+    npy_intp n = PyArray_SIZE(x_copy);
+
+    Py_BEGIN_ALLOW_THREADS
+    func(&self->params, xc, n, sizeof(double));
+    Py_END_ALLOW_THREADS
+
+    PyArray_ResolveWritebackIfCopy(x_copy);
+    Py_DECREF(x_copy);
+
+    Py_INCREF(x);
+    return x;
+}
+
+static PyObject *Transform_scale(TransformObject *self, PyObject *x) {
+    return apply_transform(self, x, 0);
+}
+
+static PyObject *Transform_inverse(TransformObject *self, PyObject *x) {
+    return apply_transform(self, x, 1);
+}
+
+static PyMemberDef transform_members[] = {
+    {"t", T_DOUBLE, offsetof(TransformObject, params.T), READONLY, NULL},
+    {"w", T_DOUBLE, offsetof(TransformObject, params.W), READONLY, NULL},
+    {"m", T_DOUBLE, offsetof(TransformObject, params.M), READONLY, NULL},
+    {"a", T_DOUBLE, offsetof(TransformObject, params.A), READONLY, NULL},
+    {"lut_bins", T_INT, offsetof(TransformObject, params.bins), READONLY, NULL},
+    {NULL}
+};
+
+static PyMethodDef transform_methods[] = {
+    {"scale", (PyCFunction) Transform_scale, METH_O, NULL},
+    {"inverse", (PyCFunction) Transform_inverse, METH_O, NULL},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyTypeObject LogicleType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "logicle_c.Logicle",
+    .tp_basicsize = sizeof(TransformObject),
+    .tp_dealloc = (destructor) Transform_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_new = PyType_GenericNew,
+    .tp_init = (initproc) Logicle_init,
+    .tp_methods = transform_methods,
+    .tp_members = transform_members,
+};
+
+static PyTypeObject HyperlogType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "logicle_c.Hyperlog",
+    .tp_basicsize = sizeof(TransformObject),
+    .tp_dealloc = (destructor) Transform_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_new = PyType_GenericNew,
+    .tp_init = (initproc) Hyperlog_init,
+    .tp_methods = transform_methods,
+    .tp_members = transform_members,
+};
+
+static int add_transform_types(PyObject *m) {
+    if (PyType_Ready(&LogicleType) < 0 || PyType_Ready(&HyperlogType) < 0) {
+        return -1;
+    }
+
+    Py_INCREF(&LogicleType);
+    if (PyModule_AddObject(m, "Logicle", (PyObject *) &LogicleType) < 0) {
+        Py_DECREF(&LogicleType);
+        return -1;
+    }
+
+    Py_INCREF(&HyperlogType);
+    if (PyModule_AddObject(m, "Hyperlog", (PyObject *) &HyperlogType) < 0) {
+        Py_DECREF(&HyperlogType);
+        return -1;
+    }
+
+    return 0;
+}
+
+static int is_transform_object(PyObject *obj) {
+    return PyObject_TypeCheck(obj, &LogicleType) || PyObject_TypeCheck(obj, &HyperlogType);
+}
+
+// Checks the statistics arrays of transform_columns: an int64 histogram with a row of
+// (3 * bins + 3) counts for each channel & a float64 array of (min, max) for each channel
+static int check_stats_arrays(PyObject *histogram, PyObject *extrema, npy_intp channel_count) {
+    if (!PyArray_Check(histogram) || !PyArray_Check(extrema)) {
+        PyErr_SetString(PyExc_TypeError, "histogram and extrema must both be NumPy arrays");
+        return 0;
+    }
+
+    PyArrayObject *histogram_array = (PyArrayObject *) histogram;
+    PyArrayObject *extrema_array = (PyArrayObject *) extrema;
+    int flags = NPY_ARRAY_C_CONTIGUOUS | NPY_ARRAY_ALIGNED | NPY_ARRAY_WRITEABLE;
+
+    if (PyArray_TYPE(histogram_array) != NPY_INT64 || !PyArray_CHKFLAGS(histogram_array, flags)
+            || PyArray_NDIM(histogram_array) != 2 || PyArray_DIM(histogram_array, 0) != channel_count
+            || PyArray_DIM(histogram_array, 1) < 6 || PyArray_DIM(histogram_array, 1) % 3 != 0) {
+        PyErr_SetString(
+            PyExc_ValueError,
+            "histogram must be a writeable, C-contiguous int64 array with a row of (3 * bins + 3) counts for each channel"
+        );
+        return 0;
+    }
+    if (PyArray_TYPE(extrema_array) != NPY_DOUBLE || !PyArray_CHKFLAGS(extrema_array, flags)
+            || PyArray_NDIM(extrema_array) != 2 || PyArray_DIM(extrema_array, 0) != channel_count
+            || PyArray_DIM(extrema_array, 1) != 2) {
+        PyErr_SetString(
+            PyExc_ValueError, "extrema must be a writeable, C-contiguous float64 array of shape (channels, 2)"
+        );
+        return 0;
+    }
+
+    return 1;
+}
+
+// number of rows processed for all channels before moving to the next
+// block, keeps the block in cache for C-ordered event data
+#define ROW_BLOCK_SIZE 512
+
+static PyObject *wrap_transform_columns(PyObject *self, PyObject *args, PyObject *kwds) {
+    PyObject *data;
+    PyObject *channel_indices;
+    PyObject *transforms;
+    int inverse = 0;
+    PyObject *histogram = Py_None;
+    PyObject *extrema = Py_None;
+    static char *kwlist[] = {"data", "channel_indices", "transforms", "inverse", "histogram", "extrema", NULL};
+
+    // parse the input args tuple
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kwds, "O!OO|pOO", kwlist, &PyArray_Type, &data, &channel_indices, &transforms, &inverse,
+            &histogram, &extrema)) {
+        return NULL;
+    }
+
+    // the data is transformed in place, so we need direct access to it
+    PyArrayObject *data_array = (PyArrayObject *) data;
+    if (PyArray_NDIM(data_array) != 2) {
+        PyErr_SetString(PyExc_ValueError, "data must be a 2-D array");
+        return NULL;
+    }
+    int type_num = PyArray_TYPE(data_array);
+    if (type_num != NPY_DOUBLE && type_num != NPY_FLOAT) {
+        PyErr_SetString(PyExc_TypeError, "data must be a float64 or float32 array");
+        return NULL;
+    }
+    if (!PyArray_ISALIGNED(data_array) || !PyArray_ISWRITEABLE(data_array)) {
+        PyErr_SetString(PyExc_ValueError, "data must be an aligned, writeable array");
+        return NULL;
+    }
+
+    npy_intp row_count = PyArray_DIM(data_array, 0);
+    npy_intp col_count = PyArray_DIM(data_array, 1);
+    npy_intp row_stride = PyArray_STRIDE(data_array, 0);
+    npy_intp col_stride = PyArray_STRIDE(data_array, 1);
+    char *data_c = (char *) PyArray_DATA(data_array);
+
+    PyArrayObject *index_array = (PyArrayObject *) PyArray_FROM_OTF(channel_indices, NPY_INTP, NPY_ARRAY_IN_ARRAY);
+    if (!index_array) {
+        return NULL;
+    }
+    if (PyArray_NDIM(index_array) > 1) {
+        Py_DECREF(index_array);
+        PyErr_SetString(PyExc_ValueError, "channel_indices must be a 1-D sequence");
+        return NULL;
+    }
+
+    npy_intp channel_count = PyArray_SIZE(index_array);
+    npy_intp *indices_c = (npy_intp *) PyArray_DATA(index_array);
+
+    // transforms may be a single transform object shared by all channels
+    // or a sequence with one transform object per channel
+    PyObject *transform_seq = NULL;
+    if (!is_transform_object(transforms)) {
+        transform_seq = PySequence_Fast(transforms, "transforms must be a transform object or a sequence of them");
+        if (!transform_seq) {
+            Py_DECREF(index_array);
+            return NULL;
+        }
+        if (PySequence_Fast_GET_SIZE(transform_seq) != channel_count) {
+            Py_DECREF(index_array);
+            Py_DECREF(transform_seq);
+            PyErr_SetString(PyExc_ValueError, "Number of transforms does not match number of channel indices");
+            return NULL;
+        }
+    }
+
+    // optional statistics of the transformed values, see transform_stats_strided
+    long long *histogram_c = NULL;
+    double *extrema_c = NULL;
+    npy_intp histogram_width = 0;
+    if (histogram != Py_None || extrema != Py_None) {
+        if (!check_stats_arrays(histogram, extrema, channel_count)) {
+            Py_DECREF(index_array);
+            Py_XDECREF(transform_seq);
+            return NULL;
+        }
+        histogram_c = (long long *) PyArray_DATA((PyArrayObject *) histogram);
+        extrema_c = (double *) PyArray_DATA((PyArrayObject *) extrema);
+        histogram_width = PyArray_DIM((PyArrayObject *) histogram, 1);
+    }
+
+    const struct logicle_params **params = malloc(channel_count * sizeof(struct logicle_params *));
+    transform_strided_func *funcs = malloc(channel_count * sizeof(transform_strided_func));
+    npy_intp *col_offsets = malloc(channel_count * sizeof(npy_intp));
+
+    if ((!params || !funcs || !col_offsets) && channel_count > 0) {
+        free(params);
+        free(funcs);
+        free(col_offsets);
+        Py_DECREF(index_array);
+        Py_XDECREF(transform_seq);
+        return PyErr_NoMemory();
+    }
+
+    for (npy_intp i = 0; i < channel_count; i++) {
+        PyObject *xform = transform_seq ? PySequence_Fast_GET_ITEM(transform_seq, i) : transforms;
+        npy_intp col = indices_c[i];
+
+        if (!is_transform_object(xform)) {
+            PyErr_SetString(PyExc_TypeError, "transforms must be Logicle or Hyperlog objects");
+        } else if (((TransformObject *) xform)->funcs == NULL) {
+            PyErr_SetString(PyExc_RuntimeError, "Transform object was not initialized");
+        } else if (col < -col_count || col >= col_count) {
+            PyErr_Format(PyExc_IndexError, "channel index %zd is out of bounds", (Py_ssize_t) col);
+        }
+        if (PyErr_Occurred()) {
+            free(params);
+            free(funcs);
+            free(col_offsets);
+            Py_DECREF(index_array);
+            Py_XDECREF(transform_seq);
+            return NULL;
+        }
+
+        // allow negative indices like NumPy
+        if (col < 0) {
+            col += col_count;
+        }
+
+        params[i] = &((TransformObject *) xform)->params;
+        funcs[i] = get_transform_func((TransformObject *) xform, type_num, inverse);
+        col_offsets[i] = col * col_stride;
+    }
+
+    // process blocks of rows, transforming every channel within a block
+    // before moving on so each block only needs to be loaded once
+    Py_BEGIN_ALLOW_THREADS
+    for (npy_intp row = 0; row < row_count; row += ROW_BLOCK_SIZE) {
+        npy_intp block_rows = row_count - row;
+        if (block_rows > ROW_BLOCK_SIZE) {
+            block_rows = ROW_BLOCK_SIZE;
+        }
+        char *block = data_c + row * row_stride;
+
+        for (npy_intp i = 0; i < channel_count; i++) {
+            funcs[i](params[i], block + col_offsets[i], block_rows, row_stride);
+
+            if (histogram_c) {
+                transform_stats_strided(
+                    block + col_offsets[i], block_rows, row_stride, type_num == NPY_FLOAT,
+                    histogram_c + i * histogram_width, histogram_width / 3 - 1, extrema_c + 2 * i
+                );
+            }
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    free(params);
+    free(funcs);
+    free(col_offsets);
+    Py_DECREF(index_array);
+    Py_XDECREF(transform_seq);
+
+    Py_INCREF(data);
+    return data;
+}
+
 static PyMethodDef module_methods[] = {
     {"logicle_scale", wrap_logicle_scale, METH_VARARGS, NULL},
     {"logicle_inverse", wrap_logicle_inverse, METH_VARARGS, NULL},
     {"hyperlog_scale", wrap_hyperlog_scale, METH_VARARGS, NULL},
     {"hyperlog_inverse", wrap_hyperlog_inverse, METH_VARARGS, NULL},
+    {"transform_columns", (PyCFunction) wrap_transform_columns, METH_VARARGS | METH_KEYWORDS, NULL},
     {NULL, NULL, 0, NULL}
 };
 
@@ -145,6 +586,11 @@ PyMODINIT_FUNC PyInit_logicle_c(void) {
         return NULL;
     }
 
+    if (add_transform_types(m) < 0) {
+        Py_DECREF(m);
+        return NULL;
+    }
+
     return m;
 }
 #else
@@ -160,6 +606,11 @@ PyMODINIT_FUNC initlogicle_c(void) {
         return;
     }
 
+    if (add_transform_types(m) < 0) {
+        Py_DECREF(m);
+        return;
+    }
+
     return;
 }
 #endif
@@ -1,4 +1,60 @@
-void logicle_scale(double t, double w, double m, double a, double* x, int n);
-void logicle_inverse(double t, double w, double m, double a, double* x, int n);
-void hyperlog_scale(double t, double w, double m, double a, double* x, int n);
-void hyperlog_inverse(double t, double w, double m, double a, double* x, int n);
\ No newline at end of file
+#include <numpy/npy_common.h>
+#include <stdbool.h>
+
+// 16 is enough for full precision of typical scales
+#define TAYLOR_LENGTH 16
+
+struct logicle_params
+{
+    double T, W, M, A;
+
+    double a, b, c, d, f;
+    double w, x0, x1, x2;
+
+    double xTaylor;
+    double taylor[TAYLOR_LENGTH];
+
+    double inverse;  // for hyperlog only
+
+    double *lookup;
+    int bins;
+
+    // index into the lookup table, bucketed by the bits of the data value
+    int *lookup_index;
+    int index_count;
+    long long index_base;
+};
+
+void logicle_initialize(struct logicle_params *p, double T, double W, double M, double A);
+void hyperlog_initialize(struct logicle_params *p, double T, double W, double M, double A);
+
+typedef void (*transform_strided_func)(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+
+void logicle_scale_strided(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+void logicle_inverse_strided(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+void hyperlog_scale_strided(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+void hyperlog_inverse_strided(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+
+void logicle_scale_strided_float(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+void logicle_inverse_strided_float(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+void hyperlog_scale_strided_float(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+void hyperlog_inverse_strided_float(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+
+int logicle_build_lookup(struct logicle_params *p, int bins);
+void logicle_free_lookup(struct logicle_params *p);
+void logicle_lookup_scale_strided(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+void logicle_lookup_scale_strided_float(const struct logicle_params *p, char *x, npy_intp n, npy_intp stride);
+
+void transform_stats_strided(
+    const char *x, npy_intp n, npy_intp stride, bool is_float, long long *counts, npy_intp bins, double *extrema
+);
+
+void logicle_scale_array(const struct logicle_params *p, double* x, npy_intp n);
+void logicle_inverse_array(const struct logicle_params *p, double* x, npy_intp n);
+void hyperlog_scale_array(const struct logicle_params *p, double* x, npy_intp n);
+void hyperlog_inverse_array(const struct logicle_params *p, double* x, npy_intp n);
+
+void logicle_scale(double t, double w, double m, double a, double* x, npy_intp n);
+void logicle_inverse(double t, double w, double m, double a, double* x, npy_intp n);
+void hyperlog_scale(double t, double w, double m, double a, double* x, npy_intp n);
+void hyperlog_inverse(double t, double w, double m, double a, double* x, npy_intp n);
@@ -0,0 +1,133 @@
+"""
+Preprocessing pipeline fusing compensation & transformation of FCS event data
+"""
+import numpy as np
+
+# noinspection PyUnresolvedReferences
+from . import logicle_c
+from .compensate import Compensator, SpectralUnmixer
+from .transforms import _PrecomputedTransform
+from ._parallel import run_chunked
+
+# number of events processed at a time, small enough for a block of events to stay in the CPU cache
+DEFAULT_BLOCK_SIZE = 8192
+
+
+class Pipeline(object):
+    """
+    Compensates & transforms event data in a single pass. The events are
+    processed in small blocks of rows: each block is compensated directly
+    into the output array, then its channels are transformed while the
+    block is still in the CPU cache. The only array allocated for the full
+    event data is the output (none, if the output array is given), instead
+    of a copy for each step.
+
+    :param compensation: Optional `Compensator` or `SpectralUnmixer` instance, or a
+        spillover matrix (NumPy array without headers) used to create a Compensator
+    :param transforms: Optional list of (channel_indices, transform) pairs. Each
+        transform is either a transform instance (e.g. `LogicleTransform`) or a
+        function taking (data, channel_indices, out) and transforming the given
+        channels of data into out, e.g. functools.partial(transforms.asinh, t=262144, m=4.5, a=0).
+        The transforms are applied in order, after compensation.
+    :param fluoro_indices: Fluorescent channel indices for the spillover matrix, only
+        used if compensation is a spillover matrix. See `compensate.compensate`.
+    :param block_size: Number of events processed at a time
+    """
+    def __init__(self, compensation=None, transforms=None, fluoro_indices=None, block_size=DEFAULT_BLOCK_SIZE):
+        if compensation is not None and not isinstance(compensation, (Compensator, SpectralUnmixer)):
+            compensation = Compensator(compensation, fluoro_indices=fluoro_indices)
+        if block_size < 1:
+            raise ValueError("block_size must be a positive integer")
+
+        self.compensation = compensation
+        self.transforms = [] if transforms is None else list(transforms)
+        self.block_size = block_size
+
+        # consecutive precomputed (C) transforms are applied to all their channels in a
+        # single C call, other transforms are called for each block of events
+        self._steps = []
+        for channel_indices, xform in self.transforms:
+            channel_indices = [int(i) for i in np.atleast_1d(channel_indices)]
+
+            if isinstance(xform, _PrecomputedTransform):
+                if len(self._steps) > 0 and self._steps[-1][0] == 'c':
+                    self._steps[-1][1].extend(channel_indices)
+                    self._steps[-1][2].extend([xform._c_xform] * len(channel_indices))
+                else:
+                    self._steps.append(('c', channel_indices, [xform._c_xform] * len(channel_indices)))
+            elif callable(xform):
+                self._steps.append(('func', channel_indices, xform))
+            else:
+                raise TypeError("transform for channels %r is not a transform instance or function" % channel_indices)
+
+    def __repr__(self):
+        return '%s(compensation=%r, transforms=%d)' % (
+            self.__class__.__name__, self.compensation, len(self.transforms)
+        )
+
+    def _process_block(self, block, out_block):
+        if isinstance(self.compensation, SpectralUnmixer):
+            self.compensation.unmix(block, out=out_block)
+        elif self.compensation is None or self.compensation.fluoro_indices is not None:
+            # the compensated channels are computed before anything is written,
+            # so the block can be processed in place
+            comp_data = None
+            if self.compensation is not None:
+                fluoro_indices = self.compensation.fluoro_indices
+                comp_data = np.dot(block[:, fluoro_indices], self.compensation.comp_matrix)
+
+            if out_block is not block:
+                np.copyto(out_block, block, casting='unsafe')
+            if comp_data is not None:
+                out_block[:, fluoro_indices] = comp_data
+        else:
+            out_block[...] = np.dot(block, self.compensation.comp_matrix)
+
+        for kind, channel_indices, xform in self._steps:
+            if kind == 'c':
+                if out_block.dtype in (np.float64, np.float32) and out_block.flags.aligned:
+                    # noinspection PyUnresolvedReferences
+                    logicle_c.transform_columns(out_block, channel_indices, xform)
+                else:
+                    # the C methods transform a float64 copy of each channel that is then written back
+                    for i, c_xform in zip(channel_indices, xform):
+                        c_xform.scale(out_block[:, i])
+            else:
+                xform(out_block, channel_indices, out=out_block)
+
+    def apply(self, event_data, out=None, n_threads=None, executor=None):
+        """
+        Compensate & transform the given event data
+
+        :param event_data: 2-D NumPy array (or memmap) of FCS event data
+        :param out: Optional NumPy array (or memmap), with the same shape as event_data,
+            to write the processed events into. Passing the event data array itself
+            processes the events in place, avoiding any allocation.
+        :param n_threads: Optional number of threads used to process chunks of events in parallel
+        :param executor: Optional concurrent.futures.Executor used to process chunks of events
+            in parallel (e.g. a shared ThreadPoolExecutor)
+
+        :return: NumPy array of processed events (out, if given)
+        """
+        if event_data.ndim != 2:
+            raise ValueError("event_data must be a 2-D array, not shape %r" % (event_data.shape,))
+
+        if out is None:
+            out_dtype = event_data.dtype if np.issubdtype(event_data.dtype, np.floating) else np.float64
+            out = np.empty(event_data.shape, dtype=out_dtype)
+        elif out.shape != event_data.shape:
+            raise ValueError("out has shape %s, but event_data has shape %s" % (out.shape, event_data.shape))
+        in_place = out is event_data
+
+        def _process_chunk(start, stop):
+            for block_start in range(start, stop, self.block_size):
+                block_stop = min(block_start + self.block_size, stop)
+                out_block = out[block_start:block_stop]
+                block = out_block if in_place else event_data[block_start:block_stop]
+
+                self._process_block(block, out_block)
+
+        # compensation & the C transforms release the GIL, so chunks of events can be processed in parallel threads
+        run_chunked(_process_chunk, len(event_data), n_threads=n_threads, executor=executor)
+
+        return out
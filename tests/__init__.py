@@ -3,6 +3,7 @@ import unittest
 from .transform_tests import TransformsTestCase
 from .compensation_tests import CompensationTestCase, SpectralCompensationTestCase
 from .gating_tests import GatingTestCase
+from .pipeline_tests import PipelineTestCase
 
 if __name__ == "__main__":
     unittest.main()
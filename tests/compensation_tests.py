@@ -5,6 +5,7 @@ import unittest
 import numpy as np
 import os
 import pathlib
+import tempfile
 from flowutils import compensate
 
 fcs_spill = '13,B515-A,R780-A,R710-A,R660-A,V800-A,V655-A,V585-A,V450-A,G780-A,G710-A,G660-A,G610-A,G560-A,'\
@@ -108,6 +109,32 @@ class CompensationTestCase(unittest.TestCase):
 
         self.assertIsInstance(matrix_array, np.ndarray)
 
+    def test_parse_compensation_matrix_cached(self):
+        compensate.clear_matrix_cache()
+
+        matrix_array = compensate.parse_compensation_matrix(test_comp_csv_path, test_comp_matrix_channel_labels)
+        spill = np.genfromtxt(test_comp_csv_path, delimiter=',', skip_header=True)
+        np.testing.assert_array_equal(matrix_array[1:], spill)
+        np.testing.assert_array_equal(matrix_array[0], np.arange(1, 15))
+
+        # the same text is only parsed once, each call gets its own copy of the matrix
+        matrix_array[1:] = 0
+        for _ in range(3):
+            cached_array = compensate.parse_compensation_matrix(test_comp_csv_path, test_comp_matrix_channel_labels)
+            np.testing.assert_array_equal(cached_array[1:], spill)
+        cache_info = compensate._convert_matrix_text_to_array_cached.cache_info()
+        self.assertEqual((cache_info.hits, cache_info.misses), (3, 1))
+
+        comp_matrix, header = compensate.get_spill(fcs_spill)
+        comp_matrix[:] = 0
+        header.append('extra')
+        comp_matrix, header = compensate.get_spill(fcs_spill)
+        self.assertEqual(header, fcs_spill_header)
+        self.assertEqual(comp_matrix[0, 0], 1.0)
+
+        compensate.clear_matrix_cache()
+        self.assertEqual(compensate._convert_matrix_text_to_array_cached.cache_info().currsize, 0)
+
     def test_parse_compensation_matrix_missing_row(self):
         comp_path = pathlib.Path("tests/test_data/test_comp_matrix_missing_row.csv")
 
@@ -193,6 +220,191 @@ class CompensationTestCase(unittest.TestCase):
         np.testing.assert_almost_equal(inv_comp_data, all_fluoro_data, 10)
 
 
+    def test_compensator(self):
+        npy_data = np.load(test_data_npy_path)
+        spill = np.genfromtxt(test_comp_csv_path, delimiter=',', skip_header=True)
+
+        # the previous implementation, solving the spillover matrix for every call
+        truth = npy_data.copy()
+        truth[:, test_data_fluoro_indices] = np.linalg.solve(spill.T, npy_data[:, test_data_fluoro_indices].T).T
+
+        compensator = compensate.Compensator(spill, fluoro_indices=test_data_fluoro_indices)
+        comp_data = compensator.compensate(npy_data)
+        np.testing.assert_almost_equal(comp_data, truth, 9)
+
+        inv_comp_data = compensator.inverse_compensate(comp_data)
+        np.testing.assert_almost_equal(inv_comp_data, npy_data, 10)
+
+        # from the parsed matrix, with the channel numbers in the header row
+        matrix = compensate.parse_compensation_matrix(test_comp_csv_path, test_data_channels)
+        compensator = compensate.Compensator.from_compensation_matrix(matrix)
+        self.assertEqual(compensator.fluoro_indices, test_data_fluoro_indices)
+        np.testing.assert_almost_equal(compensator.compensate(npy_data), truth, 9)
+
+        compensator = compensate.Compensator(spill)
+        all_fluoro_data = npy_data[:, test_data_fluoro_indices]
+        np.testing.assert_almost_equal(compensator.compensate(all_fluoro_data), truth[:, test_data_fluoro_indices], 9)
+
+        self.assertRaises(ValueError, compensate.Compensator, spill[:-1])
+        self.assertRaises(ValueError, compensate.Compensator, spill, test_data_fluoro_indices[:-1])
+
+
+    def test_compensate_chunked(self):
+        npy_data = np.load(test_data_npy_path)
+        spill = np.genfromtxt(test_comp_csv_path, delimiter=',', skip_header=True)
+        truth = compensate.compensate(npy_data, spill, fluoro_indices=test_data_fluoro_indices)
+
+        comp_data = compensate.compensate(npy_data, spill, fluoro_indices=test_data_fluoro_indices, chunk_size=1000)
+        np.testing.assert_array_equal(comp_data, truth)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            events_path = os.path.join(temp_dir, 'events.dat')
+            events = np.memmap(events_path, dtype=npy_data.dtype, mode='w+', shape=npy_data.shape)
+            events[:] = npy_data
+            out = np.memmap(os.path.join(temp_dir, 'comp.dat'), dtype=np.float64, mode='w+', shape=npy_data.shape)
+
+            result = compensate.compensate(
+                events, spill, fluoro_indices=test_data_fluoro_indices, out=out, chunk_size=999
+            )
+            self.assertIs(result, out)
+            np.testing.assert_array_equal(out, truth)
+
+            # in place, then back again
+            compensator = compensate.Compensator(spill, fluoro_indices=test_data_fluoro_indices)
+            compensator.compensate(events, out=events, chunk_size=4096)
+            np.testing.assert_array_equal(events, truth)
+            compensate.inverse_compensate(events, spill, test_data_fluoro_indices, out=events, chunk_size=4096)
+            np.testing.assert_almost_equal(events, npy_data, 10)
+
+            del events, out, result
+
+        blocks = (npy_data[start:start + 3000] for start in range(0, len(npy_data), 3000))
+        comp_blocks = list(compensator.compensate_blocks(blocks))
+        self.assertEqual(len(comp_blocks), 4)
+        np.testing.assert_array_equal(np.concatenate(comp_blocks), truth)
+
+        self.assertRaises(ValueError, compensator.compensate, npy_data, out=np.empty((10, npy_data.shape[1])))
+
+    def test_compensate_spectral_ols_chunked(self):
+        rng = np.random.default_rng(5)
+        spill = np.hstack([np.eye(4), rng.uniform(0, 0.5, (4, 3))])
+        events = rng.uniform(0, 1000, (2500, 8))
+        fluoro_indices = [1, 2, 3, 4, 5, 6, 7]
+
+        truth = compensate.compensate_spectral_ols(events, spill, fluoro_indices=fluoro_indices)
+        result = compensate.compensate_spectral_ols(events, spill, fluoro_indices=fluoro_indices, chunk_size=700)
+        np.testing.assert_almost_equal(result, truth, 9)
+        np.testing.assert_array_equal(result[:, [0, 5, 6, 7]], events[:, [0, 5, 6, 7]])
+
+
+    def test_spectral_unmixer(self):
+        rng = np.random.default_rng(9)
+        spill = np.hstack([np.eye(5), rng.uniform(0, 0.5, (5, 4))]) + rng.uniform(0, 0.05, (5, 9))
+        events = rng.uniform(0, 1000, (3000, 11))
+        fluoro_indices = list(range(1, 10))
+
+        # the previous implementation, a least squares solution for every call
+        truth = events.copy()
+        truth[:, 1:6] = np.linalg.lstsq(spill.T, events[:, fluoro_indices].T, rcond=-1)[0].T
+
+        unmixer = compensate.SpectralUnmixer(spill, fluoro_indices=fluoro_indices)
+        comp_data, residuals = unmixer.unmix(events, chunk_size=700, n_threads=2, return_residuals=True)
+        np.testing.assert_almost_equal(comp_data, truth, 9)
+
+        fit = truth[:, 1:6] @ spill
+        np.testing.assert_almost_equal(residuals, np.linalg.norm(events[:, fluoro_indices] - fit, axis=1), 9)
+
+        unmixer = compensate.SpectralUnmixer(spill, fluoro_indices=fluoro_indices, dtype=np.float32)
+        comp_data = unmixer.unmix(events.astype(np.float32))
+        self.assertEqual(comp_data.dtype, np.float32)
+        np.testing.assert_allclose(comp_data, truth, rtol=1e-4, atol=1e-2)
+
+        # without indices, only the columns of the true fluorochromes are replaced
+        unmixer = compensate.SpectralUnmixer(spill)
+        fluoro_data = events[:, fluoro_indices].copy()
+        unmixer.unmix(fluoro_data, out=fluoro_data)
+        np.testing.assert_almost_equal(fluoro_data, truth[:, fluoro_indices], 9)
+
+        # the residuals are computed without modifying the event data, even unmixing in place
+        fluoro_data = events[:, fluoro_indices].copy()
+        comp_data, residuals = unmixer.unmix(fluoro_data, return_residuals=True)
+        np.testing.assert_array_equal(fluoro_data, events[:, fluoro_indices])
+        np.testing.assert_almost_equal(residuals, np.linalg.norm(fluoro_data - fit, axis=1), 9)
+
+        comp_data, residuals = unmixer.unmix(fluoro_data, out=fluoro_data, return_residuals=True)
+        np.testing.assert_almost_equal(residuals, np.linalg.norm(events[:, fluoro_indices] - fit, axis=1), 9)
+
+        # a stream of event blocks, e.g. read from a file one block at a time
+        unmixer = compensate.SpectralUnmixer(spill, fluoro_indices=fluoro_indices)
+        blocks = (events[start:start + 700] for start in range(0, len(events), 700))
+        unmixed_blocks = list(unmixer.unmix_blocks(blocks, return_residuals=True))
+        self.assertEqual(len(unmixed_blocks), 5)
+        np.testing.assert_almost_equal(np.concatenate([b for b, _ in unmixed_blocks]), truth, 9)
+        np.testing.assert_almost_equal(
+            np.concatenate([r for _, r in unmixed_blocks]), np.linalg.norm(events[:, fluoro_indices] - fit, axis=1), 9
+        )
+
+        self.assertRaises(ValueError, compensate.SpectralUnmixer, spill.T)
+        self.assertRaises(ValueError, compensate.SpectralUnmixer, spill, fluoro_indices[:-1])
+
+
+    def test_compensate_spectral_wls(self):
+        rng = np.random.default_rng(13)
+        spill = np.hstack([np.eye(4), rng.uniform(0, 0.5, (4, 3))]) + rng.uniform(0, 0.05, (4, 7))
+        events = rng.uniform(0, 1000, (1500, 8))
+        fluoro_indices = list(range(1, 8))
+        detector_weights = rng.uniform(0.2, 2.0, 7)
+        event_weights = rng.uniform(0.2, 2.0, (1500, 7))
+
+        def _solve_wls(detectors, weights):
+            weighted_spill = spill * weights
+            return np.linalg.solve(weighted_spill @ spill.T, weighted_spill @ detectors)
+
+        comp_data = compensate.compensate_spectral_wls(events, spill, detector_weights, fluoro_indices)
+        truth = np.array([_solve_wls(event[fluoro_indices], detector_weights) for event in events])
+        np.testing.assert_almost_equal(comp_data[:, 1:5], truth, 9)
+        np.testing.assert_array_equal(comp_data[:, [0, 5, 6, 7]], events[:, [0, 5, 6, 7]])
+
+        comp_data = compensate.compensate_spectral_wls(
+            events, spill, event_weights, fluoro_indices, chunk_size=400, n_threads=2
+        )
+        truth = np.array([_solve_wls(event[fluoro_indices], w) for event, w in zip(events, event_weights)])
+        np.testing.assert_almost_equal(comp_data[:, 1:5], truth, 9)
+
+        # equal weights are the same as OLS
+        comp_data = compensate.compensate_spectral_wls(events, spill, np.ones(7), fluoro_indices)
+        ols_data = compensate.compensate_spectral_ols(events, spill, fluoro_indices)
+        np.testing.assert_almost_equal(comp_data, ols_data, 9)
+
+        self.assertRaises(ValueError, compensate.compensate_spectral_wls, events, spill, np.ones(6), fluoro_indices)
+        self.assertRaises(ValueError, compensate.compensate_spectral_wls, events, spill, -np.ones(7), fluoro_indices)
+
+    def test_compensate_spectral_nnls(self):
+        rng = np.random.default_rng(17)
+        spill = np.hstack([np.eye(4), rng.uniform(0, 0.6, (4, 5))]) + rng.uniform(0, 0.1, (4, 9))
+        events = rng.uniform(0, 1000, (1000, 4)) @ spill + rng.normal(0, 80, (1000, 9))
+        events[:, :3] -= 300
+
+        comp_data = compensate.compensate_spectral_nnls(events, spill, chunk_size=300)[:, :4]
+        self.assertTrue((comp_data >= 0).all())
+        self.assertTrue((compensate.compensate_spectral_ols(events, spill)[:, :4] < 0).any())
+
+        # optimality conditions: the gradient is 0 for the positive values & non-negative for the 0 values
+        gram = spill @ spill.T
+        rhs = events @ spill.T
+        gradient = (comp_data @ gram - rhs) / np.abs(rhs).max()
+        np.testing.assert_almost_equal(gradient[comp_data > 0], 0, 9)
+        self.assertTrue((gradient[comp_data == 0] > -1e-9).all())
+
+        # events with a non-negative OLS solution are unchanged
+        positive = rng.uniform(100, 1000, (50, 4)) @ spill
+        np.testing.assert_almost_equal(
+            compensate.compensate_spectral_nnls(positive, spill),
+            compensate.compensate_spectral_ols(positive, spill),
+            9
+        )
+
+
 class SpectralCompensationTestCase(unittest.TestCase):
     """
     Tests for spectral compensation functions
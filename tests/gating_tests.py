@@ -1,10 +1,12 @@
 """
 Tests for 'gating' module
 """
+import os
+import tempfile
 import unittest
 import numpy as np
 
-from flowutils import gating
+from flowutils import gating, gating_c
 
 
 class GatingTestCase(unittest.TestCase):
@@ -29,6 +31,43 @@ class GatingTestCase(unittest.TestCase):
 
         np.testing.assert_array_equal(truth, result)
 
+    @staticmethod
+    def test_ellipsoid_gate():
+        rng = np.random.default_rng(7)
+        cov_mat = np.array(
+            [
+                [4.0, 1.2, -0.5],
+                [1.2, 3.0, 0.3],
+                [-0.5, 0.3, 2.0]
+            ]
+        )
+        means = np.array([1.0, -2.0, 0.5])
+        distance_square = 2.5
+        points = rng.normal(size=(5001, 3)) * 2.0 + means
+
+        # the previous NumPy implementation
+        inv_cov_mat = np.linalg.inv(cov_mat)
+        points_translated = points - means
+        expected = ((points_translated @ inv_cov_mat) * points_translated).sum(axis=1) <= distance_square
+
+        gate = gating.EllipsoidGate(cov_mat, means, distance_square)
+        np.testing.assert_array_equal(expected, gate.contains(points))
+        np.testing.assert_array_equal(expected, gate.contains(points, n_threads=3))
+        np.testing.assert_array_equal(np.packbits(expected), gate.contains(points, output='packed'))
+
+        # float32 points are tested natively, same as converting them to float64
+        points_float = points.astype(np.float32)
+        points_translated = points_float.astype(np.float64) - means
+        expected_float = ((points_translated @ inv_cov_mat) * points_translated).sum(axis=1) <= distance_square
+        np.testing.assert_array_equal(expected_float, gate.contains(points_float))
+
+        # NaN values are never inside the ellipsoid
+        points[10, 1] = np.nan
+        assert not gate.contains(points)[10]
+
+        np.testing.assert_raises(ValueError, gate.contains, points[:, :2])
+        np.testing.assert_raises(ValueError, gating.EllipsoidGate, cov_mat[:2], means, distance_square)
+
     @staticmethod
     def test_points_in_polygon():
         poly_vertices = np.array(
@@ -48,3 +87,388 @@ class GatingTestCase(unittest.TestCase):
         result = gating.points_in_polygon(poly_vertices, event_data)
 
         np.testing.assert_array_equal(truth, result)
+
+    @staticmethod
+    def test_points_in_polygon_float32():
+        poly_vertices = np.array(
+            [
+                [5., 5.],
+                [500., 5.],
+                [500., 500.]
+            ]
+        )
+
+        npy_file_path = "tests/test_data/event_data_for_poly_test.npy"
+        event_data = np.load(npy_file_path).astype(np.float32)
+
+        truth = gating.points_in_polygon(poly_vertices, event_data.astype(np.float64))
+        result = gating.points_in_polygon(poly_vertices, event_data)
+
+        np.testing.assert_array_equal(truth, result)
+
+    @staticmethod
+    def test_points_in_polygon_many_vertices():
+        # large polygons are indexed, the results must match testing every edge of the polygon
+        rng = np.random.default_rng(0)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, 2000))
+        radii = rng.uniform(100., 500., 2000)
+        poly_vertices = np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])
+
+        # random points, plus points level with the vertices where edges start & end
+        points = np.concatenate(
+            [
+                rng.uniform(-550., 550., (5000, 2)),
+                np.column_stack([rng.uniform(-550., 550., 2000), poly_vertices[:, 1]]),
+                poly_vertices
+            ]
+        )
+
+        truth = [
+            gating_c.calc_wind_count(x, y, len(poly_vertices), poly_vertices) % 2 != 0 for x, y in points
+        ]
+        result = gating.points_in_polygon(poly_vertices, points)
+
+        np.testing.assert_array_equal(truth, result)
+
+    @staticmethod
+    def test_points_in_polygon_threaded():
+        rng = np.random.default_rng(42)
+        points = rng.uniform(0, 600, size=(100000, 2))
+        poly_vertices = np.array([[5., 5.], [500., 5.], [500., 500.], [250., 100.]])
+
+        truth = gating.points_in_polygon(poly_vertices, points)
+        result = gating.points_in_polygon(poly_vertices, points, n_threads=4)
+
+        np.testing.assert_array_equal(truth, result)
+
+    @staticmethod
+    def test_points_in_polygons():
+        rng = np.random.default_rng(42)
+        points = rng.uniform(0, 600, size=(100000, 2))
+        angles = np.linspace(0, 2 * np.pi, 100, endpoint=False)
+        poly_vertices_list = [
+            np.array([[5., 5.], [500., 5.], [500., 500.], [250., 100.]]),
+            np.array([[300., 300.], [400., 300.], [400., 400.]]),
+            np.column_stack([300 + 200 * np.cos(angles), 300 + 100 * np.sin(3 * angles)]),
+            [[0., 0.], [10., 0.], [10., 10.]]
+        ]
+
+        truth = np.column_stack([gating.points_in_polygon(v, points) for v in poly_vertices_list])
+
+        result = gating.points_in_polygons(poly_vertices_list, points)
+        np.testing.assert_array_equal(truth, result)
+
+        result = gating.points_in_polygons(poly_vertices_list, points.astype(np.float32), n_threads=4)
+        truth = np.column_stack([gating.points_in_polygon(v, points.astype(np.float32)) for v in poly_vertices_list])
+        np.testing.assert_array_equal(truth, result)
+
+    @staticmethod
+    def test_points_in_rectangle():
+        rng = np.random.default_rng(3)
+        points = rng.uniform(-10, 10, size=(4099, 3)).round()
+        points[5] = [np.nan, 0, 0]
+        points[6] = [0, np.nan, 0]
+        bounds = [(-4, 6), (None, 2), (-1, None)]
+
+        with np.errstate(invalid='ignore'):
+            expected = (
+                (points[:, 0] >= -4) & (points[:, 0] < 6) & (points[:, 1] < 2) & (points[:, 2] >= -1)
+            )
+        # minimum inclusive, maximum exclusive (GatingML)
+        assert expected.any() and (points[expected, 0] == -4).any()
+        assert not expected[points[:, 0] == 6].any()
+
+        result = gating.points_in_rectangle(bounds, points)
+        np.testing.assert_array_equal(expected, result)
+        # NaN values are outside any bounded dimension
+        assert not result[5] and not result[6]
+
+        result = gating.points_in_rectangle(bounds, points.astype(np.float32), n_threads=2)
+        np.testing.assert_array_equal(expected, result)
+
+        result = gating.points_in_rectangle(bounds, points, output='packed')
+        np.testing.assert_array_equal(np.packbits(expected), result)
+
+        # a dimension open at both ends doesn't constrain the points
+        result = gating.points_in_rectangle([(None, None)], points[:, :1])
+        assert result.all()
+
+        np.testing.assert_raises(ValueError, gating.points_in_rectangle, bounds[:2], points)
+        np.testing.assert_raises(ValueError, gating.points_in_rectangle, [1, 2, 3], points)
+
+    @staticmethod
+    def test_points_in_polygon_packed():
+        rng = np.random.default_rng(42)
+        points = rng.uniform(0, 600, size=(100003, 2))
+        poly_vertices_list = [
+            np.array([[5., 5.], [500., 5.], [500., 500.], [250., 100.]]),
+            np.array([[300., 300.], [400., 300.], [400., 400.]])
+        ]
+
+        mask = gating.points_in_polygon(poly_vertices_list[0], points)
+        packed = gating.points_in_polygon(poly_vertices_list[0], points, output='packed', n_threads=4)
+        np.testing.assert_array_equal(packed, np.packbits(mask))
+        np.testing.assert_array_equal(gating.unpack_mask(packed, len(points)), mask)
+
+        masks = gating.points_in_polygons(poly_vertices_list, points)
+        packed = gating.points_in_polygons(poly_vertices_list, points, output='packed', n_threads=4)
+        np.testing.assert_array_equal(packed, np.packbits(masks.T, axis=1))
+        np.testing.assert_array_equal(gating.packed_mask_count(packed), masks.sum(axis=0))
+
+        both = gating.packed_mask_and(packed[0], packed[1])
+        either = gating.packed_mask_or(packed[0], packed[1])
+        outside = gating.packed_mask_not(packed[0], len(points))
+        np.testing.assert_array_equal(gating.unpack_mask(both, len(points)), masks[:, 0] & masks[:, 1])
+        np.testing.assert_array_equal(gating.unpack_mask(either, len(points)), masks[:, 0] | masks[:, 1])
+        np.testing.assert_equal(gating.packed_mask_count(outside), np.count_nonzero(~masks[:, 0]))
+
+    @staticmethod
+    def test_points_in_gate_indices():
+        rng = np.random.default_rng(7)
+        points = rng.uniform(0, 600, size=(100003, 3))
+        poly_vertices_list = [
+            np.array([[5., 5.], [500., 5.], [500., 500.], [250., 100.]]),
+            np.array([[300., 300.], [400., 300.], [400., 400.]])
+        ]
+        cov_mat = np.array([[10000., 2000.], [2000., 8000.]])
+        means = np.array([300., 250.])
+        bounds = [(100., 400.), (None, 350.), (200., None)]
+
+        vertices = poly_vertices_list[0]
+        xy = points[:, :2]
+
+        # indices of the events in a parent population, e.g. a previous gate
+        parent = np.flatnonzero(points[:, 2] > 300.)
+
+        mask = gating.points_in_polygon(vertices, xy)
+        for n_threads in [None, 4]:
+            indices = gating.points_in_polygon(vertices, xy, output='indices', n_threads=n_threads)
+            assert indices.dtype == np.intp
+            np.testing.assert_array_equal(indices, np.flatnonzero(mask))
+
+            indices = gating.points_in_polygon(vertices, xy, output='indices32', indices=parent, n_threads=n_threads)
+            assert indices.dtype == np.uint32
+            np.testing.assert_array_equal(indices, parent[mask[parent]])
+
+        # the parent's indices select the points tested for the mask & packed outputs
+        np.testing.assert_array_equal(gating.points_in_polygon(vertices, xy, indices=parent), mask[parent])
+        np.testing.assert_array_equal(
+            gating.points_in_polygon(vertices, xy, output='packed', indices=parent),
+            np.packbits(mask[parent])
+        )
+
+        masks = gating.points_in_polygons(poly_vertices_list, xy)
+        indices = gating.points_in_polygons(poly_vertices_list, xy, output='indices', indices=parent)
+        for i in range(len(poly_vertices_list)):
+            np.testing.assert_array_equal(indices[i], parent[masks[parent, i]])
+
+        mask = gating.points_in_ellipsoid(cov_mat, means, 4.0, xy)
+        indices = gating.points_in_ellipsoid(cov_mat, means, 4.0, xy, output='indices', indices=parent)
+        np.testing.assert_array_equal(indices, parent[mask[parent]])
+
+        # float32, Fortran ordered points are read in place
+        points_f32 = np.asfortranarray(points, dtype=np.float32)
+        mask = gating.points_in_rectangle(bounds, points_f32)
+        indices = gating.points_in_rectangle(bounds, points_f32, output='indices', indices=parent, n_threads=4)
+        np.testing.assert_array_equal(indices, parent[mask[parent]])
+
+        np.testing.assert_array_equal(gating.points_in_polygon(vertices, xy, output='indices', indices=[]), [])
+        np.testing.assert_raises(IndexError, gating.points_in_polygon, vertices, xy, indices=[len(points)])
+        np.testing.assert_raises(ValueError, gating.points_in_polygon, vertices, xy, output='bits')
+
+    @unittest.skipUnless(
+        os.environ.get('FLOWUTILS_TEST_LARGE_ARRAYS'),
+        "set FLOWUTILS_TEST_LARGE_ARRAYS=1 to run tests on arrays with more than 2^31 elements"
+    )
+    def test_points_in_polygon_large_memmap(self):
+        # A sparse memory-mapped file of 2^30 + 2 float32 points (more than 2^31 values).
+        # Only the last point is non-zero, and is the only point inside the polygon.
+        poly_vertices = np.array([[5., 5.], [500., 5.], [500., 500.]])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            points = np.memmap(
+                os.path.join(tmp_dir, 'points.dat'), dtype=np.float32, mode='w+', shape=(2 ** 30 + 2, 2)
+            )
+            points[-1] = [400., 100.]
+
+            result = gating.points_in_polygon(poly_vertices, points)
+
+            self.assertEqual(len(result), 2 ** 30 + 2)
+            self.assertTrue(result[-1])
+            self.assertEqual(np.count_nonzero(result), 1)
+            del result
+
+            packed = gating.points_in_polygon(poly_vertices, points, output='packed')
+
+            self.assertEqual(len(packed), (2 ** 30 + 2 + 7) // 8)
+            self.assertEqual(gating.packed_mask_count(packed), 1)
+
+            del points, packed
+
+    @staticmethod
+    def test_evaluate_gates():
+        rng = np.random.default_rng(11)
+        events = rng.normal(size=(20000, 4)) * 100.0
+        events[3, 1] = np.nan
+
+        vertices = np.array([[-150., -150.], [150., -100.], [0., 200.]])
+        cov_mat = np.array([[2500., 500.], [500., 1600.]])
+        means = np.array([10., -20.])
+
+        quadrants = [
+            gating.Quadrant([1.0, 1.0], gate_id='Q++'),
+            gating.Quadrant([-1.0, 1.0], gate_id='Q-+'),
+            gating.Quadrant([1.0, -100.0], gate_id='Q+-'),
+            gating.Quadrant([-1.0, -100.0], gate_id='Q--', children=[
+                gating.BooleanGate('not', ['Ellipse'], gate_id='NotEllipse')
+            ]),
+        ]
+        gates = [
+            gating.RectangleGate([(-250, 250), (None, 250)], gate_id='Range', dimensions=[0, 1], children=[
+                gating.PolygonGate(vertices, gate_id='Polygon', dimensions=[2, 3], children=[
+                    gating.EllipsoidGate(cov_mat, means, 4.0, gate_id='Ellipse', dimensions=[0, 3])
+                ]),
+                gating.QuadrantGate([0.0, [-50.0, 0.0]], quadrants, gate_id='Quad', dimensions=[2, 1]),
+                gating.BooleanGate('and', ['Polygon', 'Q++'], gate_id='PolyAndQ'),
+            ]),
+            gating.BooleanGate('or', ['Q+-', 'Ellipse'], gate_id='Either'),
+        ]
+
+        masks, counts = gating.evaluate_gates(gates, events, n_threads=2)
+
+        # the same gates evaluated on all events with the gating functions
+        with np.errstate(invalid='ignore'):
+            in_range = (
+                (events[:, 0] >= -250) & (events[:, 0] < 250) & (events[:, 1] < 250)
+            )
+            in_polygon = in_range & gating.points_in_polygon(vertices, events[:, [2, 3]])
+            in_ellipse = in_polygon & gating.points_in_ellipsoid(cov_mat, means, 4.0, events[:, [0, 3]])
+            x = events[:, 2]
+            y = events[:, 1]
+            q_pp = in_range & (x >= 0) & (y >= 0)
+            q_mp = in_range & (x < 0) & (y >= 0)
+            # the middle region between the y dividers is not in any of the quadrants
+            q_pm = in_range & (x >= 0) & (y < -50)
+            q_mm = in_range & (x < 0) & (y < -50)
+
+        expected = {
+            'Range': in_range,
+            'Polygon': in_polygon,
+            'Ellipse': in_ellipse,
+            'Q++': q_pp,
+            'Q-+': q_mp,
+            'Q+-': q_pm,
+            'Q--': q_mm,
+            'NotEllipse': q_mm & ~in_ellipse,
+            'PolyAndQ': in_polygon & q_pp,
+            'Either': q_pm | in_ellipse,
+        }
+
+        assert sorted(masks) == sorted(expected)
+        for gate_id, mask in expected.items():
+            np.testing.assert_array_equal(mask, masks[gate_id], err_msg=gate_id)
+            assert counts[gate_id] == mask.sum()
+
+        assert not masks['Range'][3]
+
+        indices, index_counts = gating.evaluate_gates(gates, events, output='indices')
+        assert index_counts == counts
+        for gate_id, mask in expected.items():
+            np.testing.assert_array_equal(indices[gate_id], np.flatnonzero(mask), err_msg=gate_id)
+
+    @staticmethod
+    def test_evaluate_gates_errors():
+        events = np.zeros((10, 2))
+
+        gates = [gating.BooleanGate('not', ['Missing'], gate_id='Not')]
+        np.testing.assert_raises(ValueError, gating.evaluate_gates, gates, events)
+
+        gates = [gating.RectangleGate([(0, 1), (0, 1)])]
+        np.testing.assert_raises(ValueError, gating.evaluate_gates, gates, events)
+
+        gates = [
+            gating.RectangleGate([(0, 1), (0, 1)], gate_id='A'),
+            gating.RectangleGate([(0, 1)], gate_id='A', dimensions=[1])
+        ]
+        np.testing.assert_raises(ValueError, gating.evaluate_gates, gates, events)
+
+        gates = [gating.RectangleGate([(0, 1), (0, 1)], gate_id='A')]
+        np.testing.assert_raises(ValueError, gating.evaluate_gates, gates, events, output='packed')
+
+        np.testing.assert_raises(ValueError, gating.BooleanGate, 'xor', ['A', 'B'])
+        np.testing.assert_raises(ValueError, gating.BooleanGate, 'not', ['A', 'B'])
+
+    @staticmethod
+    def test_count_in_gate():
+        rng = np.random.default_rng(5)
+        points = rng.normal(size=(150001, 2)) * 100.0
+        points[7] = np.nan
+
+        vertices = np.array([[-150., -150.], [150., -100.], [0., 200.]])
+        cov_mat = np.array([[2500., 500.], [500., 1600.]])
+        means = np.array([10., -20.])
+
+        in_polygon = gating.points_in_polygon(vertices, points)
+        in_ellipse = gating.points_in_ellipsoid(cov_mat, means, 4.0, points)
+
+        assert gating.count_in_polygon(vertices, points) == np.count_nonzero(in_polygon)
+        assert gating.count_in_polygon(vertices, points.astype(np.float32), n_threads=3) == np.count_nonzero(
+            gating.points_in_polygon(vertices, points.astype(np.float32))
+        )
+        assert gating.count_in_ellipsoid(cov_mat, means, 4.0, points, n_threads=2) == np.count_nonzero(in_ellipse)
+
+        rectangle = gating.RectangleGate([(-50, 100), (None, 25)])
+        assert rectangle.count(points) == np.count_nonzero(rectangle.contains(points))
+        assert gating.count_in_polygon(vertices, points[:0]) == 0
+
+        np.testing.assert_raises(ValueError, gating.count_in_ellipsoid, cov_mat, means, 4.0, points[:, :1])
+        np.testing.assert_raises(TypeError, gating.QuadrantGate([0.0], []).count, points[:, :1])
+        np.testing.assert_raises(TypeError, gating.Quadrant([1.0, 1.0]).contains, points[:, :2])
+        np.testing.assert_raises(TypeError, gating.Quadrant([1.0, 1.0]).count, points[:, :2])
+
+    @staticmethod
+    def test_stats_in_gate():
+        rng = np.random.default_rng(9)
+        events = rng.normal(size=(100003, 5)) * 100.0
+        events[11, 2] = np.nan
+
+        vertices = np.array([[-150., -150.], [150., -100.], [0., 200.]])
+        gate = gating.PolygonGate(vertices, dimensions=[3, 1])
+        inside = events[gating.points_in_polygon(vertices, events[:, [3, 1]])]
+
+        columns = [0, 2, 4]
+        ranges = [(-500, 500), (-300, 300), (-400, 200)]
+        stats = gating.stats_in_gate(gate, events, columns=columns, bins=64, ranges=ranges, n_threads=3)
+
+        assert stats.count == len(inside)
+        np.testing.assert_allclose(stats.sums, inside[:, columns].sum(axis=0))
+        np.testing.assert_allclose(stats.mean[[0, 2]], inside[:, [0, 4]].mean(axis=0))
+        np.testing.assert_allclose(stats.std[[0, 2]], inside[:, [0, 4]].std(axis=0))
+        for k, column in enumerate(columns):
+            histogram, edges = np.histogram(inside[:, column], bins=64, range=ranges[k])
+            np.testing.assert_array_equal(stats.histograms[k], histogram)
+            np.testing.assert_allclose(stats.bin_edges[k], edges)
+
+        # medians are estimated within a bin width
+        bin_widths = np.diff(ranges, axis=1)[:, 0] / 64
+        assert np.all(np.abs(stats.median[[0, 2]] - np.median(inside[:, [0, 4]], axis=0)) <= bin_widths[[0, 2]])
+
+        # strided float32 events give the same statistics as a copy converted to float64
+        events_f32 = np.asfortranarray(events.astype(np.float32))
+        stats_f32 = gating.stats_in_gate(gate, events_f32, columns=columns, bins=64, ranges=ranges)
+        inside_f32 = events_f32[gating.points_in_polygon(vertices, events_f32[:, [3, 1]])].astype(np.float64)
+        assert stats_f32.count == len(inside_f32)
+        np.testing.assert_allclose(stats_f32.sums, inside_f32[:, columns].sum(axis=0))
+
+        # statistics of several samples accumulate in the same instance
+        rectangle = gating.RectangleGate([(0, None)], dimensions=[0])
+        batch = gating.stats_in_gate(rectangle, events[:50000], columns=[1])
+        gating.stats_in_gate(rectangle, events[50000:], stats=batch)
+        positive = events[events[:, 0] >= 0]
+        assert batch.count == len(positive)
+        np.testing.assert_allclose(batch.mean, positive[:, [1]].mean(axis=0))
+
+        np.testing.assert_raises(ValueError, gating.stats_in_gate, gate, events, columns=[0], bins=8)
+        np.testing.assert_raises(ValueError, batch.quantile, 0.5)
+        np.testing.assert_raises(ValueError, stats.merge, batch)
+        np.testing.assert_raises(IndexError, gating.stats_in_gate, gate, events, columns=[5])
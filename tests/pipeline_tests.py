@@ -0,0 +1,74 @@
+"""
+Tests for 'pipeline' module
+"""
+import functools
+import unittest
+import numpy as np
+
+from flowutils import compensate, transforms, pipeline
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(21)
+        self.spill = np.eye(5) + rng.uniform(0, 0.1, (5, 5))
+        self.fluoro_indices = [2, 3, 4, 5, 6]
+        self.events = rng.uniform(-100, 100000, (20001, 8))
+
+    def test_pipeline(self):
+        logicle_xform = transforms.LogicleTransform(t=262144, m=4.5, w=0.5, a=0)
+        asinh_xform = functools.partial(transforms.asinh, t=262144, m=4.5, a=0)
+
+        # the same steps, one after the other
+        truth = compensate.compensate(self.events, self.spill, fluoro_indices=self.fluoro_indices)
+        truth = logicle_xform.apply(truth, [2, 3, 4])
+        truth = asinh_xform(truth, [5, 6])
+        truth = transforms.hyperlog(truth, [6], t=262144, m=4.5, w=0.5, a=0)
+
+        xform_pipeline = pipeline.Pipeline(
+            self.spill,
+            transforms=[
+                ([2, 3, 4], logicle_xform),
+                ([5, 6], asinh_xform),
+                (6, transforms.HyperlogTransform(t=262144, m=4.5, w=0.5, a=0))
+            ],
+            fluoro_indices=self.fluoro_indices,
+            block_size=1000
+        )
+
+        result = xform_pipeline.apply(self.events)
+        np.testing.assert_allclose(result, truth, rtol=1e-12, atol=1e-12)
+
+        result = xform_pipeline.apply(self.events, n_threads=2)
+        np.testing.assert_allclose(result, truth, rtol=1e-12, atol=1e-12)
+
+        events = self.events.copy()
+        result = xform_pipeline.apply(events, out=events)
+        self.assertIs(result, events)
+        np.testing.assert_allclose(events, truth, rtol=1e-12, atol=1e-12)
+
+    def test_pipeline_float32(self):
+        logicle_xform = transforms.LogicleTransform(t=262144, m=4.5, w=0.5, a=0)
+        compensator = compensate.Compensator(self.spill, fluoro_indices=self.fluoro_indices)
+        events = self.events.astype(np.float32)
+
+        truth = logicle_xform.apply(compensator.compensate(events), self.fluoro_indices)
+
+        result = pipeline.Pipeline(compensator, [(self.fluoro_indices, logicle_xform)]).apply(events)
+        self.assertEqual(result.dtype, np.float32)
+        np.testing.assert_allclose(result, truth, rtol=1e-6, atol=1e-6)
+
+    def test_pipeline_spectral(self):
+        rng = np.random.default_rng(22)
+        spill = np.hstack([np.eye(3), rng.uniform(0, 0.5, (3, 2))])
+        unmixer = compensate.SpectralUnmixer(spill, fluoro_indices=[1, 2, 3, 4, 5])
+        logicle_xform = transforms.LogicleTransform()
+
+        truth = logicle_xform.apply(unmixer.unmix(self.events), [1, 2, 3])
+        result = pipeline.Pipeline(unmixer, [([1, 2, 3], logicle_xform)], block_size=3000).apply(self.events)
+        np.testing.assert_allclose(result, truth, rtol=1e-12, atol=1e-12)
+
+    def test_pipeline_errors(self):
+        self.assertRaises(TypeError, pipeline.Pipeline, None, [([0], 'logicle')])
+        self.assertRaises(ValueError, pipeline.Pipeline, None, None, block_size=0)
+        self.assertRaises(ValueError, pipeline.Pipeline().apply, self.events[:, 0])
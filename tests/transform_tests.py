@@ -1,10 +1,14 @@
 """
 Tests for 'transform' module
 """
+import os
+import sys
+import tempfile
 import unittest
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
-from flowutils import transforms
+from flowutils import transforms, logicle_c
 
 
 class TransformsTestCase(unittest.TestCase):
@@ -186,3 +190,307 @@ class TransformsTestCase(unittest.TestCase):
         )
 
         np.testing.assert_array_almost_equal(self.test_data_range, x[:, 0], decimal=10)
+
+    def test_logicle_transform_object(self):
+        data = np.vstack([self.test_data_range - 500.0, self.test_data_range]).T
+        xform = transforms.LogicleTransform(t=10000, m=4.5, w=0.5, a=0)
+
+        xform_data = xform.apply(data, [0, 1])
+        truth = transforms.logicle(data, [0, 1], t=10000, m=4.5, w=0.5, a=0)
+        np.testing.assert_array_equal(xform_data, truth)
+
+        x = xform.inverse(xform_data, [0, 1])
+        np.testing.assert_array_almost_equal(data, x, decimal=10)
+
+    def test_logicle_lut(self):
+        data = np.concatenate([np.linspace(-1000.0, 12000.0, 100001), np.geomspace(1e-3, 10000, 10000)])
+        data = np.vstack([data, data[::-1]]).T
+        lut_bins = 1024
+
+        truth = transforms.logicle(data, [0, 1], t=10000, m=4.5, w=0.5, a=0)
+        xform_data = transforms.logicle(data, [0, 1], t=10000, m=4.5, w=0.5, a=0, method='lut', lut_bins=lut_bins)
+
+        max_error = 4.5 * np.log(10) / (8 * lut_bins ** 2)
+        self.assertLessEqual(np.max(np.abs(xform_data - truth)), max_error)
+
+        # the inverse is exact, so the round trip is within the error of the table
+        xform = transforms.LogicleTransform(t=10000, m=4.5, w=0.5, a=0, method='lut', lut_bins=lut_bins)
+        x = xform.inverse(xform_data, [0, 1])
+        np.testing.assert_array_almost_equal(x, transforms.logicle_inverse(xform_data, [0, 1], t=10000, m=4.5, w=0.5, a=0))
+
+        # float32 data uses the same table
+        xform_data_32 = xform.apply(data.astype(np.float32), [0, 1])
+        self.assertLessEqual(np.max(np.abs(xform_data_32 - truth)), max_error + 6e-8)
+
+        self.assertRaises(ValueError, transforms.LogicleTransform, method='fast')
+        self.assertRaises(ValueError, transforms.LogicleTransform, method='lut', lut_bins=0)
+
+    def test_scale_partial_blocks_and_strides(self):
+        # events are solved in fixed size blocks, use a count that isn't a multiple of the
+        # block size & values across the linear, log & extended (beyond t) regions
+        rng = np.random.default_rng(1)
+        data = np.concatenate([rng.normal(0, 100, 500), rng.lognormal(7, 3, 499), [0.0, 1e7, -1e7]])
+
+        for xform in [transforms.LogicleTransform(t=10000), transforms.HyperlogTransform(t=10000)]:
+            xform_data = xform.apply(data)
+
+            strided_data = np.repeat(data, 2)
+            xform.apply(strided_data[::2], out=strided_data[::2])
+            np.testing.assert_array_equal(strided_data[::2], xform_data)
+            np.testing.assert_array_equal(strided_data[1::2], data)
+
+            np.testing.assert_allclose(xform.inverse(xform_data), data, rtol=1e-9, atol=1e-9)
+
+    def test_hyperlog_transform_object(self):
+        data = np.vstack([self.test_data_range - 500.0, self.test_data_range]).T
+        xform = transforms.HyperlogTransform(t=10000, m=4.5, w=0.5, a=0)
+
+        # only transform the 2nd channel, 1st channel should be untouched
+        xform_data = xform.apply(data, [1])
+        truth = transforms.hyperlog(data, [1], t=10000, m=4.5, w=0.5, a=0)
+        np.testing.assert_array_equal(xform_data, truth)
+        np.testing.assert_array_equal(xform_data[:, 0], data[:, 0])
+
+        x = xform.inverse(xform_data, [1])
+        np.testing.assert_array_almost_equal(data, x, decimal=10)
+
+    def test_transform_columns_per_channel_params(self):
+        data = np.vstack([self.test_data_range - 500.0, self.test_data_range, self.test_data_range]).T
+        logicle_xform = logicle_c.Logicle(10000, 0.5, 4.5, 0)
+        hyperlog_xform = logicle_c.Hyperlog(1000, 1.0, 4.0, 0)
+
+        for order in ['C', 'F']:
+            xform_data = np.array(data, order=order)
+            logicle_c.transform_columns(xform_data, [0, 2], [logicle_xform, hyperlog_xform])
+
+            np.testing.assert_array_equal(
+                xform_data[:, 0],
+                transforms.logicle(data[:, 0], None, t=10000, m=4.5, w=0.5, a=0)
+            )
+            np.testing.assert_array_equal(xform_data[:, 1], data[:, 1])
+            np.testing.assert_array_equal(
+                xform_data[:, 2],
+                transforms.hyperlog(data[:, 2], None, t=1000, m=4.0, w=1.0, a=0)
+            )
+
+            logicle_c.transform_columns(xform_data, [0, 2], [logicle_xform, hyperlog_xform], inverse=True)
+            np.testing.assert_array_almost_equal(xform_data, data, decimal=10)
+
+    def test_transform_columns_invalid_args(self):
+        data = np.zeros((10, 3))
+        xform = logicle_c.Logicle(10000, 0.5, 4.5, 0)
+
+        self.assertRaises(IndexError, logicle_c.transform_columns, data, [3], xform)
+        self.assertRaises(ValueError, logicle_c.transform_columns, data, [0, 1], [xform])
+        self.assertRaises(TypeError, logicle_c.transform_columns, data.astype(np.int64), [0], xform)
+
+    def test_logicle_in_place(self):
+        data = np.vstack([self.test_data_range - 500.0, self.test_data_range]).T
+        truth = transforms.logicle(data, [1], t=10000, m=4.5, w=0.5, a=0)
+
+        data_in_place = data.copy()
+        result = transforms.logicle(data_in_place, [1], t=10000, m=4.5, w=0.5, a=0, out=data_in_place)
+
+        self.assertIs(result, data_in_place)
+        np.testing.assert_array_equal(data_in_place, truth)
+
+        result = transforms.logicle_inverse(data_in_place, [1], t=10000, m=4.5, w=0.5, a=0, out=data_in_place)
+        self.assertIs(result, data_in_place)
+        np.testing.assert_array_almost_equal(data_in_place, data, decimal=10)
+
+    def test_transforms_out_buffer(self):
+        data = np.vstack([self.test_data_range, self.test_data_range + 1.0]).T
+        data_orig = data.copy()
+
+        xform_funcs = [
+            (transforms.asinh, {'t': 10000, 'm': 4.5, 'a': 0}),
+            (transforms.asinh_inverse, {'t': 10000, 'm': 4.5, 'a': 0}),
+            (transforms.log, {'t': 10000, 'm': 4.5}),
+            (transforms.log_inverse, {'t': 10000, 'm': 4.5}),
+            (transforms.hyperlog, {'t': 10000, 'm': 4.5, 'w': 0.5, 'a': 0}),
+            (transforms.hyperlog_inverse, {'t': 10000, 'm': 4.5, 'w': 0.5, 'a': 0})
+        ]
+
+        for xform_func, kwargs in xform_funcs:
+            out = np.empty_like(data)
+            with np.errstate(divide='ignore'):
+                truth = xform_func(data, [1], **kwargs)
+                result = xform_func(data, [1], out=out, **kwargs)
+
+            self.assertIs(result, out)
+            np.testing.assert_array_equal(out, truth)
+            np.testing.assert_array_equal(data, data_orig)
+
+    def test_transforms_out_wrong_shape(self):
+        data = self.test_data_range.reshape(-1, 1)
+        out = np.empty(data.shape[0])
+
+        self.assertRaises(ValueError, transforms.logicle, data, [0], out=out)
+        self.assertRaises(ValueError, transforms.asinh, data, [0], 10000, 4.5, 0, out=out)
+
+    def test_float32_transforms(self):
+        data = np.vstack([self.test_data_range - 500.0, self.test_data_range]).T
+        data_f32 = data.astype(np.float32)
+
+        for xform in [transforms.LogicleTransform(t=10000), transforms.HyperlogTransform(t=10000)]:
+            # float32 results should match the rounded float64 results for the same input
+            truth = xform.apply(data_f32.astype(np.float64)).astype(np.float32)
+            xform_data = xform.apply(data_f32)
+
+            self.assertEqual(xform_data.dtype, np.float32)
+            np.testing.assert_array_equal(xform_data, truth)
+
+            truth = xform.inverse(xform_data.astype(np.float64)).astype(np.float32)
+            x = xform.inverse(xform_data)
+
+            self.assertEqual(x.dtype, np.float32)
+            np.testing.assert_array_equal(x, truth)
+
+    def test_logicle_threaded(self):
+        rng = np.random.default_rng(42)
+        data = rng.normal(1000, 5000, size=(100000, 4))
+        truth = transforms.logicle(data, [0, 2, 3])
+
+        result = transforms.logicle(data, [0, 2, 3], n_threads=4)
+        np.testing.assert_array_equal(result, truth)
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            result = transforms.hyperlog(data, [1], executor=executor)
+        np.testing.assert_array_equal(result, transforms.hyperlog(data, [1]))
+
+    def test_transform_stats(self):
+        rng = np.random.default_rng(8)
+        data = rng.lognormal(mean=7.0, sigma=2.0, size=(30000, 4))
+        data -= rng.normal(loc=200.0, scale=300.0, size=(30000, 4))
+        data[0, 0] = -1e9  # below -1 on the Logicle scale
+        data[1, 0] = 1e9  # above 2
+
+        xform = transforms.LogicleTransform(t=262144, m=4.5, w=0.5, a=0)
+        stats = transforms.TransformStats(3, bins=128)
+        result = xform.apply(data, [0, 2, 3], stats=stats)
+
+        # the statistics accumulated in C match those of the transformed values
+        expected = transforms.TransformStats(3, bins=128)
+        expected.update(result, [0, 2, 3])
+        np.testing.assert_array_equal(stats.counts, expected.counts)
+        np.testing.assert_array_equal(stats.extrema, expected.extrema)
+
+        transformed = result[:, [0, 2, 3]]
+        for i in range(3):
+            values = transformed[:, i][~np.isnan(transformed[:, i])]
+            np.testing.assert_array_equal(stats.histogram[i], np.histogram(values, bins=128, range=(0, 1))[0])
+            self.assertEqual(stats.below[i], np.count_nonzero(values < 0))
+            self.assertEqual(stats.above[i], np.count_nonzero(values > 1))
+            self.assertEqual(stats.count[i], len(values))
+            self.assertEqual(stats.min[i], values.min())
+            self.assertEqual(stats.max[i], values.max())
+
+            q = [0.0, 0.01, 0.25, 0.5, 0.9, 1.0]
+            np.testing.assert_allclose(stats.quantile(q)[i], np.quantile(values, q), atol=1.0 / 128)
+        self.assertEqual(stats.quantile(0.5).shape, (3,))
+
+        # chunks transformed in parallel threads, or separately & merged, give the same statistics
+        threaded_stats = transforms.TransformStats(3, bins=128)
+        xform.apply(data, [0, 2, 3], n_threads=3, stats=threaded_stats)
+        np.testing.assert_array_equal(threaded_stats.counts, stats.counts)
+
+        merged_stats = transforms.TransformStats(3, bins=128)
+        for start in range(0, len(data), 7000):
+            chunk_stats = transforms.TransformStats(3, bins=128)
+            transforms.logicle(data[start:start + 7000], [0, 2, 3], stats=chunk_stats)
+            merged_stats.merge(chunk_stats)
+        np.testing.assert_array_equal(merged_stats.counts, stats.counts)
+        np.testing.assert_array_equal(merged_stats.extrema, stats.extrema)
+
+        # float32 & 1-D data, and the hyperlog transform
+        data_32 = data.astype(np.float32)
+        stats_32 = transforms.TransformStats(1, bins=64)
+        result_32 = transforms.hyperlog(data_32[:, 1], None, stats=stats_32)
+        expected = transforms.TransformStats(1, bins=64)
+        expected.update(result_32)
+        np.testing.assert_array_equal(stats_32.counts, expected.counts)
+        np.testing.assert_array_equal(stats_32.extrema, expected.extrema)
+
+        # NaN values are counted separately, and a channel without values has NaN statistics
+        nan_stats = transforms.TransformStats(2)
+        nan_stats.update(np.array([[np.nan, np.nan], [0.5, np.nan]]))
+        np.testing.assert_array_equal(nan_stats.nan_count, [1, 2])
+        np.testing.assert_array_equal(nan_stats.count, [1, 0])
+        np.testing.assert_array_equal(nan_stats.min, [0.5, np.nan])
+        np.testing.assert_array_equal(nan_stats.quantile(0.5), [0.5, np.nan])
+
+        empty_stats = transforms.TransformStats(1)
+        xform.apply(np.empty(0), stats=empty_stats)
+        self.assertEqual(empty_stats.count[0], 0)
+
+        self.assertRaises(ValueError, xform.apply, data, [0, 1], stats=stats)
+        self.assertRaises(ValueError, stats.merge, transforms.TransformStats(3, bins=64))
+        self.assertRaises(ValueError, stats.quantile, 1.5)
+        self.assertRaises(ValueError, transforms.TransformStats, 2, bins=0)
+
+    def test_estimate_logicle_params(self):
+        rng = np.random.default_rng(5)
+        data = rng.lognormal(mean=7.0, sigma=2.0, size=(50000, 4))
+        data[:, :3] -= rng.normal(loc=200.0, scale=300.0, size=(50000, 3))
+        data[10, 0] = np.nan
+
+        params = transforms.estimate_logicle_params(data, [0, 1, 3], chunk_size=7000)
+        self.assertEqual(len(params), 3)
+
+        for channel_params, i in zip(params, [0, 1, 3]):
+            channel = data[:, i]
+            self.assertEqual(channel_params['t'], np.nanmax(channel))
+            self.assertEqual((channel_params['m'], channel_params['a']), (4.5, 0))
+
+            negatives = channel[channel < 0]
+            if len(negatives) == 0:
+                self.assertEqual(channel_params['w'], 0.0)
+                continue
+            r = np.quantile(negatives, 0.05)
+            w = np.clip((4.5 - np.log10(np.nanmax(channel) / abs(r))) / 2, 0, 2.25)
+            self.assertGreater(channel_params['w'], 0.0)
+            self.assertAlmostEqual(channel_params['w'], w, delta=2.5e-4)
+
+        # a stream of blocks (e.g. a memmap read in chunks) gives the same parameters
+        blocks = (data[start:start + 999] for start in range(0, len(data), 999))
+        self.assertEqual(transforms.estimate_logicle_params(blocks, [0, 1, 3]), params)
+
+        # a fixed T, and the parameters can be passed straight to the transform
+        params = transforms.estimate_logicle_params(data[:, 1], t=262144, m=4.5, a=1)
+        self.assertEqual(params[0]['t'], 262144)
+        self.assertEqual(params[0]['a'], 1)
+        xform = transforms.LogicleTransform(**params[0])
+        np.testing.assert_array_equal(
+            xform.apply(data, [1]), transforms.logicle(data, [1], **params[0])
+        )
+
+        self.assertRaises(ValueError, transforms.estimate_logicle_params, data, q=1.5)
+        self.assertRaises(ValueError, transforms.estimate_logicle_params, data[:0])
+        self.assertRaises(ValueError, transforms.estimate_logicle_params, -np.abs(data))
+
+    @unittest.skipIf(sys.platform == 'win32', "requires sparse file support for memory-mapped arrays")
+    def test_logicle_large_memmap_offsets(self):
+        # A sparse memory-mapped file with 2^32 float32 elements (16 GB on disk,
+        # though only the few pages touched here are ever allocated). The strided
+        # views below have byte offsets well beyond the range of a 32-bit int.
+        xform = transforms.LogicleTransform(t=10000)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mm = np.memmap(os.path.join(tmp_dir, 'events.dat'), dtype=np.float32, mode='w+', shape=(2 ** 32,))
+
+            # 1-D view with a stride of 2^31 bytes
+            view = mm[::2 ** 29]
+            view[:] = np.arange(len(view)) * 1000.
+            truth = xform.apply(view.astype(np.float64)).astype(np.float32)
+            xform.apply(view, out=view)
+            np.testing.assert_array_equal(view, truth)
+
+            # 2-D view with a row stride of 2^32 bytes, transforming the first & last columns
+            events = mm.reshape(4, 2 ** 30)
+            events[:, 0] = [-100., 0., 100., 1000.]
+            events[:, -1] = [1., 10., 100., 5000.]
+            truth = xform.apply(np.array(events[:, [0, -1]], dtype=np.float64)).astype(np.float32)
+            xform.apply(events, [0, 2 ** 30 - 1], out=events)
+            np.testing.assert_array_equal(events[:, [0, -1]], truth)
+
+            del view, events, mm